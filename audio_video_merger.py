@@ -9,6 +9,8 @@ import logging
 import time
 from pathlib import Path
 
+from media_pipeline import finalize_video
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -23,7 +25,7 @@ class AudioVideoMerger:
         合并视频和音频文件
         
         Args:
-            video_path (str): 视频文件路径
+            video_path (str | list): 视频文件路径，或按播放顺序排列的分段视频列表
             audio_path (str): 音频文件路径
             output_name (str): 输出文件名（可选）
         
@@ -32,8 +34,10 @@ class AudioVideoMerger:
         """
         try:
             # 检查输入文件是否存在
-            if not os.path.exists(video_path):
-                raise FileNotFoundError(f"视频文件不存在: {video_path}")
+            segments = [video_path] if isinstance(video_path, (str, Path)) else list(video_path)
+            for segment in segments:
+                if not os.path.exists(segment):
+                    raise FileNotFoundError(f"视频文件不存在: {segment}")
             
             if not os.path.exists(audio_path):
                 raise FileNotFoundError(f"音频文件不存在: {audio_path}")
@@ -50,27 +54,13 @@ class AudioVideoMerger:
             logger.info(f"🎵 音频文件: {audio_path}")
             logger.info(f"📁 输出文件: {output_path}")
             
-            # 使用ffmpeg合并音频和视频
-            cmd = [
-                'ffmpeg', '-y',  # 覆盖输出文件
-                '-i', video_path,  # 输入视频
-                '-i', audio_path,  # 输入音频
-                '-c:v', 'copy',  # 复制视频流（不重新编码）
-                '-c:a', 'aac',  # 音频编码为AAC
-                '-shortest',  # 以最短的流为准
-                '-map', '0:v:0',  # 映射第一个输入的视频流
-                '-map', '1:a:0',  # 映射第二个输入的音频流
-                output_path
-            ]
-            
-            logger.info(f"🔧 执行ffmpeg命令: {' '.join(cmd)}")
-            
-            # 执行ffmpeg命令
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-            
-            if result.returncode != 0:
-                logger.error(f"❌ ffmpeg合并失败: {result.stderr}")
-                raise Exception(f"ffmpeg合并失败: {result.stderr}")
+            # 一次ffmpeg完成分段拼接、混音和封装，视频流直接复制
+            try:
+                mode = finalize_video(segments, output_path, audio_path=audio_path)
+            except RuntimeError as e:
+                logger.error(f"❌ ffmpeg合并失败: {e}")
+                raise Exception(f"ffmpeg合并失败: {e}")
+            logger.info(f"🔧 合并方式: {mode}")
             
             # 检查输出文件是否生成
             if not os.path.exists(output_path):
@@ -11,11 +11,15 @@ import time
 import http.server
 import socketserver
 from pathlib import Path
-import shutil
 import re
 import hashlib
 import traceback
 
+import process_tree
+import render_metrics
+from media_pipeline import publish_faststart
+from storage_manager import get_storage_manager
+
 # Configuration
 PORT = 5001
 BASE_DIR = Path('/mnt/d/ai/VideoTutor')
@@ -60,13 +64,18 @@ class EnhancedManimHandler(http.server.BaseHTTPRequestHandler):
                 
                 # Generate script if not provided
                 if not script_content or len(script_content) < 100:
-                    script_content = self.generate_safe_manim_script(question, solution)
+                    with render_metrics.stage('script_generation'):
+                        script_content = self.generate_safe_manim_script(question, solution)
                 
                 # Execute Manim with enhanced error handling
-                success, video_path, message = self.execute_manim_safe(
-                    script_content, 
-                    output_name
-                )
+                with render_metrics.in_flight():
+                    success, video_path, message = self.execute_manim_safe(
+                        script_content, 
+                        output_name
+                    )
+                render_metrics.record_request('success' if success else 'failed')
+                if not success:
+                    render_metrics.record_failure(message)
                 
                 response = {
                     'success': success,
@@ -92,6 +101,8 @@ class EnhancedManimHandler(http.server.BaseHTTPRequestHandler):
             except Exception as e:
                 print(f"❌ Request Error: {str(e)}")
                 traceback.print_exc()
+                render_metrics.record_request('failed')
+                render_metrics.record_failure(e)
                 self.send_json_response({
                     'success': False,
                     'video_path': None,
@@ -171,13 +182,14 @@ class MathScene(Scene):
             print(f"   Scene: {scene_name}")
             print(f"   Command: {' '.join(cmd)}")
             
-            # Run with timeout
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=60
-            )
+            # Run with timeout; the whole process tree is killed when it expires
+            with render_metrics.stage('manim'):
+                result = process_tree.run(
+                    cmd,
+                    capture_output=True,
+                    text=True,
+                    timeout=60
+                )
             
             print(f"📊 Return code: {result.returncode}")
             
@@ -229,10 +241,10 @@ class MathScene(Scene):
                 for video_file in Path(search_dir).glob(f'{scene_name}.mp4'):
                     print(f"✅ Found video: {video_file}")
                     
-                    # Copy to public directory
+                    # Publish to the public directory as a fast-start mp4
                     output_name = f'manim_{int(time.time())}_{script_hash}.mp4'
                     output_path = RENDERED_VIDEOS_DIR / output_name
-                    shutil.copy2(video_file, output_path)
+                    publish_faststart(video_file, output_path)
                     print(f"✅ Video copied to: {output_path}")
                     
                     return f'/rendered_videos/{output_name}'
@@ -241,7 +253,9 @@ class MathScene(Scene):
         return None
     
     def do_GET(self):
-        if self.path == '/health':
+        if self.path == '/metrics':
+            render_metrics.send_metrics(self)
+        elif self.path == '/health':
             self.send_json_response({
                 'status': 'healthy',
                 'service': 'enhanced-manim-server',
@@ -261,6 +275,7 @@ class MathScene(Scene):
 
 if __name__ == '__main__':
     os.chdir(str(BASE_DIR))
+    get_storage_manager().start()
     
     print(f"🚀 Enhanced Manim Video Server starting on port {PORT}...")
     print(f"📡 Health check: http://localhost:{PORT}/health")
@@ -1,50 +1,204 @@
 import os
 import subprocess
 import logging
-from flask import Flask, request, send_from_directory, jsonify
+from flask import Flask, Response, request, send_from_directory, jsonify
 from flask_cors import CORS
 import glob
+import hashlib
 import time
 import subprocess
 import os
 
+import process_tree
+import render_metrics
+import render_profiles
+import resource_ledger
+from manim_workers import get_worker_pool, render_scene
+from section_render import render_in_sections
+from media_pipeline import finalize_video, manim_segment_order, publish_faststart
+from segment_cache import SegmentCache
+from storage_manager import get_storage_manager
+from video_serving import cache_max_age, file_etag
+
 app = Flask(__name__)
 CORS(app)
 OUTPUT_DIR = "rendered_videos"
+# 单个场景并行分段渲染的最大段数，0表示关闭
+PARALLEL_SECTIONS = int(os.environ.get('MANIM_PARALLEL_SECTIONS', 0))
+# 跨请求共享的动画分段缓存（常驻进程内按动画哈希复用）
+SEGMENT_CACHE = SegmentCache()
+# 默认渲染档位（请求可用profile字段指定preview/standard/final）
+DEFAULT_PROFILE = os.environ.get('RENDER_PROFILE', 'final')
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def assemble_video(output_name, scene_name, output_video_path, manim_output=None, audio_path=None):
+    """把渲染结果放到output_video_path，返回(分辨率目录, 分段数, 合成方式)
+
+    Manim已经合成好的成片直接使用；找不到成片时才拼接分段，
+    分段编码参数一致时无损拼接，否则重新编码。
+    提供audio_path时，拼接、混入音频和封装在同一次ffmpeg中完成，不产生无声中间文件
+    """
+    if not manim_output:
+        candidates = glob.glob(os.path.join("media", "videos", output_name, "*", f"{output_name}.mp4"))
+        manim_output = candidates[0] if candidates else None
+    if manim_output and os.path.exists(manim_output):
+        if audio_path:
+            mode = finalize_video(manim_output, output_video_path, audio_path=audio_path)
+        else:
+            mode = publish_faststart(manim_output, output_video_path)
+        movie_dir = os.path.dirname(manim_output)
+        segment_count = len(glob.glob(os.path.join(movie_dir, "partial_movie_files", scene_name, "*.mp4")))
+        logger.info(f"✅ 直接使用Manim合成的成片: {manim_output}")
+        return os.path.basename(movie_dir), segment_count, 'manim_output' if mode == 'single' else mode
+
+    # 优化：自动降级查找实际存在的分辨率目录
+    possible_resolutions = [
+        "1080p30", "1080p60", "720p30", "2160p60"  # 优先1080p30，因为Manim默认生成这个
+    ]
+    part_dir = None
+    actual_resolution = None
+    for res in possible_resolutions:
+        dir_path = os.path.join("media", "videos", output_name, res, "partial_movie_files", scene_name)
+        if os.path.exists(dir_path):
+            part_dir = dir_path
+            actual_resolution = res
+            logger.info(f"✅ 找到分段视频目录: {part_dir}")
+            break
+
+    if not part_dir:
+        logger.error(f"❌ 未找到分段视频目录，尝试过的路径: {[os.path.join('media', 'videos', output_name, r, 'partial_movie_files', scene_name) for r in possible_resolutions]}")
+        # 输出media/videos/output_name下所有目录
+        media_videos_dir = os.path.join("media", "videos", output_name)
+        if os.path.exists(media_videos_dir):
+            logger.info(f"📁 media/videos目录存在: {media_videos_dir}")
+            # 列出该目录下的所有子目录和文件
+            subdirs = [d for d in os.listdir(media_videos_dir) if os.path.isdir(os.path.join(media_videos_dir, d))]
+            files = [f for f in os.listdir(media_videos_dir) if os.path.isfile(os.path.join(media_videos_dir, f))]
+            logger.info(f"📂 找到的子目录: {subdirs}")
+            logger.info(f"📄 找到的文件: {files}")
+            # 尝试查找任何包含partial_movie_files的目录
+            for subdir in subdirs:
+                partial_dir = os.path.join(media_videos_dir, subdir, "partial_movie_files", scene_name)
+                if os.path.exists(partial_dir):
+                    part_dir = partial_dir
+                    actual_resolution = subdir
+                    logger.info(f"🔍 通过备用方法找到分段视频目录: {part_dir}")
+                    break
+        if not part_dir:
+            raise Exception(f"无法找到分段视频目录，请检查Manim渲染是否成功")
+
+    # 按Manim记录的播放顺序拼接分段（文件名是哈希，按名称排序会打乱顺序）
+    segments = manim_segment_order(part_dir)
+    if not segments:
+        raise Exception(f"分段视频目录中没有找到mp4文件: {part_dir}")
+
+    logger.info(f"📹 找到 {len(segments)} 个分段视频文件")
+    mode = finalize_video(segments, output_video_path, audio_path=audio_path)
+    logger.info(f"🎬 分段合成方式: {'无损拼接' if mode == 'copy' else '重新编码'}")
+
+    return actual_resolution, len(segments), mode
+
 @app.route('/api/manim_render', methods=['POST'])
 def manim_render():
+    """渲染请求，同时记录渲染结果和失败原因指标，以及每个Manim/ffmpeg子进程的资源消耗"""
+    data = request.json or {}
+    with render_metrics.in_flight(), resource_ledger.render_context(
+        script_hash=hashlib.md5((data.get('script') or '').encode()).hexdigest()[:8],
+        question_type=data.get('question_type') or resource_ledger.question_type(data.get('question')),
+        quality=render_profiles.resolve(data.get('profile'), default=DEFAULT_PROFILE).name
+    ):
+        response, status = render_request()
+    if status == 200:
+        render_metrics.record_request('success')
+    else:
+        render_metrics.record_request('failed')
+        render_metrics.record_failure((response.get_json() or {}).get('error'))
+    return response, status
+
+def render_request():
     data = request.json
     script = data.get('script')
     output_name = data.get('output_name', 'output')
     scene_name = data.get('scene_name', 'MyScene')
+    sections = int(data.get('parallel_sections', PARALLEL_SECTIONS) or 0)
+    audio_path = data.get('audio_path')
+    profile = render_profiles.resolve(data.get('profile'), default=DEFAULT_PROFILE)
+    if audio_path and not os.path.exists(audio_path):
+        logger.warning(f"⚠️ 音频文件不存在，输出无声视频: {audio_path}")
+        audio_path = None
 
     if not script:
         return jsonify({'success': False, 'error': 'Missing script'}), 400
 
     logger.info(f"开始渲染视频: {output_name}, 场景: {scene_name}")
 
-    # 保存脚本
+    # 保存脚本，末尾追加渲染档位设置，覆盖脚本自己写死的分辨率和帧率
     script_path = f"{output_name}.py"
     try:
         with open(script_path, 'w', encoding='utf-8') as f:
-            f.write(script)
+            f.write(render_profiles.enforce_script(script, profile))
         logger.info(f"脚本已保存: {script_path}")
     except Exception as e:
         logger.error(f"保存脚本失败: {e}")
         return jsonify({'success': False, 'error': f'保存脚本失败: {str(e)}'}), 500
 
-    # 渲染视频
+    # 渲染视频；有音频时直接输出带音频的成片
+    if audio_path:
+        output_video_path = os.path.join("rendered_videos", f"{output_name}_with_audio_{int(time.time() * 1000)}.mp4")
+    else:
+        output_video_path = os.path.join("rendered_videos", f"{output_name}.mp4")
+    sectioned = None
+    manim_output = None
+    segments_reused = 0
     try:
-        logger.info("开始执行manim渲染...")
-        result = subprocess.run([
-            "manim", script_path, scene_name, "-o", f"{output_name}.mp4", "-qh"
-        ], check=True, timeout=300, capture_output=True, text=True)
-        logger.info(f"Manim渲染成功: {result.stdout}")
+        if sections > 1:
+            # 按步骤拆分为多个片段并行渲染，再无损拼接
+            sectioned = render_in_sections(
+                script_path, scene_name, output_video_path, sections,
+                profile=profile, timeout=300, audio_path=audio_path
+            )
+            if sectioned is not None and sectioned['success']:
+                SEGMENT_CACHE.record_render(sectioned)
+                segments_reused = sectioned['segments_reused']
+                logger.info(f"✅ 并行分段渲染成功: {sectioned['sections']}段, 用时{sectioned['wall_time']:.1f}秒")
+            elif sectioned is not None:
+                logger.warning(f"⚠️ 并行分段渲染失败，改为整体渲染: {sectioned['error']}")
+                sectioned = None
+        if sectioned is None:
+            with render_metrics.stage('manim'):
+                logger.info("开始执行manim渲染...")
+                # 优先使用常驻Manim进程，不可用时回退到命令行
+                worker_result = render_scene(
+                    script_path, scene_name, profile=profile,
+                    output_file=f"{output_name}.mp4", timeout=300
+                )
+                if worker_result is not None:
+                    resource_ledger.record('manim', worker_result.get('usage', {}), worker_result.get('wall_time', 0),
+                                           output_path=worker_result.get('video_path'), worker=True,
+                                           returncode=0 if worker_result['success'] else 1)
+                    SEGMENT_CACHE.record_render(worker_result)
+                if worker_result is None:
+                    result = process_tree.run([
+                        "manim", script_path, scene_name, "-o", f"{output_name}.mp4", *profile.cli_args()
+                    ], timeout=300, capture_output=True, text=True)
+                    resource_ledger.record('manim', result.rusage, result.wall_time, returncode=result.returncode)
+                    result.check_returncode()
+                    logger.info(f"Manim渲染成功: {result.stdout}")
+                    segments_reused = (result.stdout + result.stderr).count('Using cached data')
+                    # 命令行渲染无法接入共享缓存，只把新分段发布出去供常驻进程复用
+                    for part_dir in glob.glob(os.path.join("media", "videos", output_name, "*", "partial_movie_files", scene_name)):
+                        SEGMENT_CACHE.collect(part_dir)
+                elif worker_result['success']:
+                    manim_output = worker_result['video_path']
+                    segments_reused = worker_result.get('segments_reused', 0)
+                    logger.info(f"Manim渲染成功(常驻进程 {worker_result['worker_pid']}): {manim_output}, "
+                                f"复用缓存分段 {segments_reused} 个, 新增 {worker_result.get('segments_stored', 0)} 个")
+                else:
+                    logger.error(f"Manim渲染失败: {worker_result['stderr']}")
+                    return jsonify({'success': False, 'error': f"Manim渲染失败: {worker_result['stderr']}"}), 500
     except subprocess.TimeoutExpired:
         logger.error("Manim渲染超时")
         return jsonify({'success': False, 'error': 'Manim渲染超时，请简化问题或稍后重试'}), 504
@@ -55,127 +209,38 @@ def manim_render():
         logger.error("Manim命令未找到，请确保已正确安装manim")
         return jsonify({'success': False, 'error': 'Manim未安装或未在PATH中'}), 500
 
-    # 自动查找分段mp4并合成
+    # 自动查找分段mp4，一次ffmpeg完成拼接、混音和封装
     try:
-        # 优化：自动降级查找实际存在的分辨率目录
-        possible_resolutions = [
-            "1080p30", "1080p60", "720p30", "2160p60"  # 优先1080p30，因为Manim默认生成这个
-        ]
-        part_dir = None
-        actual_resolution = None
-        for res in possible_resolutions:
-            dir_path = os.path.join("media", "videos", output_name, res, "partial_movie_files", scene_name)
-            if os.path.exists(dir_path):
-                part_dir = dir_path
-                actual_resolution = res
-                logger.info(f"✅ 找到分段视频目录: {part_dir}")
-                break
-        
-        if not part_dir:
-            logger.error(f"❌ 未找到分段视频目录，尝试过的路径: {[os.path.join('media', 'videos', output_name, r, 'partial_movie_files', scene_name) for r in possible_resolutions]}")
-            # 输出media/videos/output_name下所有目录
-            media_videos_dir = os.path.join("media", "videos", output_name)
-            if os.path.exists(media_videos_dir):
-                logger.info(f"📁 media/videos目录存在: {media_videos_dir}")
-                # 列出该目录下的所有子目录和文件
-                subdirs = [d for d in os.listdir(media_videos_dir) if os.path.isdir(os.path.join(media_videos_dir, d))]
-                files = [f for f in os.listdir(media_videos_dir) if os.path.isfile(os.path.join(media_videos_dir, f))]
-                logger.info(f"📂 找到的子目录: {subdirs}")
-                logger.info(f"📄 找到的文件: {files}")
-                # 尝试查找任何包含partial_movie_files的目录
-                for subdir in subdirs:
-                    partial_dir = os.path.join(media_videos_dir, subdir, "partial_movie_files", scene_name)
-                    if os.path.exists(partial_dir):
-                        part_dir = partial_dir
-                        actual_resolution = subdir
-                        logger.info(f"🔍 通过备用方法找到分段视频目录: {part_dir}")
-                        break
-            raise Exception(f"无法找到分段视频目录，请检查Manim渲染是否成功")
-        
-        # 查找分段mp4文件
-        mp4_files = [f for f in os.listdir(part_dir) if f.endswith('.mp4') and not f.startswith('filelist')]
-        if not mp4_files:
-            raise Exception(f"分段视频目录中没有找到mp4文件: {part_dir}")
-        
-        logger.info(f"📹 找到 {len(mp4_files)} 个分段视频文件")
-        
-        # 创建filelist.txt，确保按正确顺序合成
-        filelist_path = os.path.join(part_dir, "filelist.txt")
-        with open(filelist_path, 'w', encoding='utf-8') as f:
-            for mp4_file in sorted(mp4_files):  # 按文件名排序确保顺序
-                f.write(f"file '{mp4_file}'\n")
-        
-        logger.info(f"📝 已创建filelist.txt: {filelist_path}")
-        
-        # 执行ffmpeg合成
-        output_video_path = os.path.join("rendered_videos", f"{output_name}.mp4")
-        ffmpeg_cmd = f'ffmpeg -y -f concat -safe 0 -i "{filelist_path}" -r 30 -c:v libx264 -pix_fmt yuv420p "{output_video_path}"'
-        
-        logger.info(f"🎬 执行ffmpeg合成: {ffmpeg_cmd}")
-        
-        # 执行ffmpeg命令
-        result = subprocess.run(ffmpeg_cmd, shell=True, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            logger.error(f"❌ ffmpeg合成失败: {result.stderr}")
-            raise Exception(f"ffmpeg合成失败: {result.stderr}")
+        if sectioned is not None:
+            actual_resolution, segment_count, concat_mode = profile.directory_name, sectioned['sections'], sectioned['concat']
+        else:
+            try:
+                actual_resolution, segment_count, concat_mode = assemble_video(
+                    output_name, scene_name, output_video_path, manim_output, audio_path
+                )
+            except RuntimeError as e:
+                if not audio_path:
+                    raise
+                logger.warning(f"⚠️ 音频合并失败，输出无声视频: {e}")
+                audio_path = None
+                output_video_path = os.path.join("rendered_videos", f"{output_name}.mp4")
+                actual_resolution, segment_count, concat_mode = assemble_video(
+                    output_name, scene_name, output_video_path, manim_output
+                )
         
         logger.info(f"✅ 视频合成成功: {output_video_path}")
         
-        # 尝试合并音频（如果提供了音频文件）
-        audio_path = data.get('audio_path')
-        final_video_path = output_video_path
-        
-        if audio_path and os.path.exists(audio_path):
-            try:
-                logger.info(f"🎵 开始合并音频: {audio_path}")
-                
-                # 生成带音频的最终视频文件名
-                timestamp = int(time.time() * 1000)
-                final_output_name = f"{output_name}_with_audio_{timestamp}"
-                final_video_path = os.path.join("rendered_videos", f"{final_output_name}.mp4")
-                
-                # 使用ffmpeg合并音频和视频
-                merge_cmd = [
-                    'ffmpeg', '-y',
-                    '-i', output_video_path,
-                    '-i', audio_path,
-                    '-c:v', 'copy',
-                    '-c:a', 'aac',
-                    '-shortest',
-                    '-map', '0:v:0',
-                    '-map', '1:a:0',
-                    final_video_path
-                ]
-                
-                logger.info(f"🔧 执行音频合并命令: {' '.join(merge_cmd)}")
-                
-                merge_result = subprocess.run(merge_cmd, capture_output=True, text=True, timeout=300)
-                
-                if merge_result.returncode == 0 and os.path.exists(final_video_path):
-                    logger.info(f"✅ 音频合并成功: {final_video_path}")
-                    # 删除原始无音频视频文件
-                    try:
-                        os.remove(output_video_path)
-                        logger.info(f"🗑️ 已删除原始无音频视频: {output_video_path}")
-                    except:
-                        pass
-                else:
-                    logger.warning(f"⚠️ 音频合并失败，使用原始视频: {merge_result.stderr}")
-                    final_video_path = output_video_path
-                    
-            except Exception as e:
-                logger.warning(f"⚠️ 音频合并异常，使用原始视频: {str(e)}")
-                final_video_path = output_video_path
-        
         # 返回成功响应
         response_data = {
             'success': True,
             'message': '视频渲染和合成成功',
-            'video_path': final_video_path,
+            'video_path': output_video_path,
             'resolution': actual_resolution,
-            'segment_count': len(mp4_files),
-            'has_audio': audio_path and os.path.exists(audio_path)
+            'segment_count': segment_count,
+            'concat_mode': concat_mode,
+            'segments_reused': segments_reused,
+            'has_audio': bool(audio_path),
+            'profile': profile.to_dict()
         }
         
         return jsonify(response_data), 200
@@ -192,7 +257,12 @@ def manim_render():
 
 @app.route('/rendered_videos/<filename>')
 def serve_rendered_video(filename):
-    return send_from_directory('rendered_videos', filename)
+    # conditional=True gives Range/206 and ETag/If-None-Match handling; the
+    # ETag comes from the content (hashed at publish) so relinks and mtime changes don't invalidate it
+    path = os.path.join('rendered_videos', filename)
+    etag = file_etag(path).strip('"') if os.path.isfile(path) else True
+    return send_from_directory('rendered_videos', filename, conditional=True, etag=etag,
+                               max_age=cache_max_age(filename))
 
 @app.route('/api/merge_audio_video', methods=['POST'])
 def merge_audio_video():
@@ -219,43 +289,29 @@ def merge_audio_video():
         video_name = os.path.splitext(os.path.basename(video_path))[0]
         final_video_path = os.path.join("rendered_videos", f"{video_name}_with_audio_{timestamp}.mp4")
         
-        # 使用ffmpeg合并音频和视频
-        merge_cmd = [
-            'ffmpeg', '-y',
-            '-i', video_path,
-            '-i', audio_path,
-            '-c:v', 'copy',
-            '-c:a', 'aac',
-            '-shortest',
-            '-map', '0:v:0',
-            '-map', '1:a:0',
-            final_video_path
-        ]
-        
-        logger.info(f"🔧 执行音频合并命令: {' '.join(merge_cmd)}")
-        
-        merge_result = subprocess.run(merge_cmd, capture_output=True, text=True, timeout=300)
-        
-        if merge_result.returncode == 0 and os.path.exists(final_video_path):
-            logger.info(f"✅ 音频合并成功: {final_video_path}")
-            
-            # 检查文件大小
-            file_size = os.path.getsize(final_video_path)
-            logger.info(f"📊 最终视频文件大小: {file_size} 字节")
-            
-            return jsonify({
-                'success': True,
-                'message': '音频视频合并成功',
-                'final_video_path': final_video_path,
-                'file_size': file_size
-            }), 200
-        else:
-            logger.error(f"❌ 音频合并失败: {merge_result.stderr}")
+        # 视频流直接复制，一次ffmpeg完成混音和封装
+        try:
+            finalize_video(video_path, final_video_path, audio_path=audio_path)
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            logger.error(f"❌ 音频合并失败: {e}")
             return jsonify({
                 'success': False,
-                'error': f'音频合并失败: {merge_result.stderr}'
+                'error': f'音频合并失败: {e}'
             }), 500
-            
+
+        logger.info(f"✅ 音频合并成功: {final_video_path}")
+
+        # 检查文件大小
+        file_size = os.path.getsize(final_video_path)
+        logger.info(f"📊 最终视频文件大小: {file_size} 字节")
+
+        return jsonify({
+            'success': True,
+            'message': '音频视频合并成功',
+            'final_video_path': final_video_path,
+            'file_size': file_size
+        }), 200
+
     except Exception as e:
         logger.error(f"❌ 音频合并异常: {str(e)}")
         return jsonify({
@@ -263,12 +319,24 @@ def merge_audio_video():
             'error': f'音频合并异常: {str(e)}'
         }), 500
 
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics.exposition(), mimetype=render_metrics.CONTENT_TYPE)
+
 @app.route('/health')
 def health_check():
-    return jsonify({'status': 'healthy', 'service': 'manim-api-server'})
+    return jsonify({
+        'status': 'healthy',
+        'service': 'manim-api-server',
+        'segment_cache': SEGMENT_CACHE.stats(),
+        'storage': get_storage_manager().stats(),
+    })
 
 if __name__ == '__main__':
     if not os.path.exists(OUTPUT_DIR):
         os.makedirs(OUTPUT_DIR)
     logger.info(f"启动Manim API服务器，输出目录: {OUTPUT_DIR}")
+    # 启动时预热常驻Manim进程，并启动存储清理线程
+    get_worker_pool()
+    get_storage_manager().start()
     app.run(host='0.0.0.0', port=5001) 
\ No newline at end of file
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Persistent Manim Worker Processes
+Long-lived processes that import Manim once and render generated scene
+modules in-process, so requests stop paying the interpreter + manim/numpy/
+cairo/pango import and font discovery cost of `python -m manim` per render.
+
+Servers call render_scene(); it returns None when the pool is disabled
+(MANIM_WORKER_PROCESSES=0), Manim can't be imported or every worker stays
+busy for MANIM_WORKER_ACQUIRE_TIMEOUT, and the caller falls back to the CLI.
+"""
+
+import importlib.util
+import logging
+import multiprocessing
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from pathlib import Path
+
+import render_metrics
+import render_profiles
+import resource_ledger
+from process_tree import kill_tree
+
+MANIM_WORKER_PROCESSES = int(os.environ.get('MANIM_WORKER_PROCESSES', 2))
+MANIM_WORKER_MAX_JOBS = int(os.environ.get('MANIM_WORKER_MAX_JOBS', 50))
+MANIM_WORKER_MAX_RSS_MB = int(os.environ.get('MANIM_WORKER_MAX_RSS_MB', 2048))
+MANIM_WORKER_STARTUP_TIMEOUT = 120
+# How long a render waits for a busy pool before the caller falls back to the CLI
+MANIM_WORKER_ACQUIRE_TIMEOUT = float(os.environ.get('MANIM_WORKER_ACQUIRE_TIMEOUT', 10))
+
+# Shared tex and partial movie segment caches, installed in each worker process
+_tex_cache = None
+_segment_cache = None
+# Fixed scene modules (keep_module jobs) stay imported: script path -> (mtime_ns, module)
+_kept_modules = {}
+
+
+def _current_rss_mb():
+    """Resident set size of this process in MB (0 when the platform can't tell us)"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        return 0
+
+
+class _ProgressHandler(logging.Handler):
+    """Forwards Manim's 'Animation N : ...' log records to the parent process"""
+
+    def __init__(self, conn):
+        super().__init__(level=logging.INFO)
+        self.conn = conn
+
+    def emit(self, record):
+        message = record.getMessage()
+        if message.startswith('Animation '):
+            try:
+                index = int(message.split()[1])
+                self.conn.send(('progress', index))
+            except (ValueError, IndexError, OSError):
+                pass
+
+
+def _warm_up(tempconfig):
+    """Exercise text and font discovery once so the first real job doesn't pay for it"""
+    try:
+        from manim import Text
+        with tempfile.TemporaryDirectory() as warm_dir:
+            with tempconfig({'media_dir': warm_dir}):
+                Text('warmup')
+    except Exception as e:
+        print(f"⚠️ Manim worker warm-up skipped: {e}")
+
+
+def _count_animations(scene, config):
+    """Run construct() with every animation skipped, recording when each starts.
+
+    Used to plan parallel section renders; no frames are rendered or written.
+    """
+    config.write_to_movie = False
+    config.from_animation_number = 10 ** 9
+    renderer = scene.renderer
+    animation_times = []
+    section_starts = []
+    original_play = renderer.play
+    original_next_section = scene.next_section
+
+    def play(*args, **kwargs):
+        animation_times.append(renderer.time)
+        return original_play(*args, **kwargs)
+
+    def next_section(*args, **kwargs):
+        section_starts.append(len(animation_times))
+        return original_next_section(*args, **kwargs)
+
+    renderer.play = play
+    scene.next_section = next_section
+    scene.render()
+    return {
+        'success': True,
+        'animations': len(animation_times),
+        'animation_times': animation_times,
+        'section_starts': section_starts,
+        'total_time': renderer.time,
+    }
+
+
+def _apply_job_config(job, config, script_path):
+    from manim.constants import QUALITIES
+
+    quality = QUALITIES[job.get('quality', 'low_quality')]
+    config.input_file = str(script_path)
+    config.media_dir = str(job.get('media_dir') or 'media')
+    config.pixel_height = quality['pixel_height']
+    config.pixel_width = quality['pixel_width']
+    config.frame_rate = quality['frame_rate']
+    config.format = job.get('format', 'mp4')
+    config.write_to_movie = True
+    config.preview = False
+    config.output_file = job.get('output_file') or ''
+    for key, value in (job.get('config') or {}).items():
+        setattr(config, key, value)
+
+
+def _load_module(script_path, module_name, keep=False):
+    """Import the scene module; with keep, reuse it across jobs until the file changes"""
+    mtime = script_path.stat().st_mtime_ns
+    if keep and _kept_modules.get(str(script_path), (None,))[0] == mtime:
+        return _kept_modules[str(script_path)][1]
+    spec = importlib.util.spec_from_file_location(module_name, script_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    if keep:
+        _kept_modules[str(script_path)] = (mtime, module)
+    return module
+
+
+def _render_job(job, config):
+    """Load the scene module (fresh unless keep_module) and render it with job-specific config"""
+    script_path = Path(job['script_path']).resolve()
+    module_name = f"manim_job_{script_path.stem}"
+    original = config.copy()
+    environ = job.get('environ') or {}
+    original_environ = {key: os.environ.get(key) for key in environ}
+    try:
+        os.environ.update(environ)
+        _apply_job_config(job, config, script_path)
+        module = _load_module(script_path, module_name, keep=job.get('keep_module'))
+        # Generated scripts set config at import time; the job's settings win
+        _apply_job_config(job, config, script_path)
+
+        scene_cls = getattr(module, job['scene_name'], None)
+        if scene_cls is None:
+            return {
+                'success': False,
+                'error': f"NameError: scene {job['scene_name']} not found in {script_path.name}",
+                'stderr': f"NameError: name '{job['scene_name']}' is not defined",
+            }
+
+        scene = scene_cls()
+        if job.get('count_only'):
+            return _count_animations(scene, config)
+        caches = {name: cache for name, cache in (('tex', _tex_cache), ('segment', _segment_cache)) if cache}
+        before = {name: (cache.hits, cache.misses) for name, cache in caches.items()}
+        scene.render()
+        result = {
+            'success': True,
+            'video_path': str(scene.renderer.file_writer.movie_file_path),
+            'resolution': f'{config.pixel_width}x{config.pixel_height}',
+            'frame_rate': config.frame_rate,
+            'cache_lookups': {name: (cache.hits - before[name][0], cache.misses - before[name][1])
+                              for name, cache in caches.items()},
+        }
+        if _segment_cache is not None:
+            result['segments_reused'], result['segment_misses'] = result['cache_lookups']['segment']
+            result['segments_stored'] = _segment_cache.collect(
+                getattr(scene.renderer.file_writer, 'partial_movie_directory', '')
+            )
+        return result
+    except Exception as e:
+        return {
+            'success': False,
+            'error': f'{type(e).__name__}: {e}',
+            'stderr': traceback.format_exc(),
+        }
+    finally:
+        if not job.get('keep_module'):
+            sys.modules.pop(module_name, None)
+        for key, value in original_environ.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        config.update(original)
+
+
+def _worker_main(conn):
+    """Entry point of a worker process: import Manim once, then serve jobs forever"""
+    if hasattr(os, 'setsid'):
+        # Lead a process group so a kill also takes latex/dvisvgm/ffmpeg children
+        os.setsid()
+    try:
+        import manim
+        from manim import config, tempconfig
+    except Exception as e:
+        conn.send(('unavailable', f'{type(e).__name__}: {e}'))
+        conn.close()
+        return
+
+    global _tex_cache, _segment_cache
+    try:
+        from tex_cache import TexSvgCache, install_manim_hook
+        cache = TexSvgCache()
+        install_manim_hook(cache)
+        _tex_cache = cache
+    except Exception as e:
+        print(f"⚠️ Shared tex cache disabled in Manim worker: {e}")
+
+    try:
+        from segment_cache import SegmentCache, install_manim_hook as install_segment_hook
+        cache = SegmentCache()
+        install_segment_hook(cache)
+        _segment_cache = cache
+    except Exception as e:
+        print(f"⚠️ Shared segment cache disabled in Manim worker: {e}")
+
+    _warm_up(tempconfig)
+    logging.getLogger('manim').addHandler(_ProgressHandler(conn))
+    conn.send(('ready', {'pid': os.getpid(), 'manim_version': manim.__version__}))
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+        started = time.time()
+        usage_before = resource_ledger.usage_snapshot()
+        result = _render_job(job, config)
+        result['wall_time'] = time.time() - started
+        result['usage'] = resource_ledger.usage_since(usage_before)
+        result['rss_mb'] = _current_rss_mb()
+        result['worker_pid'] = os.getpid()
+        conn.send(('result', result))
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.ready = False
+        self.info = None
+
+    def wait_ready(self, timeout):
+        """True once the worker has imported Manim; False if it can't"""
+        if self.ready:
+            return True
+        if not self.conn.poll(timeout):
+            return False
+        try:
+            kind, info = self.conn.recv()
+        except EOFError:
+            return False
+        self.info = info
+        self.ready = kind == 'ready'
+        return self.ready
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(2)
+        if self.process.is_alive():
+            self.kill()
+
+    def kill(self):
+        kill_tree(self.process.pid)
+        self.process.kill()
+        self.process.join(2)
+        self.conn.close()
+
+
+class ManimWorkerPool:
+    """Fixed set of pre-warmed Manim processes.
+
+    A worker is recycled after max_jobs renders or once its RSS grows past
+    max_rss_mb; one that crashes or times out is killed and replaced.
+    """
+
+    def __init__(self, size=MANIM_WORKER_PROCESSES, max_jobs=MANIM_WORKER_MAX_JOBS,
+                 max_rss_mb=MANIM_WORKER_MAX_RSS_MB):
+        self.size = max(1, int(size))
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.available = True
+        self.unavailable_reason = None
+        self._ctx = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._counters = {'renders': 0, 'recycled': 0, 'crashed': 0, 'timeouts': 0, 'cancelled': 0, 'busy': 0}
+        for _ in range(self.size):
+            self._idle.put(_Worker(self._ctx))
+
+    def _replace(self, worker, reason):
+        with self._lock:
+            self._counters[reason] += 1
+        if reason == 'recycled':
+            worker.stop()
+        else:
+            worker.kill()
+        return _Worker(self._ctx)
+
+    def render(self, script_path, scene_name, quality='low_quality', media_dir=None,
+               output_file=None, fmt='mp4', config=None, timeout=60, on_progress=None,
+               cancel_event=None, count_only=False, profile=None, environ=None, keep_module=False):
+        """Render scene_name from script_path on an idle worker.
+
+        Returns a result dict, or None if Manim is unavailable in the workers
+        or no worker frees up within MANIM_WORKER_ACQUIRE_TIMEOUT. Raises
+        subprocess.TimeoutExpired when waiting plus rendering exceeds timeout.
+        Setting cancel_event kills the worker mid-render. count_only runs the
+        scene without rendering and reports its animation timeline instead.
+        A render profile (name or RenderProfile) replaces quality. environ is
+        set in the worker for the job only; keep_module keeps a fixed scene
+        module imported between jobs instead of re-executing it.
+        """
+        if not self.available:
+            return None
+        if profile is not None:
+            profile = render_profiles.resolve(profile)
+            quality = profile.quality
+            config = {**profile.config(), **(config or {})}
+
+        deadline = time.time() + timeout
+        try:
+            worker = self._idle.get(timeout=min(timeout, MANIM_WORKER_ACQUIRE_TIMEOUT))
+        except queue.Empty:
+            with self._lock:
+                self._counters['busy'] += 1
+            print(f"⚠️ All {self.size} Manim workers busy, rendering {scene_name} with the CLI")
+            return None
+        try:
+            if not worker.wait_ready(MANIM_WORKER_STARTUP_TIMEOUT):
+                self.available = False
+                self.unavailable_reason = worker.info or 'worker failed to start'
+                print(f"⚠️ Persistent Manim workers unavailable: {self.unavailable_reason}")
+                return None
+
+            worker.conn.send({
+                'script_path': str(script_path),
+                'scene_name': scene_name,
+                'quality': quality,
+                'media_dir': str(media_dir) if media_dir else None,
+                'output_file': output_file,
+                'format': fmt,
+                'config': config,
+                'count_only': count_only,
+                'environ': environ,
+                'keep_module': keep_module,
+            })
+
+            result = None
+            while result is None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    worker = self._replace(worker, 'timeouts')
+                    raise subprocess.TimeoutExpired(f'manim-worker {scene_name}', timeout)
+                if cancel_event is not None and cancel_event.is_set():
+                    worker = self._replace(worker, 'cancelled')
+                    return {'success': False, 'cancelled': True, 'error': 'Render cancelled', 'stderr': 'Render cancelled'}
+                try:
+                    if not worker.conn.poll(min(remaining, 0.25)):
+                        if not worker.process.is_alive():
+                            raise EOFError
+                        continue
+                    kind, payload = worker.conn.recv()
+                except (EOFError, OSError):
+                    worker.process.join(1)
+                    exitcode = worker.process.exitcode
+                    worker = self._replace(worker, 'crashed')
+                    return {
+                        'success': False,
+                        'error': f'Manim worker exited unexpectedly (exit code {exitcode})',
+                        'stderr': f'Manim worker process crashed with exit code {exitcode}',
+                    }
+                if kind == 'progress':
+                    if on_progress:
+                        on_progress(payload)
+                elif kind == 'result':
+                    result = payload
+
+            worker.jobs += 1
+            with self._lock:
+                self._counters['renders'] += 1
+            for cache, (hits, misses) in result.get('cache_lookups', {}).items():
+                render_metrics.record_cache_lookups(cache, hits, misses)
+            if worker.jobs >= self.max_jobs or result.get('rss_mb', 0) > self.max_rss_mb:
+                worker = self._replace(worker, 'recycled')
+            return result
+        finally:
+            self._idle.put(worker)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'processes': self.size,
+                'idle': self._idle.qsize(),
+                'available': self.available,
+                'unavailable_reason': self.unavailable_reason,
+                **self._counters,
+            }
+
+    def shutdown(self):
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool(size=None):
+    """Process-wide worker pool, created on first use; None when disabled"""
+    global _pool
+    if MANIM_WORKER_PROCESSES <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ManimWorkerPool(size=size or MANIM_WORKER_PROCESSES)
+        return _pool
+
+
+def worker_pool_stats():
+    """Stats of the pool if one has been started, else None; never spawns workers"""
+    pool = _pool
+    return pool.stats() if pool is not None else None
+
+
+def render_scene(script_path, scene_name, **kwargs):
+    """Render on the shared worker pool, or return None so the caller uses the CLI"""
+    pool = get_worker_pool()
+    if pool is None:
+        return None
+    return pool.render(script_path, scene_name, **kwargs)
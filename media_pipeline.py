@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Media Pipeline
+ffmpeg stages shared by the render servers. A render becomes a published
+video in a single ffmpeg pass: Manim's segments (or its finished movie) are
+concatenated, muxed with the narration audio and written to the final
+container at once, stream-copying whenever the codec parameters allow it.
+
+Every mp4 that pass writes is fast-start: the moov atom (the index a player
+needs before it can decode anything) comes before the media data, so
+playback starts after the first few kilobytes instead of after fetching the
+tail of the file.
+"""
+
+import json
+import struct
+import subprocess
+import tempfile
+from pathlib import Path
+
+import process_tree
+import render_metrics
+import resource_ledger
+from render_cache import link_or_copy
+from video_serving import remember_digest
+
+# Stream parameters that must match for the concat demuxer to copy packets
+COPY_COMPATIBLE_FIELDS = ('codec_name', 'profile', 'width', 'height', 'pix_fmt', 'r_frame_rate', 'time_base')
+# No -r: the output keeps the source frame rate, i.e. the render profile's
+REENCODE_ARGS = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p']
+FASTSTART_ARGS = ['-movflags', '+faststart']
+
+
+def probe_video(path, timeout=10):
+    """Codec parameters of the first video stream, or None if ffprobe can't tell"""
+    try:
+        result = subprocess.run([
+            'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'stream=' + ','.join(COPY_COMPATIBLE_FIELDS),
+            '-of', 'json', str(path)
+        ], capture_output=True, text=True, timeout=timeout)
+        streams = json.loads(result.stdout).get('streams') if result.returncode == 0 else None
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        return None
+    return streams[0] if streams else None
+
+
+def probe_duration(path, timeout=10):
+    """Container duration in seconds, or None if ffprobe can't tell"""
+    try:
+        result = subprocess.run([
+            'ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', str(path)
+        ], capture_output=True, text=True, timeout=timeout)
+        return round(float(result.stdout.strip()), 3) if result.returncode == 0 else None
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        return None
+
+
+def can_stream_copy(paths):
+    """True when every segment was encoded with identical stream parameters"""
+    params = [probe_video(path) for path in paths]
+    return all(params) and all(p == params[0] for p in params)
+
+
+def manim_segment_order(part_dir):
+    """Segment files in play order, from Manim's partial_movie_file_list.txt.
+
+    Segment names are animation hashes, so sorting them by name scrambles
+    the video; falls back to modification time when the list is missing.
+    """
+    part_dir = Path(part_dir)
+    listing = part_dir / 'partial_movie_file_list.txt'
+    if listing.exists():
+        segments = []
+        for line in listing.read_text(encoding='utf-8').splitlines():
+            line = line.strip()
+            if line.startswith('file '):
+                name = line[5:].strip().strip("'")
+                if name.startswith('file:'):
+                    name = name[5:]
+                segments.append(part_dir / Path(name).name)
+        if segments and all(segment.exists() for segment in segments):
+            return segments
+    return sorted(part_dir.glob('*.mp4'), key=lambda path: path.stat().st_mtime)
+
+
+def mp4_atoms(path):
+    """Top-level (type, offset, size) boxes of an mp4 file"""
+    atoms = []
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        file_size = f.tell()
+        offset = 0
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            size, kind = struct.unpack('>I4s', f.read(8))
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0]
+            elif size == 0:
+                size = file_size - offset
+            if size < 8:
+                break  # Corrupt box - stop rather than loop
+            atoms.append((kind.decode('latin-1'), offset, size))
+            offset += size
+    return atoms
+
+
+def is_faststart(path):
+    """True when the moov atom precedes the media data"""
+    try:
+        kinds = [kind for kind, _, _ in mp4_atoms(path)]
+    except (OSError, struct.error):
+        return False
+    return 'moov' in kinds and ('mdat' not in kinds or kinds.index('moov') < kinds.index('mdat'))
+
+
+def probe_audio_codec(path, timeout=10):
+    """Codec name of the first audio stream, or None"""
+    try:
+        result = subprocess.run([
+            'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+            '-show_entries', 'stream=codec_name', '-of', 'csv=p=0', str(path)
+        ], capture_output=True, text=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip() or None
+
+
+def finalize_video(segments, output_path, audio_path=None, timeout=300):
+    """Concatenate, mux audio and write the final container in one ffmpeg pass.
+
+    segments is one finished movie or a list of segment files in play order.
+    Video is stream-copied whenever the segments allow it; an AAC soundtrack
+    is copied too. The output is written fast-start beside output_path,
+    checked, and renamed into place, so a half-written or moov-last file is
+    never served.
+
+    Returns 'copy', 'reencode' or 'single' (one fast-start segment and no
+    audio: linked without running ffmpeg). Raises RuntimeError when ffmpeg
+    fails or its output doesn't verify.
+    """
+    if isinstance(segments, (str, Path)):
+        segments = [segments]
+    segments = [Path(segment) for segment in segments]
+    if not segments:
+        raise RuntimeError('No segments to finalize')
+    stage = 'mux' if audio_path else 'concat' if len(segments) > 1 else 'copy'
+    with render_metrics.stage(stage):
+        mode = _finalize(segments, Path(output_path), audio_path, timeout)
+    remember_digest(output_path)
+    return mode
+
+
+def _finalize(segments, output_path, audio_path, timeout):
+    if len(segments) == 1 and not audio_path and is_faststart(segments[0]):
+        link_or_copy(segments[0], output_path)
+        return 'single'
+
+    mode = 'copy' if len(segments) == 1 or can_stream_copy(segments) else 'reencode'
+    list_path = None
+    if len(segments) == 1:
+        cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-i', str(segments[0])]
+    else:
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8') as f:
+            for segment in segments:
+                f.write(f"file '{segment.resolve()}'\n")
+            list_path = f.name
+        cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path]
+
+    if audio_path:
+        audio_codec = 'copy' if probe_audio_codec(audio_path) == 'aac' else 'aac'
+        cmd += ['-i', str(audio_path), '-map', '0:v:0', '-map', '1:a:0', '-c:a', audio_codec, '-shortest']
+    cmd += ['-c:v', 'copy'] if mode == 'copy' else REENCODE_ARGS
+    cmd += FASTSTART_ARGS
+
+    tmp_path = output_path.with_name(f'.{output_path.stem}.partial{output_path.suffix}')
+    try:
+        result = process_tree.run(cmd + [str(tmp_path)], capture_output=True, text=True, timeout=timeout)
+        resource_ledger.record('ffmpeg', result.rusage, result.wall_time, output_path=tmp_path, mode=mode,
+                               segments=len(segments), has_audio=bool(audio_path))
+        if result.returncode != 0:
+            raise RuntimeError(f'ffmpeg finalize ({mode}) failed: {result.stderr[-500:]}')
+        if not is_faststart(tmp_path):
+            raise RuntimeError(f'ffmpeg finalize ({mode}) wrote no fast-start mp4 for {output_path.name}')
+        tmp_path.replace(output_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+        if list_path:
+            Path(list_path).unlink(missing_ok=True)
+    return mode
+
+
+def publish_faststart(movie, output_path, timeout=300):
+    """finalize_video for one finished movie; publishes it unchanged when ffmpeg can't run"""
+    try:
+        return finalize_video(movie, output_path, timeout=timeout)
+    except (RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+        print(f"⚠️ Fast-start finalize failed, publishing {Path(movie).name} as is: {e}")
+        link_or_copy(movie, output_path)
+        remember_digest(output_path)
+        return 'unchanged'
@@ -54,6 +54,8 @@ class {scene_name}(Scene):
         step_count = min(len({repr(cleaned_steps)}), 6)  # 限制最多6步
         
         for i, step_text in enumerate({repr(cleaned_steps)}[:step_count]):
+            # 每一步是独立的片段，可并行渲染
+            self.next_section(f"step_{{i+1}}")
             try:
                 # 创建步骤文本
                 step_num = Text(f"步骤 {{i+1}}", font_size=24, color=RED)
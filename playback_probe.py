@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Playback Start Probe
+Local test client that measures time-to-first-frame of a served mp4 the way
+a progressive player fetches it: read the head of the file, find the moov
+atom (seeking to the tail with a Range request when the media data comes
+first, or reading through everything when the server can't do ranges), then
+fetch the start of the media data.
+
+Besides the wall time on this machine it reports requests and bytes needed,
+and a modelled time for a student connection (RTT + bandwidth), since on
+localhost every file starts instantly.
+
+Usage:
+    python playback_probe.py URL [URL...] [--rtt-ms 80] [--mbps 4]
+"""
+
+import argparse
+import json
+import struct
+import time
+import urllib.request
+
+HEAD_BYTES = 64 * 1024
+FIRST_FRAME_BYTES = 64 * 1024
+
+
+def _fetch(url, start=None, end=None, timeout=30):
+    """(status, body, total size) for a whole-file or ranged GET"""
+    request = urllib.request.Request(url)
+    if start is not None:
+        request.add_header('Range', f'bytes={start}-{"" if end is None else end}')
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        body = response.read()
+        total = len(body)
+        content_range = response.headers.get('Content-Range')
+        if response.status == 206 and content_range:
+            total = int(content_range.rsplit('/', 1)[1])
+        return response.status, body, total
+
+
+def _boxes(data, base=0):
+    """Top-level (type, offset, size) boxes whose headers lie inside data"""
+    boxes = []
+    offset = 0
+    while offset + 8 <= len(data):
+        size, kind = struct.unpack('>I4s', data[offset:offset + 8])
+        if size == 1 and offset + 16 <= len(data):
+            size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+        if size < 8:
+            break
+        boxes.append((kind.decode('latin-1'), base + offset, size))
+        offset += size
+    return boxes
+
+
+def time_to_first_frame(url, rtt_ms=80, mbps=4.0, timeout=30):
+    """Fetch url like a progressive player and report when the first frame could decode"""
+    started = time.perf_counter()
+    requests = 1
+    status, head, size = _fetch(url, 0, HEAD_BYTES - 1, timeout)
+    fetched = len(head)
+    ranged = status == 206
+    boxes = _boxes(head)
+    kinds = [kind for kind, _, _ in boxes]
+
+    moov_first = 'moov' in kinds and ('mdat' not in kinds or kinds.index('moov') < kinds.index('mdat'))
+    if moov_first:
+        # Index first: the media data follows it
+        _, moov_offset, moov_size = boxes[kinds.index('moov')]
+        needed_end = moov_offset + moov_size + FIRST_FRAME_BYTES
+        if not ranged:
+            fetched = min(size, needed_end)  # Playback starts while the body streams in
+    elif 'mdat' in kinds and ranged:
+        # Player sees media data first and seeks to the tail for the index
+        _, mdat_offset, mdat_size = boxes[kinds.index('mdat')]
+        _, tail, _ = _fetch(url, mdat_offset + mdat_size, None, timeout)
+        requests += 1
+        fetched += len(tail)
+        needed_end = mdat_offset + FIRST_FRAME_BYTES
+    else:
+        # No ranges: the whole body has to arrive before the index does
+        fetched = size
+        needed_end = 0
+
+    if ranged and min(needed_end, size) > len(head):
+        _, body, _ = _fetch(url, len(head), min(needed_end, size) - 1, timeout)
+        requests += 1
+        fetched += len(body)
+
+    wall = time.perf_counter() - started
+    modelled = requests * rtt_ms / 1000 + fetched * 8 / (mbps * 1_000_000)
+    return {
+        'url': url,
+        'size': size,
+        'faststart': moov_first,
+        'range_support': ranged,
+        'requests': requests,
+        'bytes_before_first_frame': fetched,
+        'ttff_wall_ms': round(wall * 1000, 2),
+        'ttff_modelled_ms': round(modelled * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure time-to-first-frame of served mp4s')
+    parser.add_argument('urls', nargs='+')
+    parser.add_argument('--rtt-ms', type=float, default=80)
+    parser.add_argument('--mbps', type=float, default=4.0)
+    args = parser.parse_args()
+    for url in args.urls:
+        print(json.dumps(time_to_first_frame(url, rtt_ms=args.rtt_ms, mbps=args.mbps), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
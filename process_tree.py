@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Process Tree Control
+Render commands (manim, and the latex/dvisvgm/ffmpeg processes it starts)
+run in their own process group, so a timeout or cancel kills the whole tree
+instead of only the direct child and leaving grandchildren burning CPU.
+
+run() is a drop-in for subprocess.run(cmd, capture_output=..., text=...,
+timeout=..., check=...) that also honours a cancel_event. Its result also
+carries the child's resource usage (.rusage from wait4, None where the
+platform has no wait4) and .wall_time.
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+IS_WINDOWS = sys.platform == 'win32'
+POLL_SECONDS = 0.25
+
+
+class ProcessCancelled(RuntimeError):
+    """Raised by run() when cancel_event was set and the process tree killed"""
+
+
+def popen_group(cmd, **kwargs):
+    """subprocess.Popen with the child as leader of a new process group"""
+    if IS_WINDOWS:
+        kwargs['creationflags'] = kwargs.get('creationflags', 0) | subprocess.CREATE_NEW_PROCESS_GROUP
+        return subprocess.Popen(cmd, **kwargs)
+    kwargs['start_new_session'] = True
+    return subprocess.Popen(cmd, **kwargs)
+
+
+def wait_with_rusage(proc):
+    """proc.wait() that reaps with wait4, returning the child's rusage (None
+    where the platform has no wait4). Don't mix with proc.poll() from another
+    thread; check proc.returncode instead."""
+    if hasattr(os, 'wait4') and proc.returncode is None:
+        try:
+            _, status, rusage = os.wait4(proc.pid, 0)
+        except ChildProcessError:
+            pass
+        else:
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            return rusage
+    proc.wait()
+    return None
+
+
+def _drain(stream):
+    """Read stream to EOF in a daemon thread; returns a callable joining it for the data"""
+    if stream is None:
+        return lambda: None
+    chunks = []
+    reader = threading.Thread(target=lambda: chunks.append(stream.read()), daemon=True)
+    reader.start()
+
+    def result():
+        reader.join()
+        stream.close()
+        return chunks[0] if chunks else None
+    return result
+
+
+def kill_tree(pid):
+    """Kill the process group led by pid; quiet when it is already gone"""
+    if IS_WINDOWS:
+        subprocess.run(['taskkill', '/F', '/T', '/PID', str(pid)], capture_output=True)
+        return
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def reap_stragglers(pid):
+    """Kill whatever is left in pid's group after the leader exited.
+
+    A no-op on Windows, where a finished pid may already belong to another process.
+    """
+    if not IS_WINDOWS:
+        kill_tree(pid)
+
+
+def run(cmd, capture_output=False, text=False, timeout=None, check=False, cancel_event=None, **kwargs):
+    """Run cmd in its own process group and wait for it.
+
+    Raises subprocess.TimeoutExpired after timeout seconds and
+    ProcessCancelled once cancel_event is set; either way the whole group is
+    killed first. Stragglers left in the group after a normal exit are
+    killed too.
+    """
+    if capture_output:
+        kwargs['stdout'] = kwargs['stderr'] = subprocess.PIPE
+    started = time.time()
+    proc = popen_group(cmd, text=text, **kwargs)
+    deadline = time.time() + timeout if timeout is not None else None
+    # Reap in our own thread so wait4 gets the rusage; pipes are drained alongside
+    usage = []
+    exited = threading.Event()
+
+    def reap():
+        usage.append(wait_with_rusage(proc))
+        exited.set()
+    threading.Thread(target=reap, daemon=True).start()
+    read_stdout, read_stderr = _drain(proc.stdout), _drain(proc.stderr)
+    try:
+        while True:
+            wait = POLL_SECONDS
+            if deadline is not None:
+                wait = max(0, min(wait, deadline - time.time()))
+            if exited.wait(wait):
+                break
+            if cancel_event is not None and cancel_event.is_set():
+                kill_tree(proc.pid)
+                exited.wait()
+                raise ProcessCancelled(f'{cmd[0]} cancelled')
+            if deadline is not None and time.time() >= deadline:
+                kill_tree(proc.pid)
+                exited.wait()
+                raise subprocess.TimeoutExpired(cmd, timeout, output=read_stdout(), stderr=read_stderr())
+    except BaseException:
+        if not exited.is_set():
+            kill_tree(proc.pid)
+            exited.wait()
+        raise
+    # Kill leftover children first, or one still holding the pipes keeps the readers waiting
+    reap_stragglers(proc.pid)
+    result = subprocess.CompletedProcess(cmd, proc.returncode, read_stdout(), read_stderr())
+    result.rusage = usage[0]
+    result.wall_time = time.time() - started
+    if check:
+        result.check_returncode()
+    return result
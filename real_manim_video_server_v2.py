@@ -10,13 +10,30 @@ import subprocess
 import tempfile
 import time
 import http.server
-import socketserver
 from pathlib import Path
 import shutil
 import re
 import hashlib
+import select
+import socket
 import platform
 import sys
+import threading
+import uuid
+
+import render_metrics
+import render_profiles
+import resource_ledger
+from process_tree import kill_tree, popen_group, reap_stragglers, wait_with_rusage
+from render_pool import RenderWorkerPool, QueueFullError, current_job
+from render_cache import RenderCache, link_or_copy, manim_version
+from manim_workers import get_worker_pool, render_scene, worker_pool_stats
+from media_pipeline import publish_faststart
+from segment_cache import SegmentCache
+from storage_manager import get_storage_manager
+from tex_cache import TexSvgCache, enable_in_script
+from video_serving import serve_from_directory
+from script_validator import validate_manim_script, manim_symbols, score_script_risk
 
 # Configuration
 PORT = 5006
@@ -25,6 +42,42 @@ BASE_DIR = Path(__file__).parent.absolute()
 RENDERED_VIDEOS_DIR = BASE_DIR / 'public' / 'rendered_videos'
 MEDIA_DIR = BASE_DIR / 'media'
 TEMP_DIR = BASE_DIR / 'temp'
+JOBS_DIR = MEDIA_DIR / 'jobs'
+RENDER_CACHE_DIR = BASE_DIR / 'render_cache'
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+# Render concurrency - number of simultaneous Manim renders and how many
+# requests may wait for a free slot before new work is rejected
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', 4))
+RENDER_QUEUE_SIZE = int(os.environ.get('RENDER_QUEUE_SIZE', 32))
+RENDER_MAX_QUEUE_WAIT = float(os.environ.get('RENDER_MAX_QUEUE_WAIT', 120))
+# Progressive final-quality renders queue separately, so they can't fill the
+# room foreground /render requests need
+RENDER_BACKGROUND_QUEUE_SIZE = int(os.environ.get('RENDER_BACKGROUND_QUEUE_SIZE', 8))
+RENDER_REQUEST_TIMEOUT = 300
+
+# Speculative fallback - for scripts whose risk score reaches the threshold,
+# render the safe script concurrently on an idle slot instead of after the
+# primary render has already failed. Opt-in globally or per request.
+SPECULATIVE_FALLBACK = os.environ.get('SPECULATIVE_FALLBACK', '0') == '1'
+SPECULATIVE_RISK_THRESHOLD = float(os.environ.get('SPECULATIVE_RISK_THRESHOLD', 0.5))
+
+# Render profiles (render_profiles) - requests may name one, the default is
+# the preview. Progressive requests are answered with the preview and
+# re-rendered with the final profile in the background, behind all
+# interactive work.
+PREVIEW_PROFILE = os.environ.get('RENDER_PROFILE', 'preview')
+FINAL_PROFILE = 'final'
+RENDER_PROGRESSIVE = os.environ.get('RENDER_PROGRESSIVE', '0') == '1'
+
+# Manim logs "Animation 3 : Partial movie file written in ..." (or
+# "Using cached data") once per finished self.play call
+ANIMATION_PROGRESS_RE = re.compile(r'Animation\s+(\d+)\s*:')
+JOB_PATH_RE = re.compile(r'^/jobs/(\w+)(/events)?/?$')
+JOB_CANCEL_RE = re.compile(r'^/jobs/(\w+)/cancel/?$')
+# How often a synchronous /render request checks whether its client is still connected
+CLIENT_POLL_SECONDS = 0.5
+SSE_KEEPALIVE_SECONDS = 15
 
 # Detect environment and set appropriate Python command
 is_windows = platform.system() == 'Windows'
@@ -46,6 +99,14 @@ else:
 
 WINDOWS_BASE = None  # Will be set dynamically if needed
 
+def to_windows_path(path):
+    """Convert a WSL /mnt/<drive>/ path to Windows format; other paths pass through"""
+    path = str(path)
+    if path.startswith('/mnt/'):
+        drive_letter = path[5].upper()
+        path = f"{drive_letter}:\\\\" + path[7:].replace('/', '\\\\')
+    return path
+
 # Log the environment
 print(f"🖥️  Environment: {'Windows' if is_windows else 'WSL' if is_wsl else 'Linux'}")
 print(f"🐍 Python command: {PYTHON_CMD}")
@@ -56,8 +117,44 @@ RENDERED_VIDEOS_DIR.mkdir(exist_ok=True, parents=True)
 MEDIA_DIR.mkdir(exist_ok=True, parents=True)
 TEMP_DIR.mkdir(exist_ok=True, parents=True)
 
+RENDER_POOL = RenderWorkerPool(
+    workers=RENDER_WORKERS,
+    max_queue=RENDER_QUEUE_SIZE,
+    max_queue_wait=RENDER_MAX_QUEUE_WAIT,
+    max_background_queue=RENDER_BACKGROUND_QUEUE_SIZE,
+    name='manim-render'
+)
+
+RENDER_CACHE = RenderCache(RENDER_CACHE_DIR, max_bytes=RENDER_CACHE_MAX_BYTES)
+TEX_CACHE = TexSvgCache()
+SEGMENT_CACHE = SegmentCache()
+STORAGE = get_storage_manager()
+render_metrics.watch_pool(RENDER_POOL)
+render_metrics.watch_cache('render', RENDER_CACHE)
+
+
+def referenced_videos():
+    """Published videos of jobs the pool still tracks - the storage manager keeps them"""
+    for job in RENDER_POOL.jobs():
+        for key in ('video_path', 'preview_video_path'):
+            url = (job.result or {}).get(key) if isinstance(job.result, dict) else None
+            if url:
+                yield BASE_DIR / 'public' / url.lstrip('/')
+
+
+STORAGE.add_references(referenced_videos)
+
 class RealManimHandler(http.server.SimpleHTTPRequestHandler):
     def do_POST(self):
+        if JOB_CANCEL_RE.match(self.path):
+            job = RENDER_POOL.get_job(JOB_CANCEL_RE.match(self.path).group(1))
+            if job is None:
+                self.send_json_response({'success': False, 'message': 'Unknown job id'}, status=404)
+                return
+            cancelled = job.cancel('client request')
+            print(f"🛑 Cancel requested for job {job.id}" if cancelled else f"ℹ️ Job {job.id} already {job.state}")
+            self.send_json_response({'success': cancelled, **job.to_dict()}, status=202 if cancelled else 409)
+            return
         if self.path == '/render':
             content_length = int(self.headers['Content-Length'])
             post_data = self.rfile.read(content_length)
@@ -69,6 +166,9 @@ class RealManimHandler(http.server.SimpleHTTPRequestHandler):
                 question = data.get('question', '')
                 solution = data.get('solution', '')
                 duration = data.get('duration', 20)  # Get duration from request, default 20s
+                speculative = bool(data.get('speculative', SPECULATIVE_FALLBACK))
+                progressive = bool(data.get('progressive', RENDER_PROGRESSIVE))
+                profile = render_profiles.resolve(data.get('profile'), default=PREVIEW_PROFILE).name
                 
                 print(f"\n{'='*60}")
                 print(f"🎬 Real Manim Render Request at {time.strftime('%Y-%m-%d %H:%M:%S')}")
@@ -78,42 +178,53 @@ class RealManimHandler(http.server.SimpleHTTPRequestHandler):
                 print(f"⏱️ Requested duration: {duration} seconds")
                 print(f"{'='*60}\n")
                 
-                # Generate unique Manim script
-                if not script_content or len(script_content) < 100:
-                    script_content = self.generate_manim_script(question, solution, duration)
-                
-                # Try to generate the video
-                success, video_path, message = self.generate_manim_video(
-                    script_content, output_name, question
-                )
-                
-                # If failed, try safe fallback
-                if not success:
-                    print(f"⚠️ First attempt failed: {message}")
-                    print("🔄 Trying safe fallback script...")
-                    safe_script = self.generate_safe_script(question, duration)
-                    success, video_path, message = self.generate_manim_video(
-                        safe_script, output_name, question
+                try:
+                    job = RENDER_POOL.submit(
+                        self.render_request, script_content, output_name, question, solution, duration,
+                        speculative=speculative, progressive=progressive, profile=profile
                     )
+                except QueueFullError as e:
+                    print(f"🚫 Render rejected: {e}")
+                    render_metrics.record_request('rejected')
+                    render_metrics.record_failure(e)
+                    self.send_json_response({
+                        'success': False,
+                        'message': str(e),
+                        'render_pool': RENDER_POOL.stats()
+                    }, status=503, headers={'Retry-After': '10'})
+                    return
                 
-                response = {
-                    'success': success,
-                    'video_path': video_path if success else None,
-                    'message': message,
-                    'duration': 20,
-                    'size': self.get_file_size(video_path) if success else 0,
-                    'fallback': False,
-                    'generated': success
-                }
+                print(f"📥 Queued render job {job.id} (queue depth: {RENDER_POOL.queue_depth})")
                 
-                if success:
-                    self.send_json_response(response)
+                # Async clients get the job id straight away and follow progress
+                # through /jobs/<id> and /jobs/<id>/events
+                if data.get('async') or 'respond-async' in self.headers.get('Prefer', ''):
+                    self.send_json_response({
+                        'success': True,
+                        'job_id': job.id,
+                        'state': job.state,
+                        'status_url': f'/jobs/{job.id}',
+                        'events_url': f'/jobs/{job.id}/events'
+                    }, status=202, headers={'Location': f'/jobs/{job.id}'})
+                    return
+                
+                finished = self.wait_for_job(job, RENDER_REQUEST_TIMEOUT)
+                if finished is None:
+                    print(f"🔌 Client went away, cancelled render job {job.id}")
+                    return
+                if not finished:
+                    job.cancel('request timeout')
+                    render_metrics.record_failure('timeout')
+                    response = self.build_render_response(False, None, 'Render queue timed out', profile=profile)
+                elif job.state == 'done':
+                    response = job.result
                 else:
-                    self.send_response(500)
-                    self.send_header('Content-type', 'application/json')
-                    self.send_header('Access-Control-Allow-Origin', '*')
-                    self.end_headers()
-                    self.wfile.write(json.dumps(response).encode())
+                    render_metrics.record_failure(job.error or job.state)
+                    response = self.build_render_response(False, None, job.error or f'Render job {job.state}',
+                                                          profile=profile)
+                response['job_id'] = job.id
+                
+                self.send_json_response(response, status=200 if response['success'] else 500)
                 
             except Exception as e:
                 print(f"❌ Error: {str(e)}")
@@ -121,6 +232,205 @@ class RealManimHandler(http.server.SimpleHTTPRequestHandler):
                 traceback.print_exc()
                 self.send_error(500, str(e))
     
+    def wait_for_job(self, job, timeout):
+        """Wait for a synchronous request's job while watching its connection.
+
+        Returns True when the job finished, False on timeout, and None when
+        the client disconnected (the job is cancelled then).
+        """
+        deadline = time.time() + timeout
+        while not job.wait(min(CLIENT_POLL_SECONDS, max(0, deadline - time.time()))):
+            if self.client_disconnected():
+                job.cancel('client disconnected')
+                return None
+            if time.time() >= deadline:
+                return False
+        return True
+    
+    def client_disconnected(self):
+        """True once the peer closed the connection (readable with no data left)"""
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and self.connection.recv(1, socket.MSG_PEEK) == b''
+        except (OSError, ValueError):
+            return True
+    
+    def render_request(self, script_content, output_name, question, solution, duration,
+                       speculative=False, progressive=False, profile=PREVIEW_PROFILE):
+        """Render one request on a pool slot and record its outcome in the metrics"""
+        with render_metrics.in_flight():
+            response = self.render_with_fallback(script_content, output_name, question, solution, duration,
+                                                 speculative=speculative, progressive=progressive,
+                                                 profile=profile)
+        if not response['success']:
+            render_metrics.record_request('failed')
+            render_metrics.record_failure(response['message'])
+        elif response['fallback']:
+            render_metrics.record_request('fallback')
+            render_metrics.record_fallback('safe_script')
+        else:
+            render_metrics.record_request('success')
+        return response
+    
+    def render_with_fallback(self, script_content, output_name, question, solution, duration,
+                             speculative=False, progressive=False, profile=PREVIEW_PROFILE):
+        """Render the request's script, falling back to the safe script"""
+        # Generate unique Manim script
+        if not script_content or len(script_content) < 100:
+            with render_metrics.stage('script_generation'):
+                script_content = self.generate_manim_script(question, solution, duration)
+        
+        # Reject broken scripts statically before paying for a Manim run
+        with render_metrics.stage('validation'):
+            validation = validate_manim_script(script_content)
+        if validation['valid'] and speculative:
+            risk = score_script_risk(script_content)
+            if risk['score'] >= SPECULATIVE_RISK_THRESHOLD:
+                response = self.render_speculative(
+                    script_content, validation['scene_name'], output_name, question, duration, risk, profile
+                )
+                if response is not None:
+                    return self.with_final_render(response, progressive, script_content,
+                                                  validation['scene_name'], output_name, question)
+        
+        if validation['valid']:
+            # Try to generate the video
+            success, video_path, message = self.generate_manim_video(
+                script_content, output_name, question, scene_name=validation['scene_name'], profile=profile
+            )
+        else:
+            success, video_path = False, None
+            message = f"Script rejected by pre-flight validation - {validation['errors'][0]}"
+            print(f"🛑 {message}")
+        
+        # If failed, try safe fallback
+        if not success:
+            print(f"⚠️ First attempt failed: {message}")
+            render_metrics.record_failure(message)
+            print("🔄 Trying safe fallback script...")
+            job = current_job()
+            if job:
+                job.update_progress(stage='fallback', message=message)
+            safe_script = self.generate_safe_script(question, duration)
+            success, video_path, message = self.generate_manim_video(
+                safe_script, output_name, question, profile=profile
+            )
+            return self.build_render_response(success, video_path, message, fallback=True, profile=profile)
+        
+        response = self.build_render_response(success, video_path, message, profile=profile)
+        return self.with_final_render(response, progressive, script_content,
+                                      validation['scene_name'], output_name, question)
+    
+    def with_final_render(self, response, progressive, script_content, scene_name, output_name, question):
+        """Attach a background full-quality render to a successful preview.
+        
+        Fallback videos are placeholders and are not worth a 1080p pass.
+        """
+        if not (progressive and response['success'] and not response['fallback']
+                and response['quality'] != FINAL_PROFILE):
+            return response
+        try:
+            final_job = RENDER_POOL.submit_background(
+                self.render_final, script_content, scene_name, output_name, question, current_job()
+            )
+        except QueueFullError as e:
+            print(f"⚠️ Final-quality render not queued: {e}")
+            return response
+        print(f"🎞️ Queued final-quality render {final_job.id} for {output_name}")
+        response['final_job_id'] = final_job.id
+        response['final_status_url'] = f'/jobs/{final_job.id}'
+        return response
+    
+    def render_final(self, script_content, scene_name, output_name, question, preview_job):
+        """Background 1080p render that swaps the preview job's video record when done"""
+        success, video_path, message = self.generate_manim_video(
+            script_content, f'{output_name}_final', question, scene_name=scene_name, profile=FINAL_PROFILE
+        )
+        response = self.build_render_response(success, video_path, message, profile=FINAL_PROFILE)
+        if success and preview_job is not None and preview_job.wait(RENDER_REQUEST_TIMEOUT):
+            record = preview_job.result
+            if record and record.get('success'):
+                record['preview_video_path'] = record['video_path']
+                record['video_path'] = video_path
+                record['size'] = response['size']
+                record['quality'] = FINAL_PROFILE
+                record['profile'] = response['profile']
+                preview_job.publish('quality_upgraded', video_path=video_path, quality=FINAL_PROFILE,
+                                    profile=response['profile'])
+                print(f"✅ {output_name} upgraded to final quality: {video_path}")
+        return response
+    
+    def render_speculative(self, script_content, scene_name, output_name, question, duration, risk,
+                           profile=PREVIEW_PROFILE):
+        """Race a risky script against the safe script on a second slot.
+        
+        The primary render wins whenever it succeeds; the safe render is only
+        published if the primary fails. Both render into the cache without
+        publishing, so the loser never touches output_name. Returns None when
+        no slot is idle for the safe render.
+        """
+        safe_script = self.generate_safe_script(question, duration)
+        safe_job = RENDER_POOL.submit_if_idle(
+            self.generate_manim_video, safe_script, output_name, question, publish=False, profile=profile
+        )
+        if safe_job is None:
+            return None
+        print(f"🎲 Risky script (score {risk['score']}), rendering safe fallback speculatively")
+        
+        job = current_job()
+        if job:
+            job.update_progress(stage='speculative', risk_score=risk['score'], fallback_job_id=safe_job.id)
+        
+        success, cached_video, message = self.generate_manim_video(
+            script_content, output_name, question, scene_name=scene_name, publish=False, profile=profile
+        )
+        if success:
+            safe_job.cancel()
+            video_path = self.publish_video(cached_video, output_name)
+            return self.build_render_response(success, video_path, message, speculative=True, profile=profile)
+        
+        print(f"⚠️ Primary render failed: {message}")
+        render_metrics.record_failure(message)
+        if job:
+            job.update_progress(stage='fallback', message=message)
+        # Only wait on a safe render that is running on another slot: one still
+        # queued behind other work could be waiting for this very slot
+        if safe_job.started_at is not None and safe_job.wait(RENDER_REQUEST_TIMEOUT) and safe_job.state == 'done':
+            success, cached_video, message = safe_job.result
+        else:
+            # The speculative slot was lost (still queued, shed or timed out) - render inline
+            safe_job.cancel('rendered inline')
+            success, cached_video, message = self.generate_manim_video(
+                safe_script, output_name, question, publish=False, profile=profile
+            )
+        video_path = self.publish_video(cached_video, output_name) if success else None
+        return self.build_render_response(success, video_path, message, fallback=True, speculative=True,
+                                          profile=profile)
+    
+    def publish_video(self, cached_video, output_name):
+        """Expose a cached render under rendered_videos/<output_name>.mp4"""
+        final_path = RENDERED_VIDEOS_DIR / f"{output_name}.mp4"
+        with render_metrics.stage('copy'):
+            link_or_copy(cached_video, final_path)
+        return f'/rendered_videos/{output_name}.mp4'
+    
+    def build_render_response(self, success, video_path, message, fallback=False, speculative=False,
+                              profile=PREVIEW_PROFILE):
+        """JSON body shared by the synchronous response and the job result"""
+        profile = render_profiles.resolve(profile)
+        return {
+            'success': success,
+            'video_path': video_path if success else None,
+            'message': message,
+            'duration': 20,
+            'size': self.get_file_size(video_path) if success else 0,
+            'fallback': fallback,
+            'speculative': speculative,
+            'quality': profile.name,
+            'profile': profile.to_dict(),
+            'generated': success
+        }
+    
     def generate_safe_script(self, question, duration=20):
         """Generate a safe, always-working script"""
         # Detect language
@@ -565,16 +875,55 @@ class MathSolution(Scene):
         root2_label.next_to(root2, DOWN)
         self.play(Write(root1_label), Write(root2_label))'''
     
-    def generate_manim_video(self, script_content, output_name, question):
-        """Generate video using Windows Manim installation"""
+    def generate_manim_video(self, script_content, output_name, question, scene_name=None, publish=True,
+                             profile=PREVIEW_PROFILE):
+        """Generate video using Windows Manim installation
+        
+        With publish=False the video is left in the render cache and its
+        cache path is returned instead of the public URL.
+        """
+        job_dir = None
+        ledger_token = None
         try:
-            # Create temporary script file
+            # Serve identical scripts rendered with identical flags from the cache
+            profile = render_profiles.resolve(profile)
+            cache_key = RenderCache.make_key(
+                script_content, format='mp4', manim=manim_version(), **profile.config()
+            )
+            cached_video = RENDER_CACHE.get(cache_key)
+            if cached_video:
+                print(f"⚡ Render cache hit: {cache_key[:12]}")
+                if not publish:
+                    return True, str(cached_video), 'Video served from render cache'
+                return True, self.publish_video(cached_video, output_name), 'Video served from render cache'
+            
+            # Every render gets its own output directory and an explicit output
+            # file, so the result path is known up front instead of searched for
             script_hash = hashlib.md5(script_content.encode()).hexdigest()[:8]
-            temp_script = TEMP_DIR / f'manim_script_{script_hash}.py'
+            ledger_token = resource_ledger.bind(
+                script_hash=script_hash, question_type=resource_ledger.question_type(question), quality=profile.name
+            )
+            job = current_job()
+            cancel_event = job.cancel_event if job else None
+            render_id = f"{job.id if job else 'direct'}-{uuid.uuid4().hex[:6]}"
+            job_dir = JOBS_DIR / render_id
+            job_dir.mkdir(parents=True, exist_ok=True)
+            job_video = job_dir / f'{render_id}.mp4'
+            
+            # Create temporary script file
+            temp_script = job_dir / f'manim_script_{script_hash}.py'
             
-            # Write script with UTF-8 encoding
+            # Write script with UTF-8 encoding, pinned to the render profile and,
+            # for CLI renders, looking its formulas up in the shared tex cache
             with open(temp_script, 'w', encoding='utf-8') as f:
-                f.write(script_content)
+                f.write(enable_in_script(render_profiles.enforce_script(script_content, profile),
+                                         import_path=to_windows_path(BASE_DIR) if USE_POWERSHELL else BASE_DIR))
+            
+            # Manim config pinning this render's video and LaTeX output to the job directory
+            job_config = job_dir / 'manim.cfg'
+            job_tex_dir = job_dir / 'Tex'
+            with open(job_config, 'w', encoding='utf-8') as f:
+                f.write(f"[CLI]\nvideo_dir = {job_dir}\ntex_dir = {job_tex_dir}\n")
             
             print(f"📝 Script written to: {temp_script}")
             
@@ -584,11 +933,8 @@ class MathSolution(Scene):
                 f.write(script_content)
             
             # Convert path format if needed (for cross-platform compatibility)
-            windows_script = str(temp_script)
-            if windows_script.startswith('/mnt/'):
-                # WSL path - convert to Windows format
-                drive_letter = windows_script[5].upper()
-                windows_script = f"{drive_letter}:\\\\" + windows_script[7:].replace('/', '\\\\')
+            windows_script = to_windows_path(temp_script)
+            windows_config = to_windows_path(job_config)
             
             # Set WINDOWS_BASE if not already set
             global WINDOWS_BASE
@@ -600,9 +946,10 @@ class MathSolution(Scene):
                 else:
                     WINDOWS_BASE = windows_base
             
-            # Extract scene name
-            scene_match = re.search(r'class\s+(\w+)\s*\(', script_content)
-            scene_name = scene_match.group(1) if scene_match else 'MathSolution'
+            # Extract scene name unless validation already found it
+            if not scene_name:
+                scene_match = re.search(r'class\s+(\w+)\s*\(', script_content)
+                scene_name = scene_match.group(1) if scene_match else 'MathSolution'
             
             # Prepare Manim command based on environment
             if is_windows:
@@ -610,59 +957,89 @@ class MathSolution(Scene):
                 cmd = [
                     PYTHON_CMD, '-m', 'manim',
                     str(temp_script), scene_name,
-                    '-pql', '--format', 'mp4',
-                    '--media_dir', str(BASE_DIR / 'media')
+                    *profile.cli_args(), '--format', 'mp4',
+                    '--media_dir', str(MEDIA_DIR),
+                    '--config_file', str(job_config),
+                    '-o', render_id
                 ]
             elif USE_POWERSHELL:
                 # WSL - use PowerShell to run Windows Python with UTF-8 encoding
+                profile_args = ' '.join(profile.cli_args())
                 cmd = [
                     'powershell.exe', '-Command',
-                    f'[Console]::OutputEncoding = [System.Text.Encoding]::UTF8; $env:PYTHONIOENCODING = "utf-8"; {PYTHON_CMD} -m manim "{windows_script}" {scene_name} -pql --format mp4 --media_dir "{WINDOWS_BASE}\\\\media"'
+                    f'[Console]::OutputEncoding = [System.Text.Encoding]::UTF8; $env:PYTHONIOENCODING = "utf-8"; {PYTHON_CMD} -m manim "{windows_script}" {scene_name} {profile_args} --format mp4 --media_dir "{WINDOWS_BASE}\\\\media" --config_file "{windows_config}" -o {render_id}'
                 ]
             else:
                 # WSL or Linux - use local Manim
                 cmd = [
                     PYTHON_CMD, '-m', 'manim',
                     str(temp_script), scene_name,
-                    '-pql', '--format', 'mp4',
-                    '--media_dir', str(BASE_DIR / 'media')
+                    *profile.cli_args(), '--format', 'mp4',
+                    '--media_dir', str(MEDIA_DIR),
+                    '--config_file', str(job_config),
+                    '-o', render_id
                 ]
             
             print(f"🔧 Executing Manim command...")
             print(f"   Scene: {scene_name}")
             
-            # Run Manim
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=False,
-                timeout=60
-            )
+            # Run Manim, reporting per-animation progress to the current job.
+            # Prefer a pre-warmed worker process; fall back to the CLI.
+            animations_total = script_content.count('self.play(')
+            self.report_animation_progress(0, animations_total)
+            with render_metrics.stage('manim'):
+                worker_result = None
+                if not USE_POWERSHELL:
+                    worker_result = render_scene(
+                        temp_script, scene_name,
+                        profile=profile, media_dir=MEDIA_DIR, timeout=profile.timeout,
+                        output_file=render_id, config={'video_dir': str(job_dir)},
+                        on_progress=lambda index: self.report_animation_progress(index + 1, animations_total),
+                        cancel_event=cancel_event
+                    )
+            
+                if worker_result is not None:
+                    returncode = 0 if worker_result['success'] else 1
+                    stdout, stderr = '', worker_result.get('stderr', '')
+                    if worker_result['success']:
+                        job_video = Path(worker_result['video_path'])
+                    resource_ledger.record('manim', worker_result.get('usage', {}), worker_result.get('wall_time', 0),
+                                           output_path=job_video, worker=True, returncode=returncode)
+                    SEGMENT_CACHE.record_render(worker_result)
+                    TEX_CACHE.record_render(worker_result)
+                    print(f"♻️ Rendered on persistent Manim worker {worker_result.get('worker_pid')} "
+                          f"(reused {worker_result.get('segments_reused', 0)} cached segments)")
+                else:
+                    returncode, stdout, stderr = self.run_manim_with_progress(
+                        cmd, animations_total, timeout=profile.timeout, cancel_event=cancel_event,
+                        output_path=job_video
+                    )
+                    TEX_CACHE.record_output(stdout)
             
-            # Decode output
-            stdout = result.stdout.decode('utf-8', errors='replace') if result.stdout else ""
-            stderr = result.stderr.decode('utf-8', errors='replace') if result.stderr else ""
+            if cancel_event is not None and cancel_event.is_set():
+                print(f"🛑 Render {render_id} cancelled")
+                return False, None, 'Render cancelled'
             
-            if result.returncode == 0:
+            if returncode == 0:
                 print("✅ Manim execution successful!")
                 
-                # Find the generated video
-                video_path = self.find_generated_video(scene_name, script_hash)
-                
-                if video_path:
-                    # Copy to final location
-                    final_path = RENDERED_VIDEOS_DIR / f"{output_name}.mp4"
-                    shutil.copy2(video_path, final_path)
-                    print(f"✅ Video copied to: {final_path}")
+                if job_video.exists():
+                    # Move the moov atom to the front (a no-op link when Manim
+                    # already wrote it there), then cache and publish
+                    web_video = job_dir / f'{render_id}_web.mp4'
+                    publish_faststart(job_video, web_video)
+                    # Store in the render cache, then publish from it
+                    cached_video = RENDER_CACHE.put(cache_key, web_video)
+                    if not publish:
+                        return True, str(cached_video), 'Video generated successfully'
+                    video_path = self.publish_video(cached_video, output_name)
+                    print(f"✅ Video published to: {video_path}")
                     
-                    # Clean up
-                    temp_script.unlink()
-                    
-                    return True, f'/rendered_videos/{output_name}.mp4', 'Video generated successfully'
+                    return True, video_path, 'Video generated successfully'
                 else:
-                    return False, None, 'Video file not found after rendering'
+                    return False, None, f'Video file not found after rendering: {job_video}'
             else:
-                print(f"❌ Manim execution failed with code {result.returncode}")
+                print(f"❌ Manim execution failed with code {returncode}")
                 print(f"📜 Stdout: {stdout[:1000]}")
                 print(f"📜 Stderr: {stderr[:1000]}")
                 
@@ -670,7 +1047,7 @@ class MathSolution(Scene):
                 error_log = TEMP_DIR / f'error_{script_hash}.log'
                 with open(error_log, 'w', encoding='utf-8') as f:
                     f.write(f"Command: {' '.join(cmd)}\n")
-                    f.write(f"Return code: {result.returncode}\n")
+                    f.write(f"Return code: {returncode}\n")
                     f.write(f"=== STDOUT ===\n{stdout}\n")
                     f.write(f"=== STDERR ===\n{stderr}\n")
                 print(f"📝 Full error saved to: {error_log}")
@@ -692,30 +1069,85 @@ class MathSolution(Scene):
         except Exception as e:
             print(f"❌ Exception: {str(e)}")
             return False, None, f'Error: {str(e)}'
+        finally:
+            # The published video is a hardlink into the cache, so the job
+            # directory (script, partial movie files, raw output) can go
+            if job_dir is not None:
+                shutil.rmtree(job_dir, ignore_errors=True)
+            if ledger_token is not None:
+                resource_ledger.unbind(ledger_token)
     
-    def find_generated_video(self, scene_name, script_hash):
-        """Find the video generated by Manim"""
-        print(f"🔍 Searching for generated video...")
-        
-        # Search paths
-        search_paths = [
-            MEDIA_DIR / 'videos' / f'manim_script_{script_hash}' / '480p15',
-            MEDIA_DIR / 'videos' / scene_name / '480p15',
-            MEDIA_DIR / 'videos',
-        ]
-        
-        # Look for recent videos
-        cutoff_time = time.time() - 300
-        
-        for path in search_paths:
-            if path.exists():
-                print(f"   Checking: {path}")
-                for video in path.rglob('*.mp4'):
-                    if video.stat().st_mtime > cutoff_time:
-                        print(f"✅ Found video: {video}")
-                        return video
-        
-        return None
+    def report_animation_progress(self, done, animations_total):
+        """Publish per-animation render progress on the current pool job"""
+        job = current_job()
+        if job:
+            total = max(animations_total, done, 1)
+            job.update_progress(
+                stage='rendering', animation=done, animations_total=total,
+                percent=round(100 * done / total, 1)
+            )
+    
+    def run_manim_with_progress(self, cmd, animations_total, timeout, cancel_event=None, output_path=None):
+        """Run Manim streaming stdout, turning 'Animation N :' log lines into job progress"""
+        # Own process group, so a kill also reaches latex/dvisvgm/ffmpeg children
+        started = time.time()
+        proc = popen_group(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        timed_out = threading.Event()
+        
+        def kill_on_timeout():
+            timed_out.set()
+            kill_tree(proc.pid)
+        
+        timer = threading.Timer(timeout, kill_on_timeout)
+        timer.start()
+        
+        if cancel_event is not None:
+            def kill_on_cancel():
+                while proc.returncode is None:
+                    if cancel_event.wait(0.25):
+                        kill_tree(proc.pid)
+                        return
+            threading.Thread(target=kill_on_cancel, daemon=True).start()
+        
+        # Drain stderr in the background so a chatty progress bar can't block the pipe
+        stderr_chunks = []
+        stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+        stderr_reader.start()
+        
+        # Reap Manim as soon as it exits and kill what it left in its group: a
+        # leftover child holding the pipes would otherwise keep the reads below
+        # waiting until the timeout
+        usage = []
+        
+        def reap():
+            usage.append(wait_with_rusage(proc))
+            reap_stragglers(proc.pid)
+        waiter = threading.Thread(target=reap, daemon=True)
+        waiter.start()
+        
+        stdout_lines = []
+        try:
+            for raw_line in proc.stdout:
+                line = raw_line.decode('utf-8', errors='replace')
+                stdout_lines.append(line)
+                match = ANIMATION_PROGRESS_RE.search(line)
+                if match:
+                    self.report_animation_progress(int(match.group(1)) + 1, animations_total)
+            waiter.join()
+            stderr_reader.join()
+        finally:
+            timer.cancel()
+            if waiter.is_alive():
+                kill_tree(proc.pid)
+                waiter.join()
+            resource_ledger.record('manim', usage[0] if usage else None, time.time() - started,
+                                   output_path=output_path, returncode=proc.returncode)
+        
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        
+        stderr = b''.join(stderr_chunks).decode('utf-8', errors='replace')
+        return proc.returncode, ''.join(stdout_lines), stderr
     
     def get_file_size(self, video_path):
         """Get file size of video"""
@@ -728,31 +1160,85 @@ class MathSolution(Scene):
             pass
         return 0
     
-    def send_json_response(self, data):
+    def send_json_response(self, data, status=200, headers=None):
         """Send JSON response with CORS headers"""
-        self.send_response(200)
+        self.send_response(status)
         self.send_header('Content-type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
         self.wfile.write(json.dumps(data).encode())
     
     def do_GET(self):
-        if self.path == '/health':
+        if self.path == '/metrics':
+            render_metrics.send_metrics(self)
+        elif self.path == '/health':
             self.send_json_response({
                 'status': 'healthy',
                 'service': 'real-manim-video-server-v2',
                 'port': PORT,
                 'timestamp': time.time(),
-                'version': '2.0'
+                'version': '2.0',
+                'render_pool': RENDER_POOL.stats(),
+                'render_cache': RENDER_CACHE.stats(),
+                'tex_cache': TEX_CACHE.stats(),
+                'segment_cache': SEGMENT_CACHE.stats(),
+                'storage': STORAGE.stats(),
+                'manim_workers': worker_pool_stats()
             })
+        elif self.path.startswith('/rendered_videos/'):
+            serve_from_directory(self, RENDERED_VIDEOS_DIR, self.path[len('/rendered_videos/'):])
+        elif JOB_PATH_RE.match(self.path):
+            match = JOB_PATH_RE.match(self.path)
+            job = RENDER_POOL.get_job(match.group(1))
+            if job is None:
+                self.send_json_response({'success': False, 'message': 'Unknown job id'}, status=404)
+            elif match.group(2):
+                self.stream_job_events(job)
+            else:
+                self.send_json_response(job.to_dict())
         else:
             super().do_GET()
     
+    def do_HEAD(self):
+        if self.path.startswith('/rendered_videos/'):
+            serve_from_directory(self, RENDERED_VIDEOS_DIR, self.path[len('/rendered_videos/'):], head=True)
+        else:
+            super().do_HEAD()
+    
+    def stream_job_events(self, job):
+        """Server-Sent Events stream of a job's state and progress until it finishes"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        
+        index = 0
+        try:
+            while True:
+                events = job.events_since(index, timeout=SSE_KEEPALIVE_SECONDS)
+                if not events:
+                    self.wfile.write(b': keepalive\n\n')
+                for event in events:
+                    payload = json.dumps(event['data'], ensure_ascii=False)
+                    self.wfile.write(f"event: {event['event']}\ndata: {payload}\n\n".encode('utf-8'))
+                index += len(events)
+                self.wfile.flush()
+                if job.done and not job.events_since(index, timeout=0):
+                    result = json.dumps(job.to_dict(), ensure_ascii=False)
+                    self.wfile.write(f"event: done\ndata: {result}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            print(f"🔌 Event stream for job {job.id} closed by client")
+    
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Range, If-None-Match, If-Range')
         self.end_headers()
 
 if __name__ == '__main__':
@@ -763,6 +1249,21 @@ if __name__ == '__main__':
     print(f"🎬 Render endpoint: http://localhost:{PORT}/render")
     print(f"🌐 Supports both Chinese and English content")
     print(f"✨ Enhanced stability and error handling")
+    print(f"🧵 Render slots: {RENDER_WORKERS}, queue capacity: {RENDER_QUEUE_SIZE} "
+          f"(+{RENDER_BACKGROUND_QUEUE_SIZE} background)")
+    
+    RENDER_POOL.start()
+    STORAGE.start()
+    
+    # Start loading the Manim symbol set for script validation (probes in the background)
+    manim_symbols(PYTHON_CMD)
+    
+    # Start the pre-warmed Manim processes now rather than on the first request
+    manim_workers = get_worker_pool(size=RENDER_WORKERS)
+    if manim_workers:
+        print(f"♻️ Persistent Manim workers: {manim_workers.size}")
     
-    with socketserver.TCPServer(("0.0.0.0", PORT), RealManimHandler) as httpd:
+    # Threaded server so /health and /rendered_videos stay responsive while
+    # renders occupy the worker pool
+    with http.server.ThreadingHTTPServer(("0.0.0.0", PORT), RealManimHandler) as httpd:
         httpd.serve_forever()
\ No newline at end of file
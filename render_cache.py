@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Content-Addressed Render Cache
+Stores finished mp4 renders keyed by script content and renderer flags,
+with size-bounded LRU eviction that survives server restarts
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+
+from video_serving import remember_digest
+
+
+@lru_cache(maxsize=1)
+def manim_version():
+    """Installed Manim version, part of every cache key"""
+    try:
+        from importlib.metadata import version
+        return version('manim')
+    except Exception:
+        return 'unknown'
+
+
+def temp_sibling(dest):
+    """Private temporary name next to dest: write there, then os.replace() it
+    onto dest. Writing dest in place would rewrite every hardlink sharing its inode."""
+    dest = Path(dest)
+    return dest.with_name(f'.{dest.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+
+
+def link_or_copy(source, dest):
+    """Publish source at dest without copying bytes when the filesystem allows it"""
+    source, dest = Path(source), Path(dest)
+    tmp = temp_sibling(dest)
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copy2(source, tmp)
+    os.replace(tmp, dest)
+    return dest
+
+
+class RenderCache:
+    """Persistent mp4 cache addressed by sha256(script + renderer flags).
+
+    Entries live as <key>.mp4 files in cache_dir. Recency is kept in memory
+    and in a sidecar index (RECENCY_INDEX), never in the file mtime: published
+    videos are hardlinks to the cache files, so touching an entry would change
+    the mtime (Last-Modified, storage age) of every alias. Entries missing from
+    the index rank by mtime, i.e. by when they were rendered.
+    """
+
+    RECENCY_INDEX = '.recency.json'
+    INDEX_SAVE_INTERVAL = 60  # Seconds between index writes caused by hits alone
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3, suffix='.mp4'):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_bytes)
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._last_used = {}
+        self._index_saved_at = 0.0
+        self._load_index()
+
+    @staticmethod
+    def make_key(script_content, **flags):
+        """Full content hash of the script plus every flag that changes the output"""
+        digest = hashlib.sha256()
+        digest.update(script_content.encode('utf-8'))
+        digest.update(json.dumps(flags, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _load_index(self):
+        try:
+            recency = json.loads((self.cache_dir / self.RECENCY_INDEX).read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            recency = {}
+        files = []
+        for path in self.cache_dir.glob(f'*{self.suffix}'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            last_used = recency.get(path.stem, stat.st_mtime)
+            files.append((last_used, path.stem, stat.st_size))
+        for last_used, key, size in sorted(files):
+            self._entries[key] = size
+            self._last_used[key] = last_used
+            self._total_bytes += size
+
+    def _touch_locked(self, key, force_save=False):
+        now = time.time()
+        self._last_used[key] = now
+        if force_save or now - self._index_saved_at >= self.INDEX_SAVE_INTERVAL:
+            self._save_index_locked(now)
+
+    def _save_index_locked(self, now=None):
+        index = self.cache_dir / self.RECENCY_INDEX
+        tmp = temp_sibling(index)
+        try:
+            tmp.write_text(json.dumps({key: self._last_used.get(key, 0) for key in self._entries}),
+                           encoding='utf-8')
+            os.replace(tmp, index)
+            self._index_saved_at = now or time.time()
+        except OSError:
+            pass
+
+    def path_for(self, key):
+        return self.cache_dir / f'{key}{self.suffix}'
+
+    def get(self, key):
+        """Return the cached file for key (refreshing its recency) or None"""
+        with self._lock:
+            path = self.path_for(key)
+            if key in self._entries and path.exists():
+                self._entries.move_to_end(key)
+                self._touch_locked(key)
+                self.hits += 1
+                return path
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+                self._last_used.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, key, source_path):
+        """Store a finished render under key and evict down to the size budget"""
+        path = self.path_for(key)
+        link_or_copy(source_path, path)
+        remember_digest(path)  # Usually a hit: the source was hashed when finalized
+        size = path.stat().st_size
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict_locked(keep=key)
+            self._touch_locked(key, force_save=True)
+        return path
+
+    def _evict_locked(self, keep=None):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = next(iter(self._entries.items()))
+            if key == keep:
+                self._entries.move_to_end(key)
+                continue
+            self._entries.pop(key)
+            self._last_used.pop(key, None)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                self.path_for(key).unlink()
+            except OSError:
+                pass
+
+    def contains(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'updated_at': time.time(),
+            }
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Render Metrics
+Prometheus metrics shared by the render servers, served at GET /metrics in
+the text exposition format (hand-rolled, so the servers need no client
+library):
+
+  videotutor_render_stage_seconds        latency histogram per stage
+                                         (script_generation, validation,
+                                         manim, concat, mux, copy)
+  videotutor_render_requests_total       render requests by outcome
+  videotutor_render_requests_in_flight   requests being answered right now
+  videotutor_render_fallbacks_total      safe-script / fallback-video usage;
+                                         divide by requests for the rate
+  videotutor_render_failures_total       failures by reason class
+  videotutor_cache_lookups_total         hits and misses per cache
+  videotutor_cache_hit_ratio             hits / lookups per cache
+  videotutor_render_queue_depth          jobs waiting in a RenderWorkerPool
+  videotutor_render_jobs_in_flight       jobs a RenderWorkerPool is running
+
+Usage:
+    with render_metrics.stage('manim'):
+        ...
+    render_metrics.record_failure(error)        # exception or error message
+    send_metrics(handler)                       # http.server GET /metrics
+    Response(exposition(), mimetype=CONTENT_TYPE)   # Flask
+"""
+
+import bisect
+import contextlib
+import math
+import subprocess
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+STAGES = ('script_generation', 'validation', 'manim', 'concat', 'mux', 'copy')
+
+# Checked in order against the lower-cased error text
+# (English and the Chinese messages some servers return)
+FAILURE_PATTERNS = (
+    ('cancelled', ('cancel', 'client disconnected', '取消')),
+    ('timeout', ('timeout', 'timed out', '超时')),
+    ('queue_full', ('queue is full', 'shed after')),
+    ('manim_unavailable', ('未安装', 'workers unavailable')),
+    ('latex', ('latex', 'dvisvgm', '.tex')),
+    ('script_error', ('syntaxerror', 'syntax error', 'nameerror', 'name error', 'importerror',
+                      'attributeerror', 'typeerror', 'type error', 'validation', 'not defined')),
+    ('worker_crash', ('exited unexpectedly', 'crashed')),
+    ('ffmpeg', ('ffmpeg', 'ffprobe', '音频合并')),
+    ('output_missing', ('not found', 'no video', 'no such file', '未找到', '不存在', '没有找到')),
+)
+
+_lock = threading.Lock()
+_families = []
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._sources = []
+        with _lock:
+            _families.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def add_source(self, source):
+        """source() -> {label values tuple: value}, read at every scrape"""
+        self._sources.append(source)
+
+    def values(self):
+        """{label values tuple: value}, including what the sources report"""
+        with _lock:
+            values = dict(self._values)
+        for source in self._sources:
+            try:
+                for key, value in source().items():
+                    values[key] = values.get(key, 0) + value
+            except Exception as e:
+                print(f"⚠️ Metrics source for {self.name} failed: {e}")
+        return values
+
+    def samples(self):
+        return [(self.name, _format_labels(self.labelnames, key), value)
+                for key, value in sorted(self.values().items())]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with _lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        samples = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                samples.append((f'{self.name}_bucket', labels, cumulative))
+            samples.append((f'{self.name}_sum', _format_labels(self.labelnames, key), total))
+            samples.append((f'{self.name}_count', _format_labels(self.labelnames, key), cumulative))
+        return samples
+
+
+STAGE_SECONDS = Histogram('videotutor_render_stage_seconds', 'Time spent in each render stage', ['stage'])
+REQUESTS = Counter('videotutor_render_requests_total', 'Render requests answered, by outcome', ['outcome'])
+IN_FLIGHT = Gauge('videotutor_render_requests_in_flight', 'Render requests currently being answered')
+FALLBACKS = Counter('videotutor_render_fallbacks_total',
+                    'Renders answered by generate_safe_script or create_fallback_video', ['kind'])
+FAILURES = Counter('videotutor_render_failures_total', 'Failed render attempts by reason class', ['reason'])
+CACHE_LOOKUPS = Counter('videotutor_cache_lookups_total', 'Cache lookups by cache and result', ['cache', 'result'])
+CACHE_HIT_RATIO = Gauge('videotutor_cache_hit_ratio', 'Cache hits / lookups since start', ['cache'])
+QUEUE_DEPTH = Gauge('videotutor_render_queue_depth', 'Jobs waiting in the render queue', ['pool'])
+JOBS_IN_FLIGHT = Gauge('videotutor_render_jobs_in_flight', 'Jobs the render pool is running', ['pool'])
+POOL_JOBS = Counter('videotutor_render_pool_jobs_total', 'Render pool jobs by final state', ['pool', 'state'])
+START_TIME = Gauge('process_start_time_seconds', 'Start time of the process since unix epoch in seconds')
+IN_FLIGHT.set(0)
+START_TIME.set(time.time())
+
+
+def _cache_hit_ratio():
+    totals = {}
+    for (cache, result), value in CACHE_LOOKUPS.values().items():
+        hits, lookups = totals.get(cache, (0, 0))
+        totals[cache] = (hits + (value if result == 'hit' else 0), lookups + value)
+    return {(cache,): round(hits / lookups, 4) for cache, (hits, lookups) in totals.items() if lookups}
+
+
+CACHE_HIT_RATIO.add_source(_cache_hit_ratio)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time the enclosed block as render stage name (recorded even when it raises)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=name)
+
+
+@contextlib.contextmanager
+def in_flight():
+    """Count the enclosed block as one render request being answered"""
+    IN_FLIGHT.inc()
+    try:
+        yield
+    finally:
+        IN_FLIGHT.dec()
+
+
+def record_request(outcome):
+    """outcome: 'success', 'cached', 'fallback', 'failed' or 'rejected'"""
+    REQUESTS.inc(outcome=outcome)
+
+
+def record_fallback(kind):
+    """kind: 'safe_script' or 'fallback_video'"""
+    FALLBACKS.inc(kind=kind)
+
+
+def classify_failure(error):
+    """Reason class for an exception or error message"""
+    if isinstance(error, subprocess.TimeoutExpired):
+        return 'timeout'
+    text = f'{type(error).__name__}: {error}' if isinstance(error, BaseException) else str(error or '')
+    text = text.lower()
+    for reason, needles in FAILURE_PATTERNS:
+        if any(needle in text for needle in needles):
+            return reason
+    return 'other'
+
+
+def record_failure(error):
+    reason = classify_failure(error)
+    FAILURES.inc(reason=reason)
+    return reason
+
+
+def record_cache_lookups(cache, hits=0, misses=0):
+    if hits:
+        CACHE_LOOKUPS.inc(hits, cache=cache, result='hit')
+    if misses:
+        CACHE_LOOKUPS.inc(misses, cache=cache, result='miss')
+
+
+def watch_cache(name, cache):
+    """Export the hits/misses an in-process cache (anything with .hits/.misses) counts itself"""
+    CACHE_LOOKUPS.add_source(lambda: {(name, 'hit'): cache.hits, (name, 'miss'): cache.misses})
+
+
+def watch_pool(pool):
+    """Export queue depth, running jobs and job outcomes of a RenderWorkerPool"""
+    QUEUE_DEPTH.add_source(lambda: {(pool.name,): pool.stats()['queue_depth']})
+    JOBS_IN_FLIGHT.add_source(lambda: {(pool.name,): pool.stats()['busy']})
+
+    def outcomes():
+        stats = pool.stats()
+        return {(pool.name, state): stats[state]
+                for state in ('completed', 'failed', 'rejected', 'shed', 'cancelled')}
+    POOL_JOBS.add_source(outcomes)
+
+
+def exposition():
+    """Every metric in the Prometheus text format"""
+    with _lock:
+        families = list(_families)
+    lines = []
+    for family in families:
+        lines.append(f'# HELP {family.name} {family.help}')
+        lines.append(f'# TYPE {family.name} {family.kind}')
+        for name, labels, value in family.samples():
+            lines.append(f'{name}{labels} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def send_metrics(handler):
+    """Answer an http.server GET /metrics"""
+    body = exposition().encode('utf-8')
+    handler.send_response(200)
+    handler.send_header('Content-Type', CONTENT_TYPE)
+    handler.send_header('Content-Length', str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
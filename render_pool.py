@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Render Worker Pool
+Bounded set of render slots fed by a FIFO job queue, shared by the Manim servers
+"""
+
+import itertools
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+_local = threading.local()
+
+# Queue priorities - lower runs first, FIFO within a priority
+PRIORITY_FOREGROUND = 0
+PRIORITY_BACKGROUND = 10
+
+
+def current_job():
+    """The RenderJob running on the calling worker thread, if any"""
+    return getattr(_local, 'job', None)
+
+
+class QueueFullError(Exception):
+    """Raised when the render queue cannot accept more work"""
+
+
+class RenderJob:
+    """A single unit of render work tracked by the pool"""
+
+    def __init__(self, func, args=(), kwargs=None, priority=PRIORITY_FOREGROUND):
+        self.id = uuid.uuid4().hex[:12]
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.priority = priority
+        self.state = 'queued'
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = {}
+        self.cancel_event = threading.Event()
+        self.cancel_reason = None
+        self._events = []
+        self._cond = threading.Condition()
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the job finishes; returns False on timeout"""
+        return self._done.wait(timeout)
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self, reason='requested'):
+        """Ask the job to stop; queued jobs are skipped, running ones must poll cancel_event.
+
+        Returns False when the job already finished or was already cancelled.
+        """
+        if self.done or self.cancelled:
+            return False
+        self.cancel_reason = reason
+        self.cancel_event.set()
+        self.publish('cancel_requested', reason=reason)
+        return True
+
+    def publish(self, event, **data):
+        """Append an event to the job's stream and wake any listeners"""
+        with self._cond:
+            self._events.append({'event': event, 'data': {'job_id': self.id, 'time': time.time(), **data}})
+            self._cond.notify_all()
+
+    def update_progress(self, **fields):
+        self.progress.update(fields)
+        self.publish('progress', **self.progress)
+
+    def events_since(self, index, timeout=None):
+        """Events after index, waiting up to timeout for new ones unless the job is done"""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._events) > index or self.done, timeout)
+            return self._events[index:]
+
+    def _set_state(self, state):
+        self.state = state
+        self.publish('state', state=state)
+
+    def _finish(self, state, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.finished_at = time.time()
+        with self._cond:
+            self._done.set()
+            self._set_state(state)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'priority': self.priority,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+            'cancel_reason': self.cancel_reason,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class RenderWorkerPool:
+    """Fixed number of worker threads consuming a bounded FIFO queue.
+
+    submit() never blocks: when the queue is full the job is rejected with
+    QueueFullError. Jobs that waited longer than max_queue_wait by the time a
+    slot frees up are shed instead of rendered, since their client has
+    almost certainly given up.
+
+    submit_background() queues work nobody is waiting on; it only starts
+    once no foreground job is queued and is never shed. Background jobs have
+    their own queue limit (max_background_queue), so a burst of them never
+    takes the room foreground submits need.
+
+    submit_if_idle() queues a job only when a slot is free to start it, as
+    one step, so a caller can't lose the slot between checking and submitting.
+    """
+
+    def __init__(self, workers=4, max_queue=32, max_queue_wait=None, name='render',
+                 max_retained_jobs=1000, max_background_queue=None):
+        self.workers = max(1, int(workers))
+        self.max_queue = max(1, int(max_queue))
+        self.max_background_queue = max(1, int(max_background_queue or max_queue))
+        self.max_queue_wait = max_queue_wait
+        self.name = name
+        self.max_retained_jobs = max_retained_jobs
+        self._queue = queue.PriorityQueue()  # Bounded per priority class by _queued
+        self._queued = {PRIORITY_FOREGROUND: 0, PRIORITY_BACKGROUND: 0}
+        self._sequence = itertools.count()
+        self._jobs = OrderedDict()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._counters = {
+            'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'shed': 0, 'cancelled': 0
+        }
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f'{self.name}-worker-{i}',
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) and return its RenderJob"""
+        return self._enqueue(RenderJob(func, args, kwargs))
+
+    def submit_background(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) behind all foreground work"""
+        return self._enqueue(RenderJob(func, args, kwargs, priority=PRIORITY_BACKGROUND))
+
+    def submit_if_idle(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) only if a slot is idle; returns the RenderJob or None"""
+        return self._enqueue(RenderJob(func, args, kwargs), if_idle=True)
+
+    def _enqueue(self, job, if_idle=False):
+        self.start()
+        with self._lock:
+            if if_idle and not self._has_idle_slot_locked():
+                return None
+            if self._queued[job.priority] >= self._queue_limit(job.priority):
+                if if_idle:
+                    return None
+                self._counters['rejected'] += 1
+                kind = 'Background render' if job.priority == PRIORITY_BACKGROUND else 'Render'
+                raise QueueFullError(
+                    f'{kind} queue is full ({self._queued[job.priority]} waiting, {self.workers} slots busy)'
+                )
+            job.publish('state', state='queued')
+            self._queue.put_nowait((job.priority, next(self._sequence), job))
+            self._queued[job.priority] += 1
+            self._counters['submitted'] += 1
+            self._jobs[job.id] = job
+            self._prune_jobs_locked()
+        return job
+
+    def _queue_limit(self, priority):
+        return self.max_background_queue if priority == PRIORITY_BACKGROUND else self.max_queue
+
+    def get_job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """Every job the pool still tracks, oldest first"""
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _prune_jobs_locked(self):
+        """Forget the oldest finished jobs once more than max_retained_jobs are tracked"""
+        excess = len(self._jobs) - self.max_retained_jobs
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].done:
+                del self._jobs[job_id]
+                excess -= 1
+
+    def _worker_loop(self):
+        while True:
+            _, _, job = self._queue.get()
+            with self._lock:
+                self._queued[job.priority] -= 1
+            try:
+                waited = time.time() - job.created_at
+                shed_after = self.max_queue_wait if job.priority == PRIORITY_FOREGROUND else None
+                if shed_after is not None and waited > shed_after:
+                    with self._lock:
+                        self._counters['shed'] += 1
+                    job._finish('shed', error=f'Shed after waiting {waited:.1f}s in queue')
+                    continue
+                if job.cancelled:
+                    with self._lock:
+                        self._counters['cancelled'] += 1
+                    job._finish('cancelled', error='Cancelled before start')
+                    continue
+
+                with self._lock:
+                    self._busy += 1
+                job.started_at = time.time()
+                job._set_state('running')
+                _local.job = job
+                try:
+                    result = job.func(*job.args, **job.kwargs)
+                except Exception as e:
+                    with self._lock:
+                        self._counters['failed'] += 1
+                    job._finish('failed', error=str(e))
+                else:
+                    if job.cancelled:
+                        with self._lock:
+                            self._counters['cancelled'] += 1
+                        job._finish('cancelled', result=result, error='Cancelled while running')
+                    else:
+                        with self._lock:
+                            self._counters['completed'] += 1
+                        job._finish('done', result=result)
+                finally:
+                    _local.job = None
+                    with self._lock:
+                        self._busy -= 1
+            finally:
+                self._queue.task_done()
+
+    def _has_idle_slot_locked(self):
+        return self._busy + self._queue.qsize() < self.workers
+
+    def has_idle_slot(self):
+        """True when a newly submitted job would start immediately"""
+        with self._lock:
+            return self._has_idle_slot_locked()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'busy': self._busy,
+                'queue_depth': self._queue.qsize(),
+                'queue_capacity': self.max_queue,
+                'background_queue_depth': self._queued[PRIORITY_BACKGROUND],
+                'background_queue_capacity': self.max_background_queue,
+                **self._counters,
+            }
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Render Profiles
+Named output settings the render servers choose, not the scripts they run:
+
+  preview    854x480   @ 15 fps   interactive answers, progressive previews
+  standard   1280x720  @ 30 fps
+  final      1920x1080 @ 30 fps   background and published final renders
+
+Generated scripts (qwen_video_*.py, theoretical_question_*.py, the waterfall
+template) pin config.pixel_height / pixel_width / frame_rate at module
+level. That runs after Manim has parsed -ql, so a "preview" silently became
+a 1080p render. A profile is therefore applied after the script's module
+body has run:
+  - scripts handed to the CLI get a trailer re-applying it (enforce_script)
+  - persistent Manim workers re-apply the job's settings once the scene
+    module is imported (manim_workers)
+Assignments inside construct() aren't covered; the generated scripts don't
+make them.
+
+Clients may ask for a profile by name (Manim quality names are accepted as
+aliases); unknown names get the server's default.
+
+Usage:
+    profile = render_profiles.resolve(data.get('profile'), default='preview')
+    script = render_profiles.enforce_script(script, profile)
+    render_scene(script_path, scene, profile=profile, ...)      # or profile.cli_args()
+    response['profile'] = profile.to_dict()
+"""
+
+DEFAULT_PROFILE = 'preview'
+
+# Manim quality preset -> CLI -q letter
+QUALITY_FLAGS = {
+    'low_quality': 'l',
+    'medium_quality': 'm',
+    'high_quality': 'h',
+    'production_quality': 'p',
+    'fourk_quality': 'k',
+}
+
+
+class RenderProfile:
+    """Resolution, frame rate and time budget of one named profile"""
+
+    def __init__(self, name, pixel_width, pixel_height, frame_rate, quality, timeout):
+        self.name = name
+        self.pixel_width = pixel_width
+        self.pixel_height = pixel_height
+        self.frame_rate = frame_rate
+        self.quality = quality  # Manim preset the profile starts from
+        self.timeout = timeout
+
+    @property
+    def quality_flag(self):
+        return QUALITY_FLAGS[self.quality]
+
+    @property
+    def directory_name(self):
+        """Folder Manim writes this profile's videos into, e.g. 480p15"""
+        return f'{self.pixel_height}p{self.frame_rate}'
+
+    def config(self):
+        """Manim config values that make up the profile"""
+        return {
+            'pixel_width': self.pixel_width,
+            'pixel_height': self.pixel_height,
+            'frame_rate': self.frame_rate,
+        }
+
+    def cli_args(self):
+        """`manim` flags for the profile (the script trailer still has the last word)"""
+        return [f'-q{self.quality_flag}', '--resolution', f'{self.pixel_width},{self.pixel_height}',
+                '--fps', str(self.frame_rate)]
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'resolution': f'{self.pixel_width}x{self.pixel_height}',
+            'frame_rate': self.frame_rate,
+        }
+
+
+PROFILES = {
+    'preview': RenderProfile('preview', 854, 480, 15, 'low_quality', timeout=60),
+    'standard': RenderProfile('standard', 1280, 720, 30, 'medium_quality', timeout=120),
+    'final': RenderProfile('final', 1920, 1080, 30, 'high_quality', timeout=300),
+}
+
+ALIASES = {
+    'low_quality': 'preview', 'l': 'preview', 'low': 'preview',
+    'medium_quality': 'standard', 'm': 'standard', 'medium': 'standard',
+    'high_quality': 'final', 'h': 'final', 'high': 'final',
+}
+
+SCRIPT_TRAILER = '''
+
+# --- render profile {name!r}, appended by the render server: overrides any
+# --- config the script set above
+from manim import config as _render_profile_config
+_render_profile_config.pixel_width = {pixel_width}
+_render_profile_config.pixel_height = {pixel_height}
+_render_profile_config.frame_rate = {frame_rate}
+'''
+
+
+def resolve(name=None, default=DEFAULT_PROFILE):
+    """RenderProfile for a requested name (or an existing profile); the default when unknown"""
+    if isinstance(name, RenderProfile):
+        return name
+    key = ALIASES.get(name, name)
+    if key in PROFILES:
+        return PROFILES[key]
+    if name:
+        print(f"⚠️ Unknown render profile {name!r}, using {default}")
+    return PROFILES[ALIASES.get(default, default)]
+
+
+def enforce_script(script_content, profile):
+    """script_content with a trailer that re-applies profile after the module body"""
+    profile = resolve(profile)
+    return script_content.rstrip('\n') + '\n' + SCRIPT_TRAILER.format(name=profile.name, **profile.config())
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Render Resource Ledger
+One JSON line per Manim or ffmpeg run: CPU user/sys seconds, peak RSS, wall
+time, bytes written and the duration of the video produced, tagged with the
+render's script hash, question type and quality profile. Summing the lines
+gives the cost of a video per question type (for sizing the render fleet)
+and per script hash (for spotting pathological templates).
+
+CLI runs report the child's own rusage from wait4 (process_tree.run), which
+includes the latex/dvisvgm/ffmpeg processes it waited for. Renders on the
+persistent Manim workers report the worker's getrusage delta across the job.
+
+Only runs made inside a render context are recorded (a line that can't be
+attributed to a script or question type is no use for costing). The ledger
+is a size-rotated file per server process under RENDER_LEDGER_DIR
+(RENDER_LEDGER=0 turns it off).
+
+Usage:
+    with resource_ledger.render_context(script_hash=..., question_type=..., quality=...):
+        result = process_tree.run(cmd, ...)
+        resource_ledger.record('manim', result.rusage, result.wall_time, output_path=video)
+
+    python resource_ledger.py summary [LEDGER.jsonl ...]
+"""
+
+import contextlib
+import contextvars
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.absolute()
+RENDER_LEDGER = os.environ.get('RENDER_LEDGER', '1') != '0'
+RENDER_LEDGER_DIR = Path(os.environ.get('RENDER_LEDGER_DIR', BASE_DIR / 'logs' / 'render_ledger'))
+RENDER_LEDGER_MAX_BYTES = int(os.environ.get('RENDER_LEDGER_MAX_BYTES', 20 * 1024 ** 2))
+RENDER_LEDGER_BACKUPS = int(os.environ.get('RENDER_LEDGER_BACKUPS', 5))
+
+# Same keyword routing as the servers' script generators
+QUESTION_TYPES = (
+    ('triangle', ('triangle', '三角')),
+    ('equation', ('equation', '方程')),
+    ('inequality', ('inequality', '不等式')),
+)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_context = contextvars.ContextVar('render_ledger_context', default={})
+
+
+def question_type(question):
+    """Template family a question is rendered with"""
+    if not question:
+        return 'unknown'
+    text = str(question).lower()
+    for name, keywords in QUESTION_TYPES:
+        if any(keyword in text for keyword in keywords):
+            return name
+    return 'generic'
+
+
+def _maxrss_mb(maxrss):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def usage_from_rusage(rusage):
+    """Ledger fields of a struct_rusage (from wait4 or getrusage)"""
+    if rusage is None:
+        return {}
+    return {
+        'cpu_user': round(rusage.ru_utime, 3),
+        'cpu_sys': round(rusage.ru_stime, 3),
+        'max_rss_mb': _maxrss_mb(rusage.ru_maxrss),
+        'bytes_written': rusage.ru_oublock * 512,
+    }
+
+
+def usage_snapshot():
+    """This process's own and reaped children's usage so far, for usage_since()"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+
+
+def usage_since(snapshot):
+    """Usage accrued since snapshot. Peak RSS is the process high-water mark,
+    which is what a long-lived worker has to be sized for."""
+    now = usage_snapshot()
+    if snapshot is None or now is None:
+        return {}
+    (self_before, children_before), (self_now, children_now) = snapshot, now
+
+    def delta(field):
+        return (getattr(self_now, field) - getattr(self_before, field)
+                + getattr(children_now, field) - getattr(children_before, field))
+
+    return {
+        'cpu_user': round(delta('ru_utime'), 3),
+        'cpu_sys': round(delta('ru_stime'), 3),
+        'max_rss_mb': _maxrss_mb(max(self_now.ru_maxrss, children_now.ru_maxrss)),
+        'bytes_written': delta('ru_oublock') * 512,
+    }
+
+
+def bind(**fields):
+    """Tag the records this thread makes from now on with fields (script_hash,
+    question_type, quality, ...) and a shared render_id; returns a token for unbind()"""
+    return _context.set({'render_id': uuid.uuid4().hex[:12], **_context.get(), **fields})
+
+
+def unbind(token):
+    _context.reset(token)
+
+
+@contextlib.contextmanager
+def render_context(**fields):
+    """bind() for the duration of a block"""
+    token = bind(**fields)
+    try:
+        yield _context.get()
+    finally:
+        unbind(token)
+
+
+class ResourceLedger:
+    """Appends records to a size-rotated JSONL file"""
+
+    def __init__(self, path, max_bytes=RENDER_LEDGER_MAX_BYTES, backups=RENDER_LEDGER_BACKUPS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._logger = logging.getLogger(f'resource_ledger.{self.path}')
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        if not self._logger.handlers:
+            handler = logging.handlers.RotatingFileHandler(
+                self.path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._logger.addHandler(handler)
+
+    def write(self, entry):
+        self._logger.info(json.dumps(entry, ensure_ascii=False, sort_keys=True))
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_resource_ledger():
+    """Process-wide ledger, or None when RENDER_LEDGER=0"""
+    global _ledger
+    if not RENDER_LEDGER:
+        return None
+    with _ledger_lock:
+        if _ledger is None:
+            server = Path(sys.argv[0]).stem or 'render'
+            _ledger = ResourceLedger(RENDER_LEDGER_DIR / f'{server}.jsonl')
+        return _ledger
+
+
+def record(process, usage, wall_time, output_path=None, **fields):
+    """Write one ledger line for a finished Manim/ffmpeg run inside a render context.
+
+    usage is a struct_rusage or a dict from usage_since(); output_path is
+    sized and probed for its duration. Never raises: accounting must not
+    fail a render.
+    """
+    if not _context.get():
+        return None
+    ledger = get_resource_ledger()
+    if ledger is None:
+        return None
+    try:
+        entry = {
+            'time': round(time.time(), 3),
+            'server': Path(sys.argv[0]).stem,
+            'process': process,
+            'wall_time': round(wall_time, 3),
+            **_context.get(),
+            **(usage if isinstance(usage, dict) else usage_from_rusage(usage)),
+            **fields,
+        }
+        if output_path and os.path.exists(output_path):
+            from media_pipeline import probe_duration
+            entry['output_bytes'] = os.path.getsize(output_path)
+            entry['output_duration'] = probe_duration(output_path)
+        ledger.write(entry)
+        return entry
+    except Exception as e:
+        print(f"⚠️ Resource ledger write failed: {e}")
+        return None
+
+
+def summarize(paths):
+    """Cost per question type and the most expensive script hashes"""
+    by_type, by_script = {}, {}
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                cpu = entry.get('cpu_user', 0) + entry.get('cpu_sys', 0)
+                for table, key in ((by_type, entry.get('question_type', 'unknown')),
+                                   (by_script, entry.get('script_hash'))):
+                    if key is None:
+                        continue
+                    row = table.setdefault(key, {'runs': 0, 'renders': set(), 'cpu': 0.0, 'wall': 0.0,
+                                                 'max_rss_mb': 0.0, 'video_seconds': 0.0})
+                    row['runs'] += 1
+                    row['renders'].add(entry.get('render_id'))
+                    row['cpu'] += cpu
+                    row['wall'] += entry.get('wall_time', 0)
+                    row['max_rss_mb'] = max(row['max_rss_mb'], entry.get('max_rss_mb', 0))
+                    if entry.get('process') == 'manim':
+                        row['video_seconds'] += entry.get('output_duration') or 0
+    for table in (by_type, by_script):
+        for row in table.values():
+            renders = len(row.pop('renders')) or 1
+            row['renders'] = renders
+            row['cpu_per_video'] = round(row['cpu'] / renders, 2)
+            row['wall_per_video'] = round(row['wall'] / renders, 2)
+            row['cpu_per_video_second'] = round(row['cpu'] / row['video_seconds'], 2) if row['video_seconds'] else None
+    worst = sorted(by_script.items(), key=lambda item: item[1]['cpu_per_video'], reverse=True)[:10]
+    return {'by_question_type': by_type, 'costliest_scripts': dict(worst)}
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] != 'summary':
+        print(__doc__)
+        return 1
+    paths = argv[2:] or sorted(glob.glob(str(RENDER_LEDGER_DIR / '*.jsonl*')))
+    print(json.dumps(summarize(paths), indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
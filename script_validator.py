@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Manim Script Validator
+Static pre-flight checks for generated Manim scripts so broken LLM output is
+rejected in milliseconds instead of after a full Manim subprocess has died
+"""
+
+import ast
+import builtins
+import json
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+from render_cache import manim_version
+
+# Not under temp/: the storage manager sweeps that, which would bring the cold probe back
+SYMBOL_CACHE_DIR = Path(os.environ.get('MANIM_SYMBOL_CACHE_DIR', Path(__file__).parent.absolute() / 'symbol_cache'))
+
+# Calls and imports that can never work inside a headless render
+UNSUPPORTED_CALLS = {'input', 'breakpoint', 'exit', 'quit'}
+UNSUPPORTED_MODULES = {'tkinter', 'turtle', 'pygame', 'IPython'}
+
+MODULE_NAMES = {'__name__', '__file__', '__doc__', '__builtins__', '__spec__', '__loader__'}
+
+_symbols_lock = threading.Lock()
+_symbols = {}
+_probes = {}  # Manim version -> Event set once its probe has finished
+
+SYMBOL_PROBE = (
+    'import json, manim; '
+    'names = getattr(manim, "__all__", None) or [n for n in dir(manim) if not n.startswith("_")]; '
+    'print(json.dumps(sorted(names)))'
+)
+
+
+def _probe_symbols(version, python_cmd, done):
+    """Import Manim in a child interpreter and cache its exported names"""
+    cache_file = SYMBOL_CACHE_DIR / f'manim_symbols_{version}.json'
+    symbols = None
+    try:
+        result = subprocess.run(
+            [python_cmd or sys.executable, '-c', SYMBOL_PROBE],
+            capture_output=True, text=True, timeout=120
+        )
+        if result.returncode == 0:
+            symbols = set(json.loads(result.stdout.strip().splitlines()[-1]))
+            SYMBOL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            cache_file.write_text(json.dumps(sorted(symbols)), encoding='utf-8')
+    except (OSError, ValueError, IndexError, subprocess.TimeoutExpired):
+        symbols = None
+    with _symbols_lock:
+        _symbols[version] = symbols
+    done.set()
+
+
+def manim_symbols(python_cmd=None, wait=False):
+    """Names exported by `from manim import *`, or None if they aren't known (yet).
+
+    Importing Manim costs seconds, so the set is computed once per Manim
+    version in a child interpreter and cached on disk. A cold cache starts
+    that probe in the background and returns None, which only disables the
+    checks that need the symbols; wait=True blocks until the probe is done.
+    """
+    version = manim_version()
+    if version == 'unknown':
+        return None
+    with _symbols_lock:
+        if version in _symbols:
+            return _symbols[version]
+
+        cache_file = SYMBOL_CACHE_DIR / f'manim_symbols_{version}.json'
+        if cache_file.exists():
+            try:
+                _symbols[version] = set(json.loads(cache_file.read_text(encoding='utf-8')))
+                return _symbols[version]
+            except (OSError, ValueError):
+                pass
+
+        done = _probes.get(version)
+        if done is None:
+            done = _probes[version] = threading.Event()
+            threading.Thread(target=_probe_symbols, args=(version, python_cmd, done),
+                             name='manim-symbols', daemon=True).start()
+    if wait:
+        done.wait()
+    with _symbols_lock:
+        return _symbols.get(version)
+
+
+def _bound_names(tree):
+    """Every name the script binds anywhere (module-wide approximation of scoping)"""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name != '*':
+                    names.add(alias.asname or alias.name.split('.')[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+    return names
+
+
+def _base_name(base):
+    if isinstance(base, ast.Name):
+        return base.id
+    if isinstance(base, ast.Attribute):
+        return base.attr
+    return None
+
+
+def _find_scene(tree, symbols):
+    """First class deriving (directly or via another script class) from a Manim Scene"""
+    scene_classes = set()
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        for base in node.bases:
+            name = _base_name(base)
+            if name is None:
+                continue
+            is_manim_scene = name.endswith('Scene') and (symbols is None or name in symbols)
+            if is_manim_scene or name in scene_classes:
+                scene_classes.add(node.name)
+                has_construct = any(
+                    isinstance(item, ast.FunctionDef) and item.name == 'construct'
+                    for item in node.body
+                )
+                if has_construct or name in scene_classes:
+                    return node.name
+    return None
+
+
+def validate_manim_script(script_content, symbols=None):
+    """Compile and statically check a Manim script.
+
+    Returns {'valid', 'scene_name', 'error_type', 'errors'}; error_type is one of
+    SyntaxError, NameError, SceneNotFound or Unsupported.
+    """
+    result = {'valid': False, 'scene_name': None, 'error_type': None, 'errors': []}
+
+    try:
+        tree = ast.parse(script_content)
+        compile(tree, '<manim script>', 'exec')
+    except SyntaxError as e:
+        result['error_type'] = 'SyntaxError'
+        result['errors'].append(f'SyntaxError: {e.msg} (line {e.lineno})')
+        return result
+
+    star_imports = {
+        node.module for node in ast.walk(tree)
+        if isinstance(node, ast.ImportFrom) and any(alias.name == '*' for alias in node.names)
+    }
+    manim_star = 'manim' in star_imports
+    if manim_star and symbols is None:
+        symbols = manim_symbols()
+
+    # Unsupported constructs
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in UNSUPPORTED_CALLS:
+            result['errors'].append(f'Unsupported call {node.func.id}() (line {node.lineno})')
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            modules = [alias.name for alias in node.names] if isinstance(node, ast.Import) else [node.module or '']
+            for module in modules:
+                if module.split('.')[0] in UNSUPPORTED_MODULES:
+                    result['errors'].append(f'Unsupported import {module} (line {node.lineno})')
+    if result['errors']:
+        result['error_type'] = 'Unsupported'
+        return result
+
+    scene_name = _find_scene(tree, symbols if manim_star else None)
+    if scene_name is None:
+        result['error_type'] = 'SceneNotFound'
+        result['errors'].append('No Scene subclass with a construct() method found')
+        return result
+    result['scene_name'] = scene_name
+
+    # Undefined names - only decidable when every star import is Manim's and its symbols are known
+    if star_imports <= {'manim'} and (not manim_star or symbols is not None):
+        known = _bound_names(tree) | set(dir(builtins)) | MODULE_NAMES | (symbols or set())
+        seen = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+                if node.id not in known and node.id not in seen:
+                    seen.add(node.id)
+                    result['errors'].append(f"NameError: name '{node.id}' is not defined (line {node.lineno})")
+        if result['errors']:
+            result['error_type'] = 'NameError'
+            return result
+
+    result['valid'] = True
+    return result
+
+
+CJK_RANGE = ('一', '鿿')
+TEXT_MOBJECTS = {'Text', 'MarkupText', 'Paragraph'}
+LATEX_MOBJECTS = {'MathTex', 'Tex', 'SingleStringMathTex'}
+
+
+def _has_cjk(value):
+    return any(CJK_RANGE[0] <= char <= CJK_RANGE[1] for char in value)
+
+
+def score_script_risk(script_content):
+    """Heuristic 0..1 likelihood that a script fails to render.
+
+    Features mirror the failures we see in production: CJK strings in Text
+    (font lookup), CJK inside LaTeX (never compiles), heavy raw LaTeX and
+    very long scripts.
+    """
+    features = {
+        'cjk_text': 0,
+        'cjk_latex': 0,
+        'latex_calls': 0,
+        'lines': script_content.count('\n') + 1,
+        'play_calls': script_content.count('self.play('),
+    }
+    try:
+        tree = ast.parse(script_content)
+    except SyntaxError:
+        return {'score': 1.0, 'features': features}
+
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        name = _base_name(node.func)
+        strings = [
+            arg.value for arg in node.args
+            if isinstance(arg, ast.Constant) and isinstance(arg.value, str)
+        ]
+        if name in TEXT_MOBJECTS and any(_has_cjk(value) for value in strings):
+            features['cjk_text'] += 1
+        elif name in LATEX_MOBJECTS:
+            features['latex_calls'] += 1
+            if any(_has_cjk(value) for value in strings):
+                features['cjk_latex'] += 1
+
+    score = 0.0
+    if features['cjk_latex']:
+        score += 0.6
+    if features['cjk_text']:
+        score += 0.35
+    score += min(0.3, 0.05 * features['latex_calls'])
+    if features['lines'] > 300:
+        score += 0.3
+    elif features['lines'] > 150:
+        score += 0.15
+    if features['play_calls'] > 25:
+        score += 0.1
+    return {'score': round(min(score, 1.0), 3), 'features': features}
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Parallel Section Rendering
+Renders one Manim scene as N contiguous animation ranges on separate worker
+processes and joins the pieces with a stream-copy concat.
+
+Each section re-runs construct() but skips every animation outside its range
+(Manim's from/upto animation numbers), so skipped animations only update
+state and write no frames. A counting pass on a worker (every animation
+skipped) records when each animation starts and where the scene marks steps
+with self.next_section(); cuts snap to those step boundaries and are balanced
+by running time. The pieces, and the narration audio when given, are
+written to the final file in one ffmpeg pass (media_pipeline.finalize_video).
+
+render_in_sections() returns None when persistent workers are unavailable;
+callers then render the scene in one piece.
+"""
+
+import concurrent.futures
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import render_metrics
+import resource_ledger
+from manim_workers import get_worker_pool
+from media_pipeline import finalize_video
+
+
+def plan_sections(animation_times, total_time, section_starts, count):
+    """Pick contiguous animation ranges of roughly equal running time.
+
+    animation_times[i] is when animation i starts; cuts snap to
+    section_starts when the scene marks any, otherwise to any animation.
+    Returns [(first_animation, last_animation), ...] with inclusive ends.
+    """
+    animations = len(animation_times)
+    candidates = sorted({i for i in section_starts if 0 < i < animations}) or list(range(1, animations))
+    cuts = []
+    for k in range(1, count):
+        target = total_time * k / count
+        later = [i for i in candidates if not cuts or i > cuts[-1]]
+        if not later:
+            break
+        best = min(later, key=lambda i: abs(animation_times[i] - target))
+        if animation_times[best] > (animation_times[cuts[-1]] if cuts else 0):
+            cuts.append(best)
+    starts = [0] + cuts
+    ends = cuts + [animations]
+    return [(first, end - 1) for first, end in zip(starts, ends) if end > first]
+
+
+def render_in_sections(script_path, scene_name, output_path, sections, profile='final',
+                       media_dir=None, timeout=300, audio_path=None):
+    """Render scene_name in up to `sections` parallel pieces into output_path.
+
+    audio_path, when given, is muxed in while the pieces are joined.
+
+    Returns a render_scene-style result dict ({'success', 'video_path', ...}),
+    or None when the persistent worker pool can't be used.
+    """
+    pool = get_worker_pool()
+    if pool is None or sections < 2:
+        return None
+    started = time.time()
+    deadline = started + timeout
+
+    count = pool.render(script_path, scene_name, profile=profile, media_dir=media_dir,
+                        count_only=True, timeout=timeout)
+    if count is None:
+        return None
+    if not count['success']:
+        return count
+
+    plan = plan_sections(count['animation_times'], count['total_time'], count['section_starts'],
+                         min(sections, pool.size))
+    if len(plan) < 2:
+        return None
+
+    work_dir = Path(tempfile.mkdtemp(prefix=f'sections_{scene_name}_', dir=media_dir))
+    try:
+        def render_part(index, first, last):
+            part_dir = work_dir / f'part{index:02d}'
+            return pool.render(
+                script_path, scene_name, profile=profile, media_dir=media_dir,
+                output_file=f'part{index:02d}.mp4', timeout=max(1, deadline - time.time()),
+                config={
+                    'video_dir': str(part_dir),
+                    'from_animation_number': first,
+                    'upto_animation_number': last,
+                }
+            )
+
+        with render_metrics.stage('manim'), \
+                concurrent.futures.ThreadPoolExecutor(max_workers=len(plan)) as executor:
+            futures = [executor.submit(render_part, i, first, last) for i, (first, last) in enumerate(plan)]
+            results = [future.result() for future in futures]
+
+        for index, result in enumerate(results):
+            if result is not None:
+                resource_ledger.record('manim', result.get('usage', {}), result.get('wall_time', 0),
+                                       output_path=result.get('video_path'), worker=True, section=index,
+                                       returncode=0 if result['success'] else 1)
+        for index, result in enumerate(results):
+            if result is None:
+                return None
+            if not result['success']:
+                result['error'] = f"Section {index + 1}/{len(plan)} failed: {result['error']}"
+                return result
+
+        try:
+            concat_mode = finalize_video([result['video_path'] for result in results], output_path,
+                                         audio_path=audio_path)
+        except (RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+            return {'success': False, 'error': str(e), 'stderr': str(e)}
+        return {
+            'success': True,
+            'video_path': str(output_path),
+            'sections': len(plan),
+            'animations': count['animations'],
+            'plan': plan,
+            'concat': concat_mode,
+            'has_audio': bool(audio_path),
+            'segments_reused': sum(result.get('segments_reused', 0) for result in results),
+            'segment_misses': sum(result.get('segment_misses', 0) for result in results),
+            'segments_stored': sum(result.get('segments_stored', 0) for result in results),
+            'wall_time': time.time() - started,
+            'section_wall_times': [round(result['wall_time'], 2) for result in results],
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
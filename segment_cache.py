@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Shared Partial Movie Segment Cache
+Manim renders every play() call to a partial movie file named after the
+hash of the animation, its mobjects and the camera config, and skips the
+animation when that file already exists. The file lives under
+media/videos/<script name>/..., and the servers name scripts after the
+request, so every job starts with an empty directory and nothing is reused.
+
+This cache keeps those segments in one directory keyed by the same hash.
+Inside a Manim worker, install_manim_hook() makes Manim's cache lookup fall
+through to it (the hit is hardlinked into the job's partial movie
+directory), and collect() publishes the segments a render produced. The
+hash covers resolution and frame rate, so one flat directory serves every
+quality. Eviction works from the directory itself, like tex_cache.
+
+The lookups happen in the workers, so the servers feed the counts each
+render reports back through record_render(); stats() serves the directory
+size from the last eviction pass or scan, rescanning at most every
+USAGE_REFRESH_INTERVAL seconds.
+"""
+
+import os
+import threading
+import time
+from pathlib import Path
+
+from render_cache import link_or_copy
+
+BASE_DIR = Path(__file__).parent.absolute()
+SEGMENT_CACHE_DIR = Path(os.environ.get('MANIM_SEGMENT_CACHE_DIR', BASE_DIR / 'segment_cache'))
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get('MANIM_SEGMENT_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+SEGMENT_EXTENSIONS = ('.mp4', '.mov', '.webm')
+
+
+def is_cacheable(name):
+    """False for segments rendered with caching disabled (Manim names them uncached_NNNNN)"""
+    return not name.startswith('uncached_') and Path(name).suffix in SEGMENT_EXTENSIONS
+
+
+class SegmentCache:
+    """Directory of <animation hash>.mp4 files shared between processes"""
+
+    USAGE_REFRESH_INTERVAL = 60  # Seconds a directory size figure is served before rescanning
+
+    def __init__(self, cache_dir=SEGMENT_CACHE_DIR, max_bytes=SEGMENT_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evictions = 0
+        self._usage = None  # (entries, bytes, measured at)
+
+    def path_for(self, name):
+        return self.cache_dir / name
+
+    def get(self, name):
+        """Path of the cached segment (refreshing its recency) or None"""
+        path = self.path_for(name)
+        try:
+            os.utime(path, None)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def _scan(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not is_cacheable(entry.name):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, Path(entry.path)))
+        return entries
+
+    def evict(self, keep=()):
+        """Drop least recently used segments until the directory fits max_bytes"""
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path in keep:
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                continue  # Another process evicted it first
+            total -= size
+            count -= 1
+            with self._lock:
+                self.evictions += 1
+        with self._lock:
+            self._usage = (count, total, time.time())
+        return total
+
+    def collect(self, part_dir):
+        """Publish the segments a render wrote to its partial movie directory; returns how many were new"""
+        added = []
+        part_dir = Path(part_dir)
+        if not part_dir.is_dir():
+            return 0
+        for segment in part_dir.iterdir():
+            if not is_cacheable(segment.name) or self.path_for(segment.name).exists():
+                continue
+            try:
+                link_or_copy(segment, self.path_for(segment.name))
+            except OSError:
+                continue
+            added.append(self.path_for(segment.name))
+        if added:
+            with self._lock:
+                self.stored += len(added)
+            self.evict(keep=set(added))
+        return len(added)
+
+    def record_render(self, result):
+        """Count the segment lookups and stores a worker render reported in its result"""
+        with self._lock:
+            self.hits += result.get('segments_reused', 0)
+            self.misses += result.get('segment_misses', 0)
+            self.stored += result.get('segments_stored', 0)
+
+    def _current_usage(self):
+        with self._lock:
+            usage = self._usage
+        if usage is None or time.time() - usage[2] >= self.USAGE_REFRESH_INTERVAL:
+            entries = self._scan()
+            usage = (len(entries), sum(size for _, size, _ in entries), time.time())
+            with self._lock:
+                self._usage = usage
+        return usage
+
+    def stats(self):
+        entries, total, measured_at = self._current_usage()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'bytes': total,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stored': self.stored,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'updated_at': measured_at,
+            }
+
+
+def install_manim_hook(cache):
+    """Make Manim's partial movie cache lookup fall through to cache in this process"""
+    from manim import config
+    from manim.scene.scene_file_writer import SceneFileWriter
+
+    original = SceneFileWriter.is_already_cached
+    if getattr(original, '_segment_cache', None) is cache:
+        return
+
+    def is_already_cached(self, hash_invocation):
+        if original(self, hash_invocation):
+            return True
+        if not config['write_to_movie']:
+            return False
+        name = f"{hash_invocation}{config['movie_file_extension']}"
+        if not is_cacheable(name) or not hasattr(self, 'partial_movie_directory'):
+            return False
+        cached = cache.get(name)
+        if cached is None:
+            return False
+        try:
+            link_or_copy(cached, Path(self.partial_movie_directory) / name)
+        except OSError:
+            return False  # Evicted between lookup and link - render it
+        return True
+
+    is_already_cached._segment_cache = cache
+    SceneFileWriter.is_already_cached = is_already_cached
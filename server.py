@@ -7,10 +7,6 @@ MathTutor AI 本地测试服务器
 import http.server
 import socketserver
 import json
-import urllib.request
-import urllib.parse
-import os
-from urllib.error import URLError, HTTPError
 import time
 import sys
 import platform
@@ -18,6 +14,32 @@ import subprocess
 import ssl
 import socket
 
+import render_metrics
+from upstream_client import HTTPSConnectionPool, UpstreamHTTPError, proxy_from_environment
+from upstream_health import CircuitBreaker, UpstreamHealthMonitor, is_upstream_failure, pool_probe
+
+DASHSCOPE_HOST = 'dashscope.aliyuncs.com'
+DASHSCOPE_GENERATION_PATH = '/api/v1/services/aigc/text-generation/generation'
+
+
+def create_dashscope_ssl_context():
+    """创建更强大的SSL上下文（整个进程共用一个）"""
+    ssl_context = ssl.create_default_context()
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+    ssl_context.set_ciphers('DEFAULT@SECLEVEL=1')  # 降低SSL安全级别以兼容更多服务器
+    return ssl_context
+
+
+# 通义千问API的长连接池：复用TCP/TLS连接，每个请求单独设置超时
+DASHSCOPE_POOL = HTTPSConnectionPool(
+    DASHSCOPE_HOST, ssl_context=create_dashscope_ssl_context(), proxy=proxy_from_environment()
+)
+
+# 通义千问API的熔断器：由真实请求结果和后台探测共同驱动，请求处理只读取状态
+DASHSCOPE_BREAKER = CircuitBreaker('dashscope')
+DASHSCOPE_MONITOR = UpstreamHealthMonitor(DASHSCOPE_BREAKER, probe=pool_probe(DASHSCOPE_POOL))
+
 class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     def end_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
@@ -29,34 +51,25 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         self.send_response(200)
         self.end_headers()
 
+    def do_GET(self):
+        if self.path == '/metrics':
+            render_metrics.send_metrics(self)
+        elif self.path == '/api/upstream':
+            body = json.dumps({**DASHSCOPE_POOL.stats(), 'health': DASHSCOPE_BREAKER.snapshot()}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            super().do_GET()
+
     def do_POST(self):
         if self.path == '/api/qwen':
             self.handle_qwen_api()
         else:
             self.send_error(404, "Not Found")
 
-    def test_network_connectivity(self):
-        """测试网络连接性"""
-        test_urls = [
-            'https://www.baidu.com',
-            'https://www.google.com',
-            'https://dashscope.aliyuncs.com'
-        ]
-        
-        print("🔍 开始网络连接性测试...")
-        for url in test_urls:
-            try:
-                print(f"  📡 测试 {url}...")
-                req = urllib.request.Request(url)
-                with urllib.request.urlopen(req, timeout=10) as response:
-                    print(f"  ✅ {url} 连接正常 (状态码: {response.code})")
-                    return True
-            except Exception as e:
-                print(f"  ❌ {url} 连接失败: {type(e).__name__}")
-        
-        print("⚠️  网络连接性测试失败，可能存在网络问题")
-        return False
-
     def handle_qwen_api(self):
         try:
             # 读取请求体
@@ -76,9 +89,9 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             print(f"🔑 API密钥: {api_key[:8]}...")
             print(f"💬 消息数量: {len(request_data.get('messages', []))}")
             
-            # 测试网络连接性
-            if not self.test_network_connectivity():
-                print("🔄 网络连接异常，直接使用备用响应...")
+            # 熔断器打开（上游不可用）时直接使用备用响应，不再逐个请求探测网络
+            if not DASHSCOPE_BREAKER.allow_request():
+                print(f"🔄 通义千问API熔断中 ({DASHSCOPE_BREAKER.state})，直接使用备用响应...")
                 fallback_response = self.create_enhanced_fallback_response(request_data.get('messages', []))
                 self.send_response(200)
                 self.send_header('Content-Type', 'application/json')
@@ -99,32 +112,12 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 }
             }
             
-            # 创建更强大的SSL上下文
-            ssl_context = ssl.create_default_context()
-            ssl_context.check_hostname = False
-            ssl_context.verify_mode = ssl.CERT_NONE
-            ssl_context.set_ciphers('DEFAULT@SECLEVEL=1')  # 降低SSL安全级别以兼容更多服务器
-            
-            # 创建请求
-            req = urllib.request.Request(
-                'https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation',
-                data=json.dumps(qwen_data).encode('utf-8'),
-                headers={
-                    'Authorization': f'Bearer {api_key}',
-                    'Content-Type': 'application/json',
-                    'User-Agent': 'MathTutor-AI/1.0'
-                }
-            )
-            
-            # 设置代理（如果环境变量存在）
-            proxy_handler = None
-            if os.environ.get('HTTP_PROXY') or os.environ.get('HTTPS_PROXY'):
-                proxy_url = os.environ.get('HTTPS_PROXY') or os.environ.get('HTTP_PROXY')
-                print(f"🌐 使用代理: {proxy_url}")
-                proxy_handler = urllib.request.ProxyHandler({
-                    'http': proxy_url,
-                    'https': proxy_url
-                })
+            request_body = json.dumps(qwen_data).encode('utf-8')
+            request_headers = {
+                'Authorization': f'Bearer {api_key}',
+                'Content-Type': 'application/json',
+                'User-Agent': 'MathTutor-AI/1.0'
+            }
             
             try:
                 print(f"🌐 正在调用通义千问API... [{time.strftime('%Y-%m-%d %H:%M:%S')}]")
@@ -139,44 +132,44 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                     try:
                         print(f"🔄 尝试第 {attempt + 1} 次连接 (超时: {timeout_values[attempt]}秒)...")
                         
-                        # 创建opener
-                        opener = urllib.request.build_opener()
-                        if proxy_handler:
-                            opener.add_handler(proxy_handler)
-                        
-                        # 设置更长的超时时间
-                        socket.setdefaulttimeout(timeout_values[attempt])
+                        # 从连接池取长连接发送请求，超时只作用于本次请求
+                        status, _, response_body = DASHSCOPE_POOL.request(
+                            'POST', DASHSCOPE_GENERATION_PATH, body=request_body,
+                            headers=request_headers, timeout=timeout_values[attempt]
+                        )
+                        DASHSCOPE_BREAKER.record_success()
+                        response_data = response_body.decode('utf-8')
+                        print(f"✅ API调用成功: {status} [{time.strftime('%Y-%m-%d %H:%M:%S')}]")
+                        print(f"📊 响应大小: {len(response_data)} 字符")
                         
-                        # 修复: 将ssl_context添加到HTTPSHandler
-                        opener.add_handler(urllib.request.HTTPSHandler(context=ssl_context))
-                        # 调用open，不传context参数
-                        with opener.open(req) as response:
-                            response_data = response.read().decode('utf-8')
-                            print(f"✅ API调用成功: {response.code} [{time.strftime('%Y-%m-%d %H:%M:%S')}]")
-                            print(f"📊 响应大小: {len(response_data)} 字符")
-                            
-                            # 返回成功响应
-                            self.send_response(200)
-                            self.send_header('Content-Type', 'application/json')
-                            self.end_headers()
-                            self.wfile.write(response_data.encode('utf-8'))
-                            return  # 成功后立即返回
+                        # 返回成功响应
+                        self.send_response(200)
+                        self.send_header('Content-Type', 'application/json')
+                        self.end_headers()
+                        self.wfile.write(response_data.encode('utf-8'))
+                        return  # 成功后立即返回
                             
-                    except (URLError, TimeoutError, socket.timeout, ssl.SSLError) as retry_error:
+                    except (UpstreamHTTPError, OSError, TimeoutError, socket.timeout, ssl.SSLError) as retry_error:
+                        DASHSCOPE_BREAKER.record_exception(retry_error)  # 4xx说明上游可达，5xx/429才算故障
                         error_type = type(retry_error).__name__
                         error_msg = str(retry_error)
                         print(f"⚠️  第 {attempt + 1} 次尝试失败: {error_type}")
                         print(f"   错误详情: {error_msg}")
                         
+                        if not is_upstream_failure(retry_error):  # 密钥错误等4xx重试也无用
+                            raise retry_error
                         if attempt == max_retries - 1:  # 最后一次尝试
                             raise retry_error
+                        if not DASHSCOPE_BREAKER.allow_request():  # 失败已触发熔断，不再重试
+                            print(f"   通义千问API熔断 ({DASHSCOPE_BREAKER.state})，停止重试")
+                            raise retry_error
                         
                         # 等待时间递增
                         wait_time = (attempt + 1) * 2
                         print(f"   等待 {wait_time} 秒后重试...")
                         time.sleep(wait_time)
                         
-            except (HTTPError, ssl.SSLError, URLError, TimeoutError, socket.timeout, Exception) as e:
+            except (UpstreamHTTPError, ssl.SSLError, OSError, TimeoutError, socket.timeout, Exception) as e:
                 print(f"⚠️  API调用遇到问题: {type(e).__name__}: {str(e)} [{time.strftime('%Y-%m-%d %H:%M:%S')}]")
                 print("🔄 使用增强备用响应机制...")
                 
@@ -382,7 +375,8 @@ def run_server():
                 else:
                     print(f"请手动释放端口 {attempt_port}")
                     continue
-            # 端口可用，启动服务器
+            # 端口可用，启动后台上游健康监测，然后启动服务器
+            DASHSCOPE_MONITOR.start()
             with socketserver.TCPServer(("", attempt_port), CORSHTTPRequestHandler) as httpd:
                 print(f"\n🚀 MathTutor AI 测试服务器启动成功!")
                 print(f"📡 服务器地址: http://localhost:{attempt_port}")
@@ -393,6 +387,7 @@ def run_server():
                 print("  ✅ 代理通义千问API调用")
                 print("  ✅ 本地文件服务")
                 print("  ✅ 实时错误处理")
+                print("  ✅ 上游熔断与后台健康监测")
                 print("💡 使用说明:")
                 print("  1. 保持此终端窗口打开")
                 print("  2. 在浏览器中打开测试页面")
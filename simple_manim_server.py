@@ -12,17 +12,29 @@ import os
 import subprocess
 import logging
 import socket
-import time
 from pathlib import Path
 
+import process_tree
+import render_metrics
+from media_pipeline import is_faststart
+from render_cache import link_or_copy, temp_sibling
+from storage_manager import get_storage_manager
+from video_serving import serve_from_directory
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Canned video every fallback response publishes (as a hardlink) under its own name
+FALLBACK_VIDEO = os.path.join('rendered_videos', 'fallback_math_video.mp4')
+
 class ManimAPIHandler(http.server.BaseHTTPRequestHandler):
     def do_GET(self):
         """Handle GET requests"""
-        if self.path == '/health':
+        if self.path == '/metrics':
+            render_metrics.send_metrics(self)
+
+        elif self.path == '/health':
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
@@ -43,18 +55,9 @@ class ManimAPIHandler(http.server.BaseHTTPRequestHandler):
                 self.send_header('Access-Control-Allow-Origin', '*')
                 self.end_headers()
                 self.wfile.write(fallback_text.encode())
-            elif os.path.exists(file_path):
-                self.send_response(200)
-                self.send_header('Content-type', 'video/mp4')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                
-                with open(file_path, 'rb') as f:
-                    self.wfile.write(f.read())
             else:
-                self.send_response(404)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
+                # Range/ETag aware, zero-copy; answers 404 for missing files
+                serve_from_directory(self, 'rendered_videos', filename)
         else:
             self.send_response(404)
             self.end_headers()
@@ -76,7 +79,10 @@ class ManimAPIHandler(http.server.BaseHTTPRequestHandler):
                 logger.info(f"Received render request: {output_name}")
                 
                 # Try to generate real video first
-                if self.generate_real_video(script, output_name, scene_name):
+                with render_metrics.in_flight():
+                    generated = self.generate_real_video(script, output_name, scene_name)
+                if generated:
+                    render_metrics.record_request('success')
                     response_data = {
                         'success': True,
                         'video_url': f'/rendered_videos/{output_name}.mp4',
@@ -84,7 +90,10 @@ class ManimAPIHandler(http.server.BaseHTTPRequestHandler):
                     }
                 else:
                     # Fallback to simple video creation
+                    render_metrics.record_failure('ffmpeg')
                     self.create_fallback_video(output_name)
+                    render_metrics.record_fallback('fallback_video')
+                    render_metrics.record_request('fallback')
                     response_data = {
                         'success': True,
                         'video_url': f'/rendered_videos/{output_name}.mp4',
@@ -102,6 +111,8 @@ class ManimAPIHandler(http.server.BaseHTTPRequestHandler):
                 
             except Exception as e:
                 logger.error(f"Error processing request: {e}")
+                render_metrics.record_request('failed')
+                render_metrics.record_failure(e)
                 self.send_response(500)
                 self.send_header('Content-type', 'application/json') 
                 self.send_header('Access-Control-Allow-Origin', '*')
@@ -118,7 +129,7 @@ class ManimAPIHandler(http.server.BaseHTTPRequestHandler):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS, HEAD')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Range, If-None-Match, If-Range')
         self.end_headers()
     
     def do_HEAD(self):
@@ -131,23 +142,13 @@ class ManimAPIHandler(http.server.BaseHTTPRequestHandler):
             
         elif self.path.startswith('/rendered_videos/'):
             filename = self.path.replace('/rendered_videos/', '')
-            file_path = os.path.join('rendered_videos', filename)
-            
-            if os.path.exists(file_path):
-                self.send_response(200)
-                self.send_header('Content-type', 'video/mp4')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Content-Length', str(os.path.getsize(file_path)))
-                self.end_headers()
-            else:
-                self.send_response(404)
-                self.end_headers()
+            serve_from_directory(self, 'rendered_videos', filename, head=True)
         else:
             self.send_response(404)
             self.end_headers()
     
     def create_fallback_video(self, output_name):
-        """Create a real video using Windows ffmpeg"""
+        """Publish the canned fallback video as output_name without copying its bytes"""
         output_dir = 'rendered_videos'
         os.makedirs(output_dir, exist_ok=True)
         
@@ -156,7 +157,25 @@ class ManimAPIHandler(http.server.BaseHTTPRequestHandler):
         # If video already exists, don't recreate
         if os.path.exists(video_path):
             return
-            
+        
+        if is_faststart(FALLBACK_VIDEO) or self.create_fallback_asset(FALLBACK_VIDEO):
+            link_or_copy(FALLBACK_VIDEO, video_path)
+            logger.info(f"Published fallback video: {video_path}")
+            return
+        
+        # No canned video: this request gets a placeholder of its own and the
+        # next fallback tries ffmpeg again
+        tmp_path = str(temp_sibling(video_path))
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('# Math Video Placeholder\nMath video content would be here.\n')
+        os.replace(tmp_path, video_path)
+        logger.info(f"Created text placeholder: {video_path}")
+    
+    def create_fallback_asset(self, video_path):
+        """Create the canned fallback video using Windows ffmpeg; False when no valid mp4 came out"""
+        # Written under a temporary name so concurrent fallbacks never link a partial file
+        tmp_path = str(temp_sibling(video_path))
+        
         # Use Windows ffmpeg path
         ffmpeg_path = "/mnt/c/Program Files (x86)/ffmpeg/bin/ffmpeg.exe"
         
@@ -166,33 +185,37 @@ class ManimAPIHandler(http.server.BaseHTTPRequestHandler):
                 ffmpeg_path, '-y',
                 '-f', 'lavfi',
                 '-i', 'color=c=white:size=1280x720:duration=5:rate=30',
-                '-vf', f'drawtext=text="Math Video {output_name}":fontcolor=black:fontsize=48:x=(w-text_w)/2:y=(h-text_h)/2',
+                '-vf', 'drawtext=text="Math Video":fontcolor=black:fontsize=48:x=(w-text_w)/2:y=(h-text_h)/2',
                 '-c:v', 'libx264',
                 '-pix_fmt', 'yuv420p',
                 '-t', '5',
-                video_path
+                '-movflags', '+faststart',
+                '-f', 'mp4',
+                tmp_path
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            if result.returncode == 0:
-                logger.info(f"Created real video using ffmpeg: {video_path}")
-                return
-            else:
-                logger.error(f"FFmpeg failed: {result.stderr}")
+            result = process_tree.run(cmd, capture_output=True, text=True, timeout=30)
+            if result.returncode == 0 and is_faststart(tmp_path):
+                os.replace(tmp_path, video_path)
+                logger.info(f"Created fallback video using ffmpeg: {video_path}")
+                return True
+            logger.error(f"FFmpeg failed: {result.stderr}")
                 
         except (subprocess.TimeoutExpired, FileNotFoundError, subprocess.CalledProcessError) as e:
             logger.error(f"FFmpeg execution failed: {e}")
-            
-        # Fallback to text file if ffmpeg fails
-        with open(video_path, 'w', encoding='utf-8') as f:
-            f.write(f'# Math Video Placeholder\n# Generated: {time.strftime("%Y-%m-%d %H:%M:%S")}\n# Video: {output_name}\nMath video content would be here.\n')
-            logger.info(f"Created text placeholder: {video_path}")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return False
 
     def generate_real_video(self, script_content, output_name, scene_name):
         """Generate a real video from Manim script using ffmpeg"""
         output_dir = 'rendered_videos'
         os.makedirs(output_dir, exist_ok=True)
         video_path = os.path.join(output_dir, f'{output_name}.mp4')
+        # Encoded under a temporary name: video_path may be a hardlink to the
+        # canned fallback, which an in-place write would overwrite for every alias
+        tmp_path = str(temp_sibling(video_path))
         
         # Parse text content from script
         text_content = self.extract_text_from_script(script_content)
@@ -213,12 +236,15 @@ class ManimAPIHandler(http.server.BaseHTTPRequestHandler):
                 '-c:v', 'libx264',
                 '-pix_fmt', 'yuv420p',
                 '-t', '8',
-                video_path
+                '-movflags', '+faststart',
+                '-f', 'mp4',
+                tmp_path
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+            result = process_tree.run(cmd, capture_output=True, text=True, timeout=60)
             
             if result.returncode == 0:
+                os.replace(tmp_path, video_path)
                 logger.info(f"Successfully generated real video: {video_path}")
                 return True
             else:
@@ -228,6 +254,9 @@ class ManimAPIHandler(http.server.BaseHTTPRequestHandler):
         except Exception as e:
             logger.error(f"Video generation exception: {e}")
             return False
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
     
     def extract_text_from_script(self, script_content):
         """Extract text content from Manim script"""
@@ -262,6 +291,7 @@ class ManimAPIHandler(http.server.BaseHTTPRequestHandler):
 def start_server(port=5001):
     """Start the simple Manim server"""
     os.makedirs('rendered_videos', exist_ok=True)
+    get_storage_manager().start()
     
     handler = ManimAPIHandler
     
@@ -4,15 +4,23 @@
 具有自动重启、健康检查和错误恢复功能
 """
 
+import hashlib
 import os
 import subprocess
 import logging
 import time
 import json
-import threading
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from pathlib import Path
+
+import process_tree
+import render_metrics
+import render_profiles
+import resource_ledger
+from manim_workers import get_worker_pool, render_scene
+from media_pipeline import publish_faststart
+from render_cache import temp_sibling
+from storage_manager import get_storage_manager
 
 app = Flask(__name__)
 CORS(app)
@@ -37,13 +45,12 @@ def ensure_directories():
         logger.info(f"确保目录存在: {directory}")
 
 def cleanup_temp_files():
-    """清理临时文件"""
+    """清理临时文件：按存储策略清理临时脚本、过期视频和Manim中间文件"""
     try:
-        script_path = Path(SCRIPT_DIR)
-        for file in script_path.glob("*.py"):
-            if file.stat().st_mtime < time.time() - 3600:  # 1小时前的文件
-                file.unlink()
-                logger.info(f"清理临时文件: {file}")
+        report = get_storage_manager().sweep()
+        for policy in report['policies'].values():
+            for item in policy['delete']:
+                logger.info(f"清理文件({item['reason']}): {item['path']}")
     except Exception as e:
         logger.warning(f"清理临时文件失败: {e}")
 
@@ -53,12 +60,18 @@ def health_check():
     return jsonify({
         **health_status,
         "server_time": time.time(),
+        "storage": get_storage_manager().stats(),
         "directories": {
             "output_exists": os.path.exists(OUTPUT_DIR),
             "script_exists": os.path.exists(SCRIPT_DIR)
         }
     })
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus指标端点"""
+    return Response(render_metrics.exposition(), mimetype=render_metrics.CONTENT_TYPE)
+
 @app.route('/api/manim_render', methods=['POST', 'OPTIONS'])
 def manim_render():
     """Manim渲染API端点"""
@@ -73,6 +86,7 @@ def manim_render():
         script = data.get('script', '')
         output_name = data.get('output_name', f'video_{int(time.time())}')
         scene_name = data.get('scene_name', 'MathSolutionScene')
+        profile = render_profiles.resolve(data.get('profile'), default='standard')
         
         logger.info(f"收到渲染请求: {output_name}")
         
@@ -80,67 +94,94 @@ def manim_render():
         health_status["last_render"] = time.time()
         health_status["render_count"] += 1
         
-        # 尝试真实渲染
-        result = render_with_manim(script, output_name, scene_name)
+        # 尝试真实渲染（Manim/ffmpeg子进程的资源消耗按脚本哈希和题型记入账本）
+        with render_metrics.in_flight(), resource_ledger.render_context(
+            script_hash=hashlib.md5(script.encode()).hexdigest()[:8],
+            question_type=resource_ledger.question_type(data.get('question')),
+            quality=profile.name
+        ):
+            result = render_with_manim(script, output_name, scene_name, profile)
         
         if result['success']:
             logger.info(f"渲染成功: {output_name}")
+            render_metrics.record_request('success')
             return jsonify(result)
         else:
             logger.warning(f"渲染失败，使用备用方案: {result.get('error', 'Unknown error')}")
+            render_metrics.record_failure(result.get('error'))
             # 备用方案：创建简单视频
             fallback_result = create_fallback_video(output_name)
+            render_metrics.record_fallback('fallback_video')
+            render_metrics.record_request('fallback' if fallback_result['success'] else 'failed')
             return jsonify(fallback_result)
             
     except Exception as e:
         logger.error(f"API处理错误: {e}")
+        render_metrics.record_request('failed')
+        render_metrics.record_failure(e)
         return jsonify({
             'success': False, 
             'error': f'Server error: {str(e)}'
         }), 500
 
-def render_with_manim(script, output_name, scene_name):
-    """使用Manim渲染视频"""
+def render_with_manim(script, output_name, scene_name, profile='standard'):
+    """使用Manim渲染视频（分辨率和帧率由服务器的渲染档位决定，脚本里的config设置无效）"""
+    profile = render_profiles.resolve(profile)
     script_path = os.path.join(SCRIPT_DIR, f"{output_name}.py")
     output_path = os.path.join(OUTPUT_DIR, f"{output_name}.mp4")
     
     try:
-        # 保存脚本
+        # 保存脚本，末尾追加渲染档位设置，覆盖脚本自己写死的分辨率和帧率
         with open(script_path, 'w', encoding='utf-8') as f:
-            f.write(script)
-        
-        # 执行Manim渲染
-        cmd = [
-            "manim", script_path, scene_name, 
-            "-qm",  # 中等质量，更快
-            "--output_file", f"{output_name}.mp4"
-        ]
+            f.write(render_profiles.enforce_script(script, profile))
         
-        logger.info(f"执行Manim命令: {' '.join(cmd)}")
-        
-        result = subprocess.run(
-            cmd, 
-            capture_output=True, 
-            text=True, 
-            timeout=MAX_RENDER_TIME,
-            cwd=os.getcwd()
-        )
+        # 执行Manim渲染 - 优先使用常驻Manim进程
+        with render_metrics.stage('manim'):
+            worker_result = render_scene(
+                script_path, scene_name, profile=profile,
+                output_file=f"{output_name}.mp4", timeout=MAX_RENDER_TIME
+            )
+            if worker_result is not None:
+                returncode = 0 if worker_result['success'] else 1
+                stderr = worker_result.get('stderr', '')
+                resource_ledger.record('manim', worker_result.get('usage', {}), worker_result.get('wall_time', 0),
+                                       output_path=worker_result.get('video_path'), worker=True,
+                                       returncode=returncode)
+            else:
+                cmd = [
+                    "manim", script_path, scene_name, 
+                    *profile.cli_args(),
+                    "--output_file", f"{output_name}.mp4"
+                ]
+            
+                logger.info(f"执行Manim命令: {' '.join(cmd)}")
+            
+                result = process_tree.run(
+                    cmd, 
+                    capture_output=True, 
+                    text=True, 
+                    timeout=MAX_RENDER_TIME,
+                    cwd=os.getcwd()
+                )
+                returncode, stderr = result.returncode, result.stderr
+                resource_ledger.record('manim', result.rusage, result.wall_time, returncode=returncode)
         
-        if result.returncode == 0:
+        if returncode == 0:
             # 查找生成的视频文件
-            video_found = find_generated_video(output_name)
+            video_found = find_generated_video(output_name, profile)
             if video_found:
                 return {
                     'success': True,
                     'video_url': f'/rendered_videos/{output_name}.mp4',
-                    'message': 'Video rendered successfully with Manim'
+                    'message': 'Video rendered successfully with Manim',
+                    'profile': profile.to_dict()
                 }
             else:
                 logger.warning("Manim执行成功但未找到视频文件")
                 return {'success': False, 'error': 'Video file not found after rendering'}
         else:
-            logger.error(f"Manim渲染失败: {result.stderr}")
-            return {'success': False, 'error': f'Manim error: {result.stderr}'}
+            logger.error(f"Manim渲染失败: {stderr}")
+            return {'success': False, 'error': f'Manim error: {stderr}'}
             
     except subprocess.TimeoutExpired:
         logger.error(f"Manim渲染超时: {MAX_RENDER_TIME}秒")
@@ -156,7 +197,7 @@ def render_with_manim(script, output_name, scene_name):
         except:
             pass
 
-def find_generated_video(output_name):
+def find_generated_video(output_name, profile=None):
     """查找Manim生成的视频文件"""
     possible_paths = [
         os.path.join(OUTPUT_DIR, f"{output_name}.mp4"),
@@ -164,6 +205,9 @@ def find_generated_video(output_name):
         os.path.join("media", "videos", output_name, "1080p60", f"{output_name}.mp4"),
         os.path.join("media", "videos", output_name, "2160p60", f"{output_name}.mp4"),
     ]
+    if profile:
+        possible_paths.insert(1, os.path.join("media", "videos", output_name, profile.directory_name,
+                                              f"{output_name}.mp4"))
     
     for path in possible_paths:
         if os.path.exists(path):
@@ -171,7 +215,9 @@ def find_generated_video(output_name):
             final_path = os.path.join(OUTPUT_DIR, f"{output_name}.mp4")
             if path != final_path:
                 try:
-                    os.rename(path, final_path)
+                    # 发布时把moov移到文件开头，浏览器无需先下载文件末尾即可播放
+                    publish_faststart(path, final_path)
+                    os.remove(path)
                     logger.info(f"视频已移动到: {final_path}")
                 except Exception as e:
                     logger.warning(f"移动视频文件失败: {e}")
@@ -201,16 +247,22 @@ Timestamp: {int(time.time())}
             f.write(fallback_content)
         
         # 创建一个简单的MP4占位符（如果ffmpeg可用）
+        # 先写临时文件再替换：output_path可能与其他视频硬链接（去重），原地写会改写所有链接
+        tmp_path = str(temp_sibling(output_path))
         try:
-            subprocess.run([
+            result = subprocess.run([
                 'ffmpeg', '-f', 'lavfi', '-i', 'color=c=lightblue:size=640x480:duration=5',
-                '-y', output_path
+                '-movflags', '+faststart', '-f', 'mp4', '-y', tmp_path
             ], capture_output=True, timeout=30)
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr)
+            os.replace(tmp_path, output_path)
             logger.info(f"创建备用视频: {output_path}")
         except:
             # 如果ffmpeg不可用，创建空文件
-            with open(output_path, 'w') as f:
+            with open(tmp_path, 'w') as f:
                 f.write('')
+            os.replace(tmp_path, output_path)
         
         return {
             'success': True,
@@ -239,17 +291,8 @@ def serve_video(filename):
         return jsonify({'error': 'Server error'}), 500
 
 def start_cleanup_thread():
-    """启动清理线程"""
-    def cleanup_worker():
-        while True:
-            try:
-                time.sleep(3600)  # 每小时执行一次
-                cleanup_temp_files()
-            except Exception as e:
-                logger.error(f"清理线程错误: {e}")
-    
-    thread = threading.Thread(target=cleanup_worker, daemon=True)
-    thread.start()
+    """启动清理线程（所有服务共用的存储管理器）"""
+    get_storage_manager().start()
     logger.info("清理线程已启动")
 
 if __name__ == '__main__':
@@ -257,6 +300,7 @@ if __name__ == '__main__':
         # 初始化
         ensure_directories()
         start_cleanup_thread()
+        get_worker_pool()  # 预热常驻Manim进程
         
         logger.info("稳定Manim API服务器启动中...")
         logger.info(f"输出目录: {os.path.abspath(OUTPUT_DIR)}")
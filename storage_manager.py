@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Storage Lifecycle Manager
+Keeps the directories the render servers write into within size and age
+budgets: published videos, Manim's per-request media/videos trees, leftover
+job directories, debug scripts and error logs.
+
+Each directory gets a StoragePolicy. A sweep first deletes entries older
+than max_age, then the least recently used ones until the directory fits
+max_bytes. It never touches:
+  - entries younger than min_age (renders still writing them)
+  - files a server reports as referenced (videos of retained jobs)
+  - files with other hardlinks (cached outputs: deleting the published name
+    frees nothing, the render cache owns those bytes)
+The render/tex/segment caches enforce their own budgets and aren't managed
+here.
+
+Video directories are also deduplicated: byte-identical files (canned
+fallback videos published under many names, re-renders of the same script)
+are hardlinked to one copy, and the sweep reports the bytes saved. Names
+that share an inode only within one directory are aged and deleted as one
+unit, since removing some of them frees nothing.
+
+One background thread per process (get_storage_manager().start()) sweeps
+every STORAGE_SWEEP_INTERVAL seconds; sweeps are idempotent, so several
+servers on one host can share the directories.
+
+Usage:
+    python storage_manager.py report     dry run: what a sweep would delete and dedupe
+    python storage_manager.py sweep
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.absolute()
+STORAGE_SWEEP_INTERVAL = float(os.environ.get('STORAGE_SWEEP_INTERVAL', 600))
+STORAGE_DRY_RUN = os.environ.get('STORAGE_DRY_RUN', '0') == '1'
+# Files younger than this may still be being written and aren't deduplicated
+DEDUPE_MIN_AGE = 60
+
+GB = 1024 ** 3
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def _env_number(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+class StoragePolicy:
+    """Budget for one directory.
+
+    unit='files' manages every file below path (matching pattern) on its
+    own; unit='entries' treats each top-level child (usually a per-request
+    directory) as one unit, sized and dated by everything inside it.
+    """
+
+    def __init__(self, name, path, max_bytes=None, max_age=None, min_age=HOUR, pattern='*',
+                 unit='files', dedupe=False):
+        self.name = name
+        self.path = Path(path)
+        self.max_bytes = _env_number(f'STORAGE_{name.upper()}_MAX_BYTES', max_bytes)
+        self.max_age = _env_number(f'STORAGE_{name.upper()}_MAX_AGE', max_age)
+        self.min_age = min_age
+        self.pattern = pattern
+        self.unit = unit
+        self.dedupe = dedupe
+
+    def to_dict(self):
+        return {
+            'path': str(self.path),
+            'max_bytes': self.max_bytes,
+            'max_age': self.max_age,
+            'min_age': self.min_age,
+            'unit': self.unit,
+        }
+
+
+def default_policies(base_dir=BASE_DIR):
+    base_dir = Path(base_dir)
+    return [
+        StoragePolicy('public_videos', base_dir / 'public' / 'rendered_videos', max_bytes=5 * GB, pattern='*.mp4',
+                      dedupe=True),
+        StoragePolicy('rendered_videos', base_dir / 'rendered_videos', max_bytes=5 * GB, dedupe=True),
+        StoragePolicy('media_videos', base_dir / 'media' / 'videos', max_bytes=2 * GB, max_age=DAY,
+                      unit='entries'),
+        StoragePolicy('media_jobs', base_dir / 'media' / 'jobs', max_age=6 * HOUR, unit='entries'),
+        StoragePolicy('temp', base_dir / 'temp', max_bytes=200 * 1024 ** 2, max_age=7 * DAY),
+        StoragePolicy('temp_scripts', base_dir / 'temp_scripts', max_age=HOUR, pattern='*.py'),
+    ]
+
+
+def _file_usage(stat):
+    """(bytes a delete would free, last use) for one file"""
+    freeable = stat.st_size if stat.st_nlink <= 1 else 0
+    return freeable, max(stat.st_mtime, stat.st_atime)
+
+
+def _link_groups(paths):
+    """Group paths naming the same inode: [(path, ...), ...]"""
+    groups = {}
+    for path in paths:
+        try:
+            stat = path.stat()
+        except OSError:
+            continue  # Deleted while scanning
+        groups.setdefault((stat.st_dev, stat.st_ino), []).append(path)
+    return [tuple(group) for group in groups.values()]
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _relink(canonical, path):
+    """Replace path with a hardlink to canonical; False when the filesystem refuses"""
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.dedupe.tmp')
+    try:
+        os.link(canonical, tmp)
+        os.replace(tmp, path)
+        return True
+    except OSError as e:
+        print(f"⚠️ Storage manager could not dedupe {path}: {e}")
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        return False
+
+
+class StorageManager:
+    """Applies StoragePolicy budgets, on demand or from a background thread"""
+
+    def __init__(self, policies=None, interval=STORAGE_SWEEP_INTERVAL, dry_run=STORAGE_DRY_RUN):
+        self.policies = list(policies) if policies is not None else default_policies()
+        self.interval = interval
+        self.dry_run = dry_run
+        self._reference_sources = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.last_report = None
+        self.sweeps = 0
+        self.deleted = 0
+        self.freed_bytes = 0
+        self.dedupe_saved_bytes = 0
+
+    def add_references(self, source):
+        """Register a callable returning paths that must not be deleted"""
+        self._reference_sources.append(source)
+
+    def _referenced(self):
+        paths = set()
+        for source in self._reference_sources:
+            try:
+                paths.update(Path(p).resolve() for p in source() if p)
+            except Exception as e:
+                print(f"⚠️ Storage reference source failed: {e}")
+        return paths
+
+    def _units(self, policy, referenced, now):
+        """(paths, freeable bytes, last use, reason kept or None) for each unit under policy"""
+        units = []
+        if policy.unit == 'entries':
+            children = [(p,) for p in policy.path.iterdir() if p.match(policy.pattern)]
+        else:
+            children = _link_groups(p for p in policy.path.rglob(policy.pattern) if p.is_file())
+        for paths in children:
+            path = paths[0]
+            try:
+                if path.is_dir():
+                    freeable, last_used, linked, files = 0, 0, False, []
+                    for file in path.rglob('*'):
+                        if file.is_file():
+                            stat = file.stat()
+                            size, used = _file_usage(stat)
+                            freeable += size
+                            last_used = max(last_used, used)
+                            files.append(file.resolve())
+                    last_used = last_used or path.stat().st_mtime
+                    hit = any(f in referenced for f in files)
+                else:
+                    # Every name of the file found here goes together; other
+                    # links (the render cache) keep the bytes alive regardless
+                    stats = [p.stat() for p in paths]
+                    linked = stats[0].st_nlink > len(paths)
+                    freeable = 0 if linked else stats[0].st_size
+                    last_used = max(max(stat.st_mtime, stat.st_atime) for stat in stats)
+                    hit = any(p.resolve() in referenced for p in paths)
+            except OSError:
+                continue  # Deleted while scanning
+            if hit:
+                kept = 'referenced'
+            elif not path.is_dir() and linked:
+                kept = 'cached'
+            elif now - last_used < policy.min_age:
+                kept = 'in_use'
+            else:
+                kept = None
+            units.append((paths, freeable, last_used, kept))
+        return units
+
+    def _delete(self, paths):
+        try:
+            for path in paths:
+                if path.is_dir():
+                    shutil.rmtree(path)
+                else:
+                    path.unlink()
+            return True
+        except OSError as e:
+            print(f"⚠️ Storage manager could not delete {path}: {e}")
+            return False
+
+    def dedupe_policy(self, policy, dry_run=None, now=None):
+        """Hardlink byte-identical files under policy to one copy.
+
+        The copy kept is the one with the most names (usually a render cache
+        entry), then the oldest. saved_bytes counts the copies whose last
+        name was replaced. Only same-size files on different inodes are
+        hashed, so once a directory is deduplicated sweeps read nothing.
+        """
+        dry_run = self.dry_run if dry_run is None else dry_run
+        now = now or time.time()
+        report = {'groups': 0, 'linked': 0, 'saved_bytes': 0}
+        if not policy.path.is_dir():
+            return report
+        by_size = {}
+        for path in policy.path.rglob(policy.pattern):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if (path.name.startswith('.') or not path.is_file() or not stat.st_size
+                    or now - stat.st_mtime < DEDUPE_MIN_AGE):
+                continue
+            by_size.setdefault(stat.st_size, []).append((path, stat))
+
+        for files in by_size.values():
+            if len({(stat.st_dev, stat.st_ino) for _, stat in files}) < 2:
+                continue
+            by_digest = {}
+            for path, stat in files:
+                try:
+                    by_digest.setdefault(_sha256(path), []).append((path, stat))
+                except OSError:
+                    continue
+            for same in by_digest.values():
+                canonical_path, canonical = max(same, key=lambda f: (f[1].st_nlink, -f[1].st_mtime))
+                names = {}
+                for path, stat in same:
+                    if stat.st_dev == canonical.st_dev and stat.st_ino != canonical.st_ino:
+                        names.setdefault(stat.st_ino, []).append((path, stat))
+                if not names:
+                    continue
+                report['groups'] += 1
+                for inode_names in names.values():
+                    relinked = sum(1 for path, _ in inode_names
+                                   if dry_run or _relink(canonical_path, path))
+                    report['linked'] += relinked
+                    if relinked == inode_names[0][1].st_nlink:
+                        report['saved_bytes'] += canonical.st_size
+        return report
+
+    def sweep_policy(self, policy, dry_run=None, referenced=None, now=None):
+        dry_run = self.dry_run if dry_run is None else dry_run
+        now = now or time.time()
+        report = {**policy.to_dict(), 'files': 0, 'bytes': 0, 'kept': {}, 'delete': [],
+                  'deleted': 0, 'freed_bytes': 0}
+        if not policy.path.is_dir():
+            return report
+        if policy.dedupe:
+            report['dedupe'] = self.dedupe_policy(policy, dry_run, now)
+        units = self._units(policy, referenced if referenced is not None else self._referenced(), now)
+        total = sum(freeable for _, freeable, _, _ in units)
+        report['files'] = len(units)
+        report['bytes'] = total
+
+        victims = []
+        candidates = []
+        for unit in sorted(units, key=lambda u: u[2]):
+            path, freeable, last_used, kept = unit
+            if kept:
+                report['kept'][kept] = report['kept'].get(kept, 0) + 1
+            elif policy.max_age is not None and now - last_used > policy.max_age:
+                victims.append((unit, 'expired'))
+                total -= freeable
+            else:
+                candidates.append(unit)
+        if policy.max_bytes is not None:
+            for unit in candidates:
+                if total <= policy.max_bytes:
+                    break
+                victims.append((unit, 'over_budget'))
+                total -= unit[1]
+
+        for (paths, freeable, last_used, _), reason in victims:
+            item = {
+                'path': str(paths[0]), 'bytes': freeable, 'reason': reason,
+                'idle_hours': round((now - last_used) / HOUR, 1),
+            }
+            if len(paths) > 1:
+                item['links'] = [str(p) for p in paths[1:]]
+            report['delete'].append(item)
+            if not dry_run and self._delete(paths):
+                report['deleted'] += 1
+                report['freed_bytes'] += freeable
+        return report
+
+    def sweep(self, dry_run=None):
+        """Apply every policy; returns a report (nothing is deleted when dry_run)"""
+        dry_run = self.dry_run if dry_run is None else dry_run
+        with self._lock:
+            started = time.time()
+            referenced = self._referenced()
+            report = {
+                'dry_run': dry_run,
+                'time': started,
+                'policies': {p.name: self.sweep_policy(p, dry_run, referenced, started) for p in self.policies},
+            }
+            report['deleted'] = sum(p['deleted'] for p in report['policies'].values())
+            report['freed_bytes'] = sum(p['freed_bytes'] for p in report['policies'].values())
+            report['dedupe_saved_bytes'] = sum(p.get('dedupe', {}).get('saved_bytes', 0)
+                                               for p in report['policies'].values())
+            report['duration'] = round(time.time() - started, 3)
+            if not dry_run:
+                self.sweeps += 1
+                self.deleted += report['deleted']
+                self.freed_bytes += report['freed_bytes']
+                self.dedupe_saved_bytes += report['dedupe_saved_bytes']
+            self.last_report = report
+            return report
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                report = self.sweep()
+                if report['dedupe_saved_bytes']:
+                    print(f"🔗 Storage dedupe saved {report['dedupe_saved_bytes'] / 1024 ** 2:.1f} MB")
+                if report['deleted']:
+                    print(f"🧹 Storage sweep freed {report['freed_bytes'] / 1024 ** 2:.1f} MB "
+                          f"({report['deleted']} entries)")
+            except Exception as e:
+                print(f"⚠️ Storage sweep failed: {e}")
+
+    def start(self):
+        """Start the background sweeper once per process"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='storage-manager', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        policies = (self.last_report or {}).get('policies', {})
+        return {
+            'interval': self.interval,
+            'dry_run': self.dry_run,
+            'sweeps': self.sweeps,
+            'deleted': self.deleted,
+            'freed_bytes': self.freed_bytes,
+            'dedupe_saved_bytes': self.dedupe_saved_bytes,
+            'last_sweep': (self.last_report or {}).get('time'),
+            'usage': {name: {'bytes': p['bytes'], 'max_bytes': p['max_bytes']} for name, p in policies.items()},
+        }
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_storage_manager():
+    """Process-wide storage manager, created on first use"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = StorageManager()
+        return _manager
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else 'report'
+    if command not in ('report', 'sweep'):
+        print(__doc__)
+        return 1
+    report = StorageManager().sweep(dry_run=command == 'report')
+    for name, policy in report['policies'].items():
+        planned = sum(item['bytes'] for item in policy['delete'])
+        print(f"{name:16} {policy['bytes'] / 1024 ** 2:10.1f} MB in {policy['files']:5} entries, "
+              f"{'would free' if report['dry_run'] else 'freed'} {planned / 1024 ** 2:.1f} MB "
+              f"({len(policy['delete'])} entries), kept {policy['kept']}")
+        if 'dedupe' in policy:
+            dedupe = policy['dedupe']
+            print(f"{'':16} {'would save' if report['dry_run'] else 'saved'} "
+                  f"{dedupe['saved_bytes'] / 1024 ** 2:.1f} MB by hardlinking {dedupe['linked']} duplicates "
+                  f"({dedupe['groups']} distinct videos)")
+        for item in policy['delete']:
+            print(f"    {item['reason']:12} {item['idle_hours']:8.1f}h {item['bytes']:>12} {item['path']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+测试媒体流水线 - 分段播放顺序、编码参数一致性判断、单分段直接使用、拼接混音一次完成、moov前置(faststart)校验
+"""
+import os
+import struct
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+import media_pipeline
+from media_pipeline import can_stream_copy, finalize_video, is_faststart, manim_segment_order, publish_faststart
+
+
+def _mp4(path, boxes=('ftyp', 'moov', 'mdat')):
+    # 最小的mp4顶层结构：每个box只有8字节头和少量内容
+    path = Path(path)
+    path.write_bytes(b''.join(struct.pack('>I4s', 16, kind.encode()) + b'\0' * 8 for kind in boxes))
+    return path
+
+
+def test_segment_order_follows_manim_list():
+    with tempfile.TemporaryDirectory() as tmp:
+        part_dir = Path(tmp)
+        for name in ['f3a1', '0b2c', '9d4e']:
+            (part_dir / f'{name}.mp4').write_bytes(b'x')
+        (part_dir / 'partial_movie_file_list.txt').write_text(
+            "# This file is used internally by FFMPEG.\n"
+            f"file 'file:{part_dir / 'f3a1.mp4'}'\n"
+            f"file 'file:{part_dir / '0b2c.mp4'}'\n"
+            f"file 'file:{part_dir / '9d4e.mp4'}'\n"
+        )
+        assert [p.stem for p in manim_segment_order(part_dir)] == ['f3a1', '0b2c', '9d4e']
+
+
+def test_segment_order_falls_back_to_mtime():
+    with tempfile.TemporaryDirectory() as tmp:
+        part_dir = Path(tmp)
+        for i, name in enumerate(['c', 'a', 'b']):
+            path = part_dir / f'{name}.mp4'
+            path.write_bytes(b'x')
+            stamp = time.time() + i
+            os.utime(path, (stamp, stamp))
+        assert [p.stem for p in manim_segment_order(part_dir)] == ['c', 'a', 'b']
+
+
+def test_stream_copy_requires_identical_parameters():
+    same = {'codec_name': 'h264', 'width': 1920, 'height': 1080, 'pix_fmt': 'yuv420p'}
+    other = dict(same, pix_fmt='yuv444p')
+    with mock.patch.object(media_pipeline, 'probe_video', side_effect=[same, same]):
+        assert can_stream_copy(['a.mp4', 'b.mp4'])
+    with mock.patch.object(media_pipeline, 'probe_video', side_effect=[same, other]):
+        assert not can_stream_copy(['a.mp4', 'b.mp4'])
+    with mock.patch.object(media_pipeline, 'probe_video', side_effect=[same, None]):
+        assert not can_stream_copy(['a.mp4', 'b.mp4'])
+
+
+def test_faststart_detection():
+    with tempfile.TemporaryDirectory() as tmp:
+        assert is_faststart(_mp4(Path(tmp) / 'fast.mp4'))
+        assert not is_faststart(_mp4(Path(tmp) / 'slow.mp4', ('ftyp', 'mdat', 'moov')))
+        assert not is_faststart(Path(tmp) / 'missing.mp4')
+
+
+def test_single_faststart_segment_is_linked():
+    with tempfile.TemporaryDirectory() as tmp:
+        segment = _mp4(Path(tmp) / 'only.mp4')
+        output = Path(tmp) / 'out.mp4'
+        assert finalize_video([segment], output) == 'single'
+        assert output.read_bytes() == segment.read_bytes()
+
+
+def _fake_ffmpeg(calls, boxes=('ftyp', 'moov', 'mdat')):
+    def run(cmd, **kwargs):
+        calls.append(cmd)
+        _mp4(cmd[-1], boxes)
+        return mock.Mock(returncode=0, stderr='')
+    return run
+
+
+def test_moov_last_movie_is_remuxed_faststart():
+    with tempfile.TemporaryDirectory() as tmp:
+        movie = _mp4(Path(tmp) / 'manim.mp4', ('ftyp', 'mdat', 'moov'))
+        output = Path(tmp) / 'out.mp4'
+        calls = []
+        with mock.patch.object(media_pipeline.process_tree, 'run', side_effect=_fake_ffmpeg(calls)):
+            assert finalize_video(movie, output) == 'copy'
+        assert calls[0][calls[0].index('-movflags') + 1] == '+faststart'
+        assert is_faststart(output)
+
+
+def test_output_that_is_not_faststart_is_rejected():
+    with tempfile.TemporaryDirectory() as tmp:
+        movie = _mp4(Path(tmp) / 'manim.mp4', ('ftyp', 'mdat', 'moov'))
+        output = Path(tmp) / 'out.mp4'
+        with mock.patch.object(media_pipeline.process_tree, 'run',
+                               side_effect=_fake_ffmpeg([], ('ftyp', 'mdat', 'moov'))):
+            try:
+                finalize_video(movie, output)
+                assert False, 'expected RuntimeError'
+            except RuntimeError as e:
+                assert 'fast-start' in str(e)
+        assert not output.exists()
+
+
+def test_publish_without_ffmpeg_keeps_the_movie():
+    with tempfile.TemporaryDirectory() as tmp:
+        movie = _mp4(Path(tmp) / 'manim.mp4', ('ftyp', 'mdat', 'moov'))
+        output = Path(tmp) / 'out.mp4'
+        with mock.patch.object(media_pipeline.process_tree, 'run', side_effect=FileNotFoundError('ffmpeg')):
+            assert publish_faststart(movie, output) == 'unchanged'
+        assert output.read_bytes() == movie.read_bytes()
+
+
+def test_concat_and_audio_mux_in_one_pass():
+    with tempfile.TemporaryDirectory() as tmp:
+        segments = [Path(tmp) / f'{i}.mp4' for i in range(3)]
+        output = Path(tmp) / 'final.mp4'
+        calls = []
+        with mock.patch.object(media_pipeline, 'can_stream_copy', return_value=True), \
+                mock.patch.object(media_pipeline, 'probe_audio_codec', return_value='mp3'), \
+                mock.patch.object(media_pipeline.process_tree, 'run', side_effect=_fake_ffmpeg(calls)):
+            assert finalize_video(segments, output, audio_path='voice.mp3') == 'copy'
+        assert len(calls) == 1
+        cmd = calls[0]
+        assert cmd[cmd.index('-f') + 1] == 'concat'
+        assert cmd[cmd.index('-c:v') + 1] == 'copy'
+        assert cmd[cmd.index('-c:a') + 1] == 'aac'
+        assert '-shortest' in cmd
+        assert is_faststart(output)
+        assert sorted(p.name for p in Path(tmp).iterdir()) == ['final.mp4']
+
+
+def test_reencode_keeps_the_source_frame_rate():
+    with tempfile.TemporaryDirectory() as tmp:
+        segments = [Path(tmp) / f'{i}.mp4' for i in range(2)]
+        calls = []
+        with mock.patch.object(media_pipeline, 'can_stream_copy', return_value=False), \
+                mock.patch.object(media_pipeline.process_tree, 'run', side_effect=_fake_ffmpeg(calls)):
+            assert finalize_video(segments, Path(tmp) / 'final.mp4') == 'reencode'
+        cmd = calls[0]
+        assert cmd[cmd.index('-c:v') + 1] == 'libx264'
+        assert '-r' not in cmd  # 15fps预览不应被改成30fps
+
+
+def test_failed_mux_leaves_no_output():
+    with tempfile.TemporaryDirectory() as tmp:
+        output = Path(tmp) / 'final.mp4'
+        failed = mock.Mock(returncode=1, stderr='boom')
+        with mock.patch.object(media_pipeline, 'probe_audio_codec', return_value='aac'), \
+                mock.patch.object(media_pipeline.process_tree, 'run', return_value=failed):
+            try:
+                finalize_video(Path(tmp) / 'movie.mp4', output, audio_path='voice.m4a')
+                assert False, 'expected RuntimeError'
+            except RuntimeError as e:
+                assert 'boom' in str(e)
+        assert not output.exists()
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 媒体流水线测试全部通过")
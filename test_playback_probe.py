@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+测试首帧时间探测客户端 - moov前置的视频只需读取开头，moov在末尾时需额外请求或下载整个文件
+"""
+import http.server
+import struct
+import tempfile
+import threading
+from functools import partial
+from pathlib import Path
+
+from playback_probe import time_to_first_frame
+from video_serving import serve_from_directory
+
+MDAT_BYTES = 2 * 1024 * 1024
+
+
+def _write_mp4(path, moov_first):
+    ftyp = struct.pack('>I4s', 16, b'ftyp') + b'isom' + b'\0' * 4
+    moov = struct.pack('>I4s', 4096, b'moov') + b'\0' * 4088
+    mdat = struct.pack('>I4s', MDAT_BYTES, b'mdat') + b'\0' * (MDAT_BYTES - 8)
+    path.write_bytes(ftyp + (moov + mdat if moov_first else mdat + moov))
+
+
+class _RangeHandler(http.server.BaseHTTPRequestHandler):
+    root = None
+
+    def do_GET(self):
+        serve_from_directory(self, self.root, self.path)
+
+    def log_message(self, *args):
+        pass
+
+
+class _PlainHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _start(handler):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def test_faststart_needs_only_the_head():
+    with tempfile.TemporaryDirectory() as tmp:
+        _write_mp4(Path(tmp) / 'fast.mp4', moov_first=True)
+        _write_mp4(Path(tmp) / 'slow.mp4', moov_first=False)
+        handler = type('Handler', (_RangeHandler,), {'root': tmp})
+        server, base = _start(handler)
+        try:
+            fast = time_to_first_frame(f'{base}/fast.mp4')
+            slow = time_to_first_frame(f'{base}/slow.mp4')
+        finally:
+            server.shutdown()
+    assert fast['faststart'] and not slow['faststart']
+    assert fast['requests'] < slow['requests']
+    assert fast['bytes_before_first_frame'] < 256 * 1024
+    assert fast['ttff_modelled_ms'] < slow['ttff_modelled_ms']
+
+
+def test_moov_last_without_ranges_downloads_everything():
+    with tempfile.TemporaryDirectory() as tmp:
+        _write_mp4(Path(tmp) / 'slow.mp4', moov_first=False)
+        server, base = _start(partial(_PlainHandler, directory=tmp))
+        try:
+            result = time_to_first_frame(f'{base}/slow.mp4')
+        finally:
+            server.shutdown()
+    assert not result['range_support']
+    assert result['bytes_before_first_frame'] == result['size']
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 首帧时间探测测试全部通过")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+测试渲染进程树控制 - 超时和取消时杀掉整个进程组（包括孙进程）、正常结束清理残留进程
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import process_tree
+from process_tree import ProcessCancelled
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # 已退出但尚未被回收的僵尸进程也算已结束
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().split(')')[-1].split()[0] != 'Z'
+    except OSError:
+        return True
+
+
+def _spawn_grandchild_cmd(pid_file, parent_sleep):
+    # 子进程启动一个长时间运行的孙进程并记录其pid，模拟manim调用latex/ffmpeg
+    code = (
+        "import subprocess, sys, time\n"
+        "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])\n"
+        f"open({str(pid_file)!r}, 'w').write(str(child.pid))\n"
+        f"time.sleep({parent_sleep})\n"
+    )
+    return [sys.executable, '-c', code]
+
+
+def _wait_for_pid(pid_file):
+    for _ in range(100):
+        if pid_file.exists() and pid_file.read_text():
+            return int(pid_file.read_text())
+        time.sleep(0.05)
+    raise AssertionError('grandchild never started')
+
+
+def test_timeout_kills_grandchildren():
+    with tempfile.TemporaryDirectory() as tmp:
+        pid_file = Path(tmp) / 'grandchild.pid'
+        try:
+            process_tree.run(_spawn_grandchild_cmd(pid_file, 30), capture_output=True, timeout=1)
+            assert False, 'expected TimeoutExpired'
+        except subprocess.TimeoutExpired:
+            pass
+        grandchild = _wait_for_pid(pid_file)
+        time.sleep(0.2)
+        assert not _alive(grandchild)
+
+
+def test_cancel_kills_tree():
+    with tempfile.TemporaryDirectory() as tmp:
+        pid_file = Path(tmp) / 'grandchild.pid'
+        cancel_event = threading.Event()
+        threading.Timer(0.5, cancel_event.set).start()
+        started = time.time()
+        try:
+            process_tree.run(_spawn_grandchild_cmd(pid_file, 30), cancel_event=cancel_event, timeout=20)
+            assert False, 'expected ProcessCancelled'
+        except ProcessCancelled:
+            pass
+        assert time.time() - started < 5
+        grandchild = _wait_for_pid(pid_file)
+        time.sleep(0.2)
+        assert not _alive(grandchild)
+
+
+def test_normal_exit_returns_output_and_reaps_stragglers():
+    with tempfile.TemporaryDirectory() as tmp:
+        pid_file = Path(tmp) / 'grandchild.pid'
+        result = process_tree.run(_spawn_grandchild_cmd(pid_file, 0), capture_output=True, text=True, timeout=20)
+        assert result.returncode == 0
+        grandchild = _wait_for_pid(pid_file)
+        time.sleep(0.2)
+        assert not _alive(grandchild)
+
+    result = process_tree.run([sys.executable, '-c', 'print("ok")'], capture_output=True, text=True, timeout=20)
+    assert result.stdout.strip() == 'ok'
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 进程树控制测试全部通过")
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+测试内容寻址渲染缓存 - 命中/未命中、LRU淘汰、重启后持久化、命中不改文件mtime、重新生成硬链接别名不改写共享的备用视频、ffmpeg失败的占位文件不共享
+"""
+import os
+import struct
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import simple_manim_server
+from render_cache import RenderCache, link_or_copy
+
+
+def _write(path, size):
+    Path(path).write_bytes(b'\0' * size)
+    return path
+
+
+def _faststart_mp4(tag=b''):
+    return struct.pack('>I4s', 8, b'ftyp') + struct.pack('>I4s', 8, b'moov') + struct.pack('>I4s', 8 + len(tag), b'mdat') + tag
+
+
+def test_key_depends_on_script_and_flags():
+    base = RenderCache.make_key('script', quality='l', format='mp4')
+    assert base == RenderCache.make_key('script', format='mp4', quality='l')
+    assert base != RenderCache.make_key('script', quality='h', format='mp4')
+    assert base != RenderCache.make_key('script2', quality='l', format='mp4')
+
+
+def test_hit_and_miss_counters():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = RenderCache(Path(tmp) / 'cache')
+        assert cache.get('abc') is None
+        cache.put('abc', _write(Path(tmp) / 'video.mp4', 100))
+        assert cache.get('abc').read_bytes() == b'\0' * 100
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+
+
+def test_lru_eviction_respects_recency():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = RenderCache(Path(tmp) / 'cache', max_bytes=250)
+        for key in ('a', 'b'):
+            cache.put(key, _write(Path(tmp) / f'{key}.mp4', 100))
+        cache.get('a')  # a 变为最近使用
+        cache.put('c', _write(Path(tmp) / 'c.mp4', 100))
+        assert cache.contains('a') and cache.contains('c')
+        assert not cache.contains('b')
+        assert not cache.path_for('b').exists()
+        assert cache.stats()['evictions'] == 1
+
+
+def test_index_survives_restart():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = RenderCache(Path(tmp) / 'cache')
+        cache.put('old', _write(Path(tmp) / 'old.mp4', 10))
+        os.utime(cache.path_for('old'), (time.time() - 60, time.time() - 60))
+        cache.put('new', _write(Path(tmp) / 'new.mp4', 10))
+        reloaded = RenderCache(Path(tmp) / 'cache', max_bytes=15)
+        reloaded.put('newest', _write(Path(tmp) / 'newest.mp4', 5))
+        assert not reloaded.contains('old')
+        assert reloaded.contains('new')
+
+
+def test_hits_keep_file_mtime_and_recency_survives_restart():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = RenderCache(Path(tmp) / 'cache', max_bytes=250)
+        cache.INDEX_SAVE_INTERVAL = 0
+        for key in ('a', 'b'):
+            cache.put(key, _write(Path(tmp) / f'{key}.mp4', 100))
+        published = link_or_copy(cache.path_for('a'), Path(tmp) / 'lesson.mp4')
+        os.utime(cache.path_for('a'), (time.time() - 3600, time.time() - 3600))
+        mtime = published.stat().st_mtime_ns
+        time.sleep(0.01)
+        assert cache.get('a') is not None
+        assert published.stat().st_mtime_ns == mtime  # 命中不改动已发布的硬链接
+
+        reloaded = RenderCache(Path(tmp) / 'cache', max_bytes=250)
+        reloaded.put('c', _write(Path(tmp) / 'c.mp4', 100))
+        assert reloaded.contains('a') and not reloaded.contains('b')
+
+
+def test_publish_replaces_existing_file():
+    with tempfile.TemporaryDirectory() as tmp:
+        source = _write(Path(tmp) / 'source.mp4', 8)
+        dest = _write(Path(tmp) / 'dest.mp4', 3)
+        link_or_copy(source, dest)
+        assert dest.read_bytes() == b'\0' * 8
+
+
+def test_regenerating_a_fallback_alias_keeps_the_canned_video():
+    def fake_ffmpeg(returncode):
+        def run(cmd, **kwargs):
+            Path(cmd[-1]).write_bytes(b'encoded' if returncode == 0 else b'partial')
+            return SimpleNamespace(returncode=returncode, stderr='')
+        return run
+
+    previous_cwd, previous_run = os.getcwd(), simple_manim_server.process_tree.run
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            handler = simple_manim_server.ManimAPIHandler.__new__(simple_manim_server.ManimAPIHandler)
+            fallback = Path(simple_manim_server.FALLBACK_VIDEO)
+            fallback.parent.mkdir()
+            canned = _faststart_mp4(b'canned')
+            fallback.write_bytes(canned)
+            handler.create_fallback_video('lesson')
+            handler.create_fallback_video('other')
+            lesson = Path('rendered_videos/lesson.mp4')
+            assert os.path.samefile(lesson, fallback)
+
+            simple_manim_server.process_tree.run = fake_ffmpeg(1)  # 编码失败
+            assert not handler.generate_real_video("Text('x')", 'lesson', 'Scene')
+            simple_manim_server.process_tree.run = fake_ffmpeg(0)
+            assert handler.generate_real_video("Text('x')", 'lesson', 'Scene')
+
+            assert lesson.read_bytes() == b'encoded'
+            assert fallback.read_bytes() == canned
+            assert Path('rendered_videos/other.mp4').read_bytes() == canned
+            assert sorted(os.listdir('rendered_videos')) == ['fallback_math_video.mp4', 'lesson.mp4', 'other.mp4']
+        finally:
+            simple_manim_server.process_tree.run = previous_run
+            os.chdir(previous_cwd)
+
+
+
+def test_failed_fallback_encode_is_not_shared():
+    calls = []
+
+    def fake_ffmpeg(output):
+        def run(cmd, **kwargs):
+            calls.append(cmd)
+            Path(cmd[-1]).write_bytes(output)
+            return SimpleNamespace(returncode=0, stderr='')
+        return run
+
+    previous_cwd, previous_run = os.getcwd(), simple_manim_server.process_tree.run
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            os.mkdir('rendered_videos')
+            handler = simple_manim_server.ManimAPIHandler.__new__(simple_manim_server.ManimAPIHandler)
+            simple_manim_server.process_tree.run = fake_ffmpeg(b'not a video')  # ffmpeg输出无效
+            handler.create_fallback_video('first')
+            assert not os.path.exists(simple_manim_server.FALLBACK_VIDEO)
+            assert Path('rendered_videos/first.mp4').read_text().startswith('# Math Video Placeholder')
+
+            simple_manim_server.process_tree.run = fake_ffmpeg(_faststart_mp4())  # 下一次重新尝试
+            handler.create_fallback_video('second')
+            assert len(calls) == 2
+            assert os.path.samefile('rendered_videos/second.mp4', simple_manim_server.FALLBACK_VIDEO)
+            assert sorted(os.listdir('rendered_videos')) == ['fallback_math_video.mp4', 'first.mp4', 'second.mp4']
+        finally:
+            simple_manim_server.process_tree.run = previous_run
+            os.chdir(previous_cwd)
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 渲染缓存测试全部通过")
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+测试渲染指标 - 分阶段耗时直方图、失败原因分类、缓存命中率、队列深度，以及Prometheus文本格式的/metrics输出
+"""
+import http.client
+import http.server
+import subprocess
+import threading
+import time
+
+import render_metrics
+from render_metrics import Histogram, classify_failure, exposition, send_metrics
+from render_pool import RenderWorkerPool
+
+
+def _sample(text, line_prefix):
+    for line in text.splitlines():
+        if line.startswith(line_prefix + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('test_histogram_seconds', 'Test histogram', ['stage'], buckets=(1, 5))
+    for value in (0.5, 2, 7):
+        histogram.observe(value, stage='manim')
+    text = exposition()
+    assert '# TYPE test_histogram_seconds histogram' in text
+    assert _sample(text, 'test_histogram_seconds_bucket{stage="manim",le="1"}') == 1
+    assert _sample(text, 'test_histogram_seconds_bucket{stage="manim",le="5"}') == 2
+    assert _sample(text, 'test_histogram_seconds_bucket{stage="manim",le="+Inf"}') == 3
+    assert _sample(text, 'test_histogram_seconds_count{stage="manim"}') == 3
+    assert _sample(text, 'test_histogram_seconds_sum{stage="manim"}') == 9.5
+
+
+def test_stage_is_recorded_when_the_block_raises():
+    line = 'videotutor_render_stage_seconds_count{stage="validation"}'
+    before = _sample(exposition(), line) or 0
+    try:
+        with render_metrics.stage('validation'):
+            raise ValueError('boom')
+    except ValueError:
+        pass
+    assert _sample(exposition(), line) == before + 1
+
+
+def test_failure_classes():
+    assert classify_failure(subprocess.TimeoutExpired('manim', 60)) == 'timeout'
+    assert classify_failure('Manim渲染超时，请简化问题或稍后重试') == 'timeout'
+    assert classify_failure('Render cancelled') == 'cancelled'
+    assert classify_failure('LaTeX rendering error - ! Undefined control sequence') == 'latex'
+    assert classify_failure('NameError: name \'Foo\' is not defined') == 'script_error'
+    assert classify_failure('Manim worker exited unexpectedly (exit code -9)') == 'worker_crash'
+    assert classify_failure(RuntimeError('ffmpeg finalize (copy) failed')) == 'ffmpeg'
+    assert classify_failure('Video file not found after rendering') == 'output_missing'
+    assert classify_failure(None) == 'other'
+
+
+def test_cache_hit_ratio_and_pool_gauges():
+    class Cache:
+        hits, misses = 3, 1
+
+    render_metrics.watch_cache('test_cache', Cache())
+    render_metrics.record_cache_lookups('test_worker_cache', hits=1, misses=1)
+    release = threading.Event()
+    pool = RenderWorkerPool(workers=1, max_queue=4, name='test_pool')
+    render_metrics.watch_pool(pool)
+    pool.submit(release.wait, 5)
+    pool.submit(lambda: None)
+    deadline = time.time() + 5
+    while pool.stats()['busy'] == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    try:
+        text = exposition()
+        assert _sample(text, 'videotutor_cache_lookups_total{cache="test_cache",result="hit"}') == 3
+        assert _sample(text, 'videotutor_cache_hit_ratio{cache="test_cache"}') == 0.75
+        assert _sample(text, 'videotutor_cache_hit_ratio{cache="test_worker_cache"}') == 0.5
+        assert _sample(text, 'videotutor_render_jobs_in_flight{pool="test_pool"}') == 1
+        assert _sample(text, 'videotutor_render_queue_depth{pool="test_pool"}') == 1
+    finally:
+        release.set()
+
+
+def test_metrics_endpoint():
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            send_metrics(self)
+
+        def log_message(self, *args):
+            pass
+
+    render_metrics.record_fallback('safe_script')
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+        conn.request('GET', '/metrics')
+        response = conn.getresponse()
+        body = response.read().decode('utf-8')
+        conn.close()
+        assert response.status == 200
+        assert response.getheader('Content-Type') == render_metrics.CONTENT_TYPE
+        assert '# TYPE videotutor_render_fallbacks_total counter' in body
+        assert _sample(body, 'videotutor_render_fallbacks_total{kind="safe_script"}') >= 1
+        assert _sample(body, 'process_start_time_seconds') > 0
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 渲染指标测试全部通过")
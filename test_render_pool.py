@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+测试渲染工作池 - 并发槽位、FIFO队列、满队列拒绝、后台任务单独限额
+"""
+import threading
+import time
+
+from render_pool import RenderWorkerPool, QueueFullError, current_job
+
+
+def test_jobs_run_concurrently():
+    pool = RenderWorkerPool(workers=4, max_queue=8)
+    barrier = threading.Barrier(4, timeout=5)
+    jobs = [pool.submit(barrier.wait) for _ in range(4)]
+    for job in jobs:
+        assert job.wait(5)
+        assert job.state == 'done'
+
+
+def test_fifo_order_with_single_slot():
+    pool = RenderWorkerPool(workers=1, max_queue=8)
+    order = []
+    gate = threading.Event()
+    first = pool.submit(gate.wait, 5)
+    jobs = [pool.submit(order.append, i) for i in range(5)]
+    gate.set()
+    for job in [first] + jobs:
+        assert job.wait(5)
+    assert order == [0, 1, 2, 3, 4]
+
+
+def test_full_queue_rejects():
+    pool = RenderWorkerPool(workers=1, max_queue=2)
+    gate = threading.Event()
+    pool.submit(gate.wait, 5)
+    time.sleep(0.1)  # 等待第一个任务占用槽位
+    pool.submit(gate.wait, 5)
+    pool.submit(gate.wait, 5)
+    try:
+        pool.submit(gate.wait, 5)
+        assert False, 'expected QueueFullError'
+    except QueueFullError:
+        pass
+    stats = pool.stats()
+    assert stats['queue_depth'] == 2
+    assert stats['rejected'] == 1
+    gate.set()
+
+
+def test_stale_jobs_are_shed():
+    pool = RenderWorkerPool(workers=1, max_queue=4, max_queue_wait=0.05)
+    gate = threading.Event()
+    pool.submit(gate.wait, 5)
+    stale = pool.submit(lambda: 'rendered')
+    time.sleep(0.2)
+    gate.set()
+    assert stale.wait(5)
+    assert stale.state == 'shed'
+    assert pool.stats()['shed'] == 1
+
+
+def test_failed_job_records_error():
+    pool = RenderWorkerPool(workers=1, max_queue=1)
+    job = pool.submit(lambda: 1 / 0)
+    assert job.wait(5)
+    assert job.state == 'failed'
+    assert 'division' in job.error
+
+
+def test_job_registry_and_progress_events():
+    pool = RenderWorkerPool(workers=1, max_queue=2)
+
+    def render():
+        for i in range(3):
+            current_job().update_progress(animation=i + 1, animations_total=3)
+        return {'success': True}
+
+    job = pool.submit(render)
+    assert pool.get_job(job.id) is job
+    assert job.wait(5)
+    events = job.events_since(0, timeout=0)
+    states = [e['data']['state'] for e in events if e['event'] == 'state']
+    progress = [e['data']['animation'] for e in events if e['event'] == 'progress']
+    assert states == ['queued', 'running', 'done']
+    assert progress == [1, 2, 3]
+    assert job.to_dict()['result'] == {'success': True}
+
+
+def test_cancel_queued_and_running_jobs():
+    pool = RenderWorkerPool(workers=1, max_queue=4)
+
+    def render():
+        current_job().cancel_event.wait(5)
+        return 'stopped'
+
+    running = pool.submit(render)
+    queued = pool.submit(lambda: 'rendered')
+    time.sleep(0.1)
+    assert not pool.has_idle_slot()
+    queued.cancel()
+    assert running.cancel('client disconnected')
+    assert running.wait(5) and queued.wait(5)
+    assert running.state == 'cancelled'
+    assert running.to_dict()['cancel_reason'] == 'client disconnected'
+    assert queued.state == 'cancelled' and queued.result is None
+    assert not queued.cancel()
+    assert pool.stats()['cancelled'] == 2
+    assert pool.has_idle_slot()
+
+
+def test_background_jobs_yield_to_foreground():
+    pool = RenderWorkerPool(workers=1, max_queue=8)
+    order = []
+    gate = threading.Event()
+    pool.submit(gate.wait, 5)
+    time.sleep(0.05)
+    background = pool.submit_background(order.append, 'final')
+    foreground = pool.submit(order.append, 'preview')
+    gate.set()
+    assert background.wait(5) and foreground.wait(5)
+    assert order == ['preview', 'final']
+    assert background.to_dict()['priority'] > foreground.to_dict()['priority']
+
+
+def test_background_jobs_are_not_shed():
+    pool = RenderWorkerPool(workers=1, max_queue=8, max_queue_wait=0.05)
+    gate = threading.Event()
+    pool.submit(gate.wait, 5)
+    background = pool.submit_background(lambda: 'final')
+    time.sleep(0.2)
+    gate.set()
+    assert background.wait(5)
+    assert background.state == 'done'
+
+
+
+def test_submit_if_idle_never_queues_behind_busy_slots():
+    pool = RenderWorkerPool(workers=2, max_queue=8)
+    gate = threading.Event()
+    pool.submit(gate.wait, 5)
+    spare = pool.submit_if_idle(lambda: 'safe')
+    assert spare is not None and spare.wait(5) and spare.result == 'safe'
+    pool.submit(gate.wait, 5)
+    time.sleep(0.05)
+    assert pool.submit_if_idle(lambda: 'safe') is None  # 槽位都在忙，不排队等待
+    stats = pool.stats()
+    assert stats['queue_depth'] == 0 and stats['rejected'] == 0
+    gate.set()
+
+
+def test_background_burst_leaves_room_for_foreground():
+    pool = RenderWorkerPool(workers=1, max_queue=2, max_background_queue=2)
+    gate = threading.Event()
+    pool.submit(gate.wait, 5)
+    time.sleep(0.05)
+    finals = [pool.submit_background(gate.wait, 5) for _ in range(2)]
+    try:
+        pool.submit_background(gate.wait, 5)
+        assert False, 'expected QueueFullError'
+    except QueueFullError:
+        pass
+    previews = [pool.submit(lambda: 'preview') for _ in range(2)]  # 后台任务占满也不影响前台
+    stats = pool.stats()
+    assert stats['background_queue_depth'] == 2 and stats['queue_depth'] == 4
+    gate.set()
+    for job in finals + previews:
+        assert job.wait(5) and job.state == 'done'
+    assert pool.stats()['background_queue_depth'] == 0
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 渲染工作池测试全部通过")
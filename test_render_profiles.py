@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+测试渲染档位 - 档位名称由服务器解析，脚本里写死的分辨率和帧率会被档位覆盖，响应中报告实际使用的档位
+"""
+import sys
+import types
+from unittest import mock
+
+import render_profiles
+from render_profiles import enforce_script, resolve
+
+SCRIPT = '''from manim import *
+
+config.pixel_height = 1080
+config.pixel_width = 1920
+config.frame_rate = 30
+
+class MathSolution(Scene):
+    pass
+'''
+
+
+def _run_script(source):
+    """Execute a generated script against a stand-in manim module, return its config"""
+    config = types.SimpleNamespace()
+    fake_manim = types.ModuleType('manim')
+    fake_manim.config = config
+    fake_manim.Scene = object
+    fake_manim.__all__ = ['config', 'Scene']
+    with mock.patch.dict(sys.modules, {'manim': fake_manim}):
+        exec(compile(source, 'generated_script.py', 'exec'), {})
+    return config
+
+
+def test_resolve_names_aliases_and_unknown():
+    assert resolve('standard').name == 'standard'
+    assert resolve('low_quality').name == 'preview'
+    assert resolve('h').name == 'final'
+    assert resolve(None).name == render_profiles.DEFAULT_PROFILE
+    assert resolve('8k_ultra', default='standard').name == 'standard'
+    assert resolve(resolve('final')) is render_profiles.PROFILES['final']
+
+
+def test_script_config_cannot_override_profile():
+    assert _run_script(SCRIPT).pixel_height == 1080
+    config = _run_script(enforce_script(SCRIPT, 'preview'))
+    assert (config.pixel_width, config.pixel_height, config.frame_rate) == (854, 480, 15)
+
+
+def test_profile_reporting_and_cli_flags():
+    profile = resolve('preview')
+    assert profile.to_dict() == {'name': 'preview', 'resolution': '854x480', 'frame_rate': 15}
+    assert profile.directory_name == '480p15'
+    assert profile.cli_args() == ['-ql', '--resolution', '854,480', '--fps', '15']
+    assert resolve('final').cli_args()[0] == '-qh'
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 渲染档位测试全部通过")
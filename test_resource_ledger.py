@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+测试渲染资源账本 - wait4记录子进程CPU/内存、账本按脚本哈希和题型打标签、渲染之外的进程不记账、按题型汇总每个视频的成本
+"""
+import json
+import tempfile
+from pathlib import Path
+
+import process_tree
+import resource_ledger
+from resource_ledger import ResourceLedger, question_type, summarize
+
+
+def _with_ledger(path, func):
+    previous = resource_ledger._ledger
+    resource_ledger._ledger = ResourceLedger(path)
+    try:
+        return func()
+    finally:
+        resource_ledger._ledger = previous
+
+
+def test_run_reports_child_rusage():
+    result = process_tree.run(['python', '-c', 'x = bytearray(64 * 1024 * 1024); sum(range(2000000))'],
+                              capture_output=True)
+    assert result.returncode == 0
+    usage = resource_ledger.usage_from_rusage(result.rusage)
+    assert usage['cpu_user'] + usage['cpu_sys'] > 0
+    assert usage['max_rss_mb'] >= 64
+    assert result.wall_time > 0
+
+
+def test_records_carry_render_context():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'ledger.jsonl'
+        output = Path(tmp) / 'out.mp4'
+        output.write_bytes(b'x' * 1000)
+
+        def render():
+            with resource_ledger.render_context(script_hash='abcd1234', question_type='triangle',
+                                                quality='low_quality') as context:
+                result = process_tree.run(['python', '-c', 'pass'], capture_output=True)
+                resource_ledger.record('manim', result.rusage, result.wall_time, output_path=output)
+                resource_ledger.record('ffmpeg', {'cpu_user': 0.5, 'cpu_sys': 0.1}, 0.7, mode='copy')
+            assert resource_ledger.record('ffmpeg', None, 0.1) is None  # Outside any render
+            return context['render_id']
+
+        render_id = _with_ledger(path, render)
+        manim, ffmpeg = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+        assert manim['process'] == 'manim' and manim['script_hash'] == 'abcd1234'
+        assert manim['question_type'] == 'triangle' and manim['quality'] == 'low_quality'
+        assert manim['render_id'] == ffmpeg['render_id'] == render_id
+        assert manim['output_bytes'] == 1000 and 'cpu_user' in manim
+        assert ffmpeg['mode'] == 'copy'
+
+
+def test_summary_costs_per_question_type():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'ledger.jsonl'
+        entries = [
+            {'render_id': 'r1', 'process': 'manim', 'question_type': 'triangle', 'script_hash': 'a',
+             'cpu_user': 8, 'cpu_sys': 2, 'wall_time': 12, 'max_rss_mb': 300, 'output_duration': 20},
+            {'render_id': 'r1', 'process': 'ffmpeg', 'question_type': 'triangle', 'script_hash': 'a',
+             'cpu_user': 1, 'cpu_sys': 1, 'wall_time': 1, 'max_rss_mb': 50},
+            {'render_id': 'r2', 'process': 'manim', 'question_type': 'triangle', 'script_hash': 'b',
+             'cpu_user': 30, 'cpu_sys': 0, 'wall_time': 40, 'max_rss_mb': 900, 'output_duration': 20},
+        ]
+        path.write_text(''.join(json.dumps(e) + '\n' for e in entries), encoding='utf-8')
+        summary = summarize([path])
+        triangle = summary['by_question_type']['triangle']
+        assert triangle['renders'] == 2 and triangle['runs'] == 3
+        assert triangle['cpu_per_video'] == 21.0
+        assert triangle['max_rss_mb'] == 900
+        assert triangle['cpu_per_video_second'] == 1.05
+        assert list(summary['costliest_scripts']) == ['b', 'a']
+
+
+def test_question_types():
+    assert question_type('求三角形的面积') == 'triangle'
+    assert question_type('Solve the equation 2x + 3 = 7') == 'equation'
+    assert question_type('解不等式 x > 3') == 'inequality'
+    assert question_type('What is 2 + 2?') == 'generic'
+    assert question_type(None) == 'unknown'
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 渲染资源账本测试全部通过")
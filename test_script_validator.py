@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+测试Manim脚本预检 - 语法错误、未定义名称、缺少场景类、不支持的调用、符号表冷启动时后台探测不阻塞
+"""
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import script_validator
+from script_validator import validate_manim_script, score_script_risk
+
+SYMBOLS = {'Scene', 'MovingCameraScene', 'Text', 'MathTex', 'Write', 'Create', 'Polygon', 'UP', 'DOWN', 'BLUE'}
+
+GOOD_SCRIPT = '''from manim import *
+import numpy as np
+
+class Helper:
+    pass
+
+class MathSolution(Scene):
+    def construct(self):
+        title = Text("Math Problem", font_size=36, color=BLUE)
+        title.to_edge(UP)
+        points = [np.array([x, 0, 0]) for x in range(3)]
+        self.play(Write(title))
+'''
+
+
+def test_valid_script_reports_scene():
+    result = validate_manim_script(GOOD_SCRIPT, symbols=SYMBOLS)
+    assert result['valid'], result['errors']
+    assert result['scene_name'] == 'MathSolution'
+
+
+def test_syntax_error():
+    result = validate_manim_script('from manim import *\nclass A(Scene:\n    pass\n', symbols=SYMBOLS)
+    assert not result['valid']
+    assert result['error_type'] == 'SyntaxError'
+
+
+def test_undefined_manim_symbol():
+    script = GOOD_SCRIPT.replace('Write(title)', 'FancyWrite(title)')
+    result = validate_manim_script(script, symbols=SYMBOLS)
+    assert result['error_type'] == 'NameError'
+    assert "FancyWrite" in result['errors'][0]
+
+
+def test_missing_scene_class():
+    result = validate_manim_script('from manim import *\nx = Text("hi")\n', symbols=SYMBOLS)
+    assert result['error_type'] == 'SceneNotFound'
+
+
+def test_subclass_of_script_scene():
+    script = '''from manim import *
+class Base(MovingCameraScene):
+    pass
+class Lesson(Base):
+    def construct(self):
+        self.play(Create(Polygon()))
+'''
+    result = validate_manim_script(script, symbols=SYMBOLS)
+    assert result['valid'], result['errors']
+    assert result['scene_name'] == 'Lesson'
+
+
+def test_unsupported_constructs():
+    script = GOOD_SCRIPT.replace('self.play(Write(title))', 'name = input("?")')
+    result = validate_manim_script(script, symbols=SYMBOLS)
+    assert result['error_type'] == 'Unsupported'
+    result = validate_manim_script('import tkinter\n' + GOOD_SCRIPT, symbols=SYMBOLS)
+    assert result['error_type'] == 'Unsupported'
+
+
+def test_name_check_skipped_for_foreign_star_import():
+    script = 'from numpy import *\n' + GOOD_SCRIPT.replace('np.array', 'array2')
+    result = validate_manim_script(script, symbols=SYMBOLS)
+    assert result['valid'], result['errors']
+
+
+def test_risk_score_features():
+    assert score_script_risk(GOOD_SCRIPT)['score'] < 0.5
+    risky = GOOD_SCRIPT.replace('"Math Problem"', '"数学问题"') + '        self.add(MathTex(r"\\text{面积}"))\n'
+    risk = score_script_risk(risky)
+    assert risk['features']['cjk_text'] == 1
+    assert risk['features']['cjk_latex'] == 1
+    assert risk['score'] >= 0.5
+    assert score_script_risk('class A(:')['score'] == 1.0
+
+
+def test_cold_symbol_cache_probes_in_background():
+    previous = script_validator.manim_version, script_validator.SYMBOL_CACHE_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        fake_python = Path(tmp) / 'python'
+        fake_python.write_text('#!/bin/sh\nsleep 1\necho \'["Scene", "Text"]\'\n')
+        os.chmod(fake_python, 0o755)
+        script_validator.manim_version = lambda: 'test-cold'
+        script_validator.SYMBOL_CACHE_DIR = Path(tmp) / 'symbols'
+        try:
+            started = time.monotonic()
+            assert script_validator.manim_symbols(str(fake_python)) is None  # 不等待探测
+            assert validate_manim_script(GOOD_SCRIPT)['valid']
+            assert time.monotonic() - started < 0.5
+            assert script_validator.manim_symbols(wait=True) == {'Scene', 'Text'}
+            assert (Path(tmp) / 'symbols' / 'manim_symbols_test-cold.json').exists()
+        finally:
+            script_validator.manim_version, script_validator.SYMBOL_CACHE_DIR = previous
+            script_validator._symbols.pop('test-cold', None)
+            script_validator._probes.pop('test-cold', None)
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 脚本预检测试全部通过")
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+测试并行分段渲染的切分规划 - 按步骤边界切分、按时长均衡、覆盖全部动画
+"""
+from section_render import plan_sections
+
+
+def _times(durations):
+    times, now = [], 0.0
+    for duration in durations:
+        times.append(now)
+        now += duration
+    return times, now
+
+
+def _covers(plan, animations):
+    rendered = [i for first, last in plan for i in range(first, last + 1)]
+    return rendered == list(range(animations))
+
+
+def test_cuts_snap_to_step_boundaries():
+    # 标题(2个动画) + 4个步骤, 每步3个动画
+    times, total = _times([1, 0.5] + [0.8, 1.5, 1.5] * 4)
+    plan = plan_sections(times, total, [2, 5, 8, 11], 4)
+    assert _covers(plan, 14)
+    assert [first for first, _ in plan][1:] == [5, 8, 11]
+
+
+def test_balances_by_running_time_without_markers():
+    times, total = _times([10, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1])
+    plan = plan_sections(times, total, [], 2)
+    assert _covers(plan, 11)
+    assert plan[0] == (0, 0)
+
+
+def test_never_more_sections_than_animations():
+    times, total = _times([1, 1])
+    plan = plan_sections(times, total, [], 8)
+    assert plan == [(0, 0), (1, 1)]
+    assert plan_sections([0.0], 1.0, [], 4) == [(0, 0)]
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 并行分段渲染测试全部通过")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+测试跨请求共享的动画分段缓存 - 按哈希查找、回收新分段、跳过禁用缓存的分段、大小上限淘汰、累计常驻进程的命中统计
+"""
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from segment_cache import SegmentCache
+
+
+def _segment(path, size):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'v' * size)
+    return path
+
+
+def test_collect_then_reuse_from_another_job():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = SegmentCache(Path(tmp) / 'segments')
+        job_a = Path(tmp) / 'media' / 'videos' / 'job_a' / '1080p60' / 'partial_movie_files' / 'Scene'
+        _segment(job_a / '123_456_789.mp4', 10)
+        (job_a / 'partial_movie_file_list.txt').write_text('file')
+        assert cache.collect(job_a) == 1
+        assert cache.collect(job_a) == 0
+
+        reader = SegmentCache(Path(tmp) / 'segments')
+        assert reader.get('123_456_789.mp4').read_bytes() == b'v' * 10
+        assert reader.get('999_456_789.mp4') is None
+        assert reader.stats()['hit_ratio'] == 0.5
+
+
+def test_uncached_segments_are_not_shared():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = SegmentCache(Path(tmp) / 'segments')
+        job = Path(tmp) / 'job'
+        _segment(job / 'uncached_00000.mp4', 10)
+        assert cache.collect(job) == 0
+        assert cache.stats()['entries'] == 0
+
+
+def test_eviction_keeps_recent_segments():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = SegmentCache(Path(tmp) / 'segments', max_bytes=250)
+        for i, name in enumerate(['a', 'b', 'c']):
+            job = Path(tmp) / f'job_{name}'
+            _segment(job / f'{name}.mp4', 100)
+            cache.collect(job)
+            stamp = time.time() + i
+            os.utime(cache.path_for(f'{name}.mp4'), (stamp, stamp))
+        assert cache.get('a.mp4') is None
+        assert cache.get('b.mp4') and cache.get('c.mp4')
+        assert cache.stats()['bytes'] <= 250
+
+
+def test_stats_count_worker_lookups_and_reuse_the_size_figure():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = SegmentCache(Path(tmp) / 'segments')
+        # 查找发生在常驻进程里，服务进程只能从渲染结果累计
+        cache.record_render({'segments_reused': 3, 'segment_misses': 1, 'segments_stored': 1})
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses'], stats['stored']) == (3, 1, 1)
+        assert stats['hit_ratio'] == 0.75 and stats['entries'] == 0
+
+        _segment(cache.path_for('d.mp4'), 10)  # 另一个进程写入，不触发重新统计
+        assert cache.stats()['entries'] == 0
+        cache.USAGE_REFRESH_INTERVAL = 0
+        assert cache.stats()['entries'] == 1
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 动画分段缓存测试全部通过")
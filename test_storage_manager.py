@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+测试存储生命周期管理 - 过期清理、超出容量按最近使用淘汰、保护被引用/被缓存/正在写入的文件、试运行报告、相同视频硬链接去重
+"""
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from storage_manager import HOUR, StorageManager, StoragePolicy
+
+
+def _file(path, size, age_hours):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'x' * size)
+    stamp = time.time() - age_hours * HOUR
+    os.utime(path, (stamp, stamp))
+    return path
+
+
+def test_expired_then_least_recently_used_over_budget():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / 'videos'
+        old = _file(root / 'old.mp4', 100, 50)
+        a = _file(root / 'a.mp4', 100, 5)
+        b = _file(root / 'b.mp4', 100, 4)
+        c = _file(root / 'c.mp4', 100, 3)
+        manager = StorageManager([StoragePolicy('videos', root, max_bytes=200, max_age=48 * HOUR)])
+        report = manager.sweep()
+        reasons = {Path(item['path']).name: item['reason'] for item in report['policies']['videos']['delete']}
+        assert reasons == {'old.mp4': 'expired', 'a.mp4': 'over_budget'}
+        assert not old.exists() and not a.exists()
+        assert b.exists() and c.exists()
+        assert report['freed_bytes'] == 200
+
+
+def test_referenced_cached_and_fresh_files_are_kept():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / 'videos'
+        referenced = _file(root / 'job.mp4', 100, 10)
+        cached = _file(root / 'cached.mp4', 100, 10)
+        os.link(cached, Path(tmp) / 'cache_entry.mp4')
+        fresh = _file(root / 'fresh.mp4', 100, 0)
+        manager = StorageManager([StoragePolicy('videos', root, max_bytes=0, max_age=HOUR)])
+        manager.add_references(lambda: [referenced])
+        report = manager.sweep()
+        assert report['deleted'] == 0
+        assert report['policies']['videos']['kept'] == {'referenced': 1, 'cached': 1, 'in_use': 1}
+        assert referenced.exists() and cached.exists() and fresh.exists()
+
+
+def test_dry_run_reports_without_deleting():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / 'temp'
+        log = _file(root / 'error_abc.log', 10, 24 * 30)
+        report = StorageManager([StoragePolicy('temp', root, max_age=24 * HOUR)]).sweep(dry_run=True)
+        assert [Path(item['path']).name for item in report['policies']['temp']['delete']] == ['error_abc.log']
+        assert report['deleted'] == 0 and log.exists()
+
+
+def test_entries_are_removed_as_whole_directories():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / 'media_videos'
+        _file(root / 'request_old' / '1080p60' / 'partial_movie_files' / 'Scene' / 'h1.mp4', 50, 30)
+        _file(root / 'request_old' / '1080p60' / 'request_old.mp4', 50, 30)
+        _file(root / 'request_new' / '1080p60' / 'request_new.mp4', 50, 2)
+        policy = StoragePolicy('media_videos', root, max_age=24 * HOUR, unit='entries')
+        report = StorageManager([policy]).sweep()
+        assert report['policies']['media_videos']['freed_bytes'] == 100
+        assert sorted(p.name for p in root.iterdir()) == ['request_new']
+
+
+def test_identical_videos_are_hardlinked_and_savings_reported():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / 'videos'
+        canned = _file(root / 'math_triangle_area_test.mp4', 1000, 30)
+        copies = [_file(root / f'fallback_{i}.mp4', 1000, 2) for i in range(3)]
+        other = root / 'other.mp4'
+        other.write_bytes(b'y' * 1000)
+        os.utime(other, (time.time() - HOUR, time.time() - HOUR))
+        fresh = _file(root / 'still_writing.mp4', 1000, 0)
+        manager = StorageManager([StoragePolicy('videos', root, dedupe=True)])
+
+        dry = manager.sweep(dry_run=True)
+        assert dry['dedupe_saved_bytes'] == 3000
+        assert all(p.stat().st_nlink == 1 for p in copies)
+
+        report = manager.sweep()
+        assert report['policies']['videos']['dedupe'] == {'groups': 1, 'linked': 3, 'saved_bytes': 3000}
+        assert all(p.stat().st_ino == canned.stat().st_ino for p in copies)
+        assert other.stat().st_nlink == 1 and fresh.stat().st_nlink == 1
+        assert manager.sweep()['dedupe_saved_bytes'] == 0  # Nothing left to link
+        assert manager.stats()['dedupe_saved_bytes'] == 3000
+
+
+def test_names_linked_within_a_directory_expire_together():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / 'videos'
+        first = _file(root / 'a.mp4', 100, 50)
+        os.link(first, root / 'b.mp4')
+        manager = StorageManager([StoragePolicy('videos', root, max_age=48 * HOUR)])
+        report = manager.sweep()
+        assert report['policies']['videos']['freed_bytes'] == 100
+        assert report['policies']['videos']['delete'][0]['links']
+        assert not list(root.iterdir())
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 存储生命周期管理测试全部通过")
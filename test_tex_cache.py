@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+测试共享LaTeX SVG缓存 - 跨进程共享目录、大小上限淘汰、CLI脚本尾部挂钩按需查缓存、常驻进程和CLI的查找次数汇总到服务进程、模板公式提取
+"""
+import contextlib
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+from unittest import mock
+
+from tex_cache import TexSvgCache, enable_in_script, harvest_formulas
+
+
+def _svg(path, size):
+    Path(path).write_bytes(b'<' * size)
+    return path
+
+
+def test_entries_shared_between_instances():
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = TexSvgCache(Path(tmp) / 'tex')
+        reader = TexSvgCache(Path(tmp) / 'tex')
+        assert reader.get('abc') is None
+        writer.put('abc', _svg(Path(tmp) / 'abc.svg', 10))
+        assert reader.get('abc').read_bytes() == b'<' * 10
+        assert reader.stats()['hits'] == 1
+        assert reader.stats()['misses'] == 1
+
+
+def test_eviction_keeps_recent_entries():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = TexSvgCache(Path(tmp) / 'tex', max_bytes=250)
+        for i, key in enumerate(['a', 'b', 'c']):
+            cache.put(key, _svg(Path(tmp) / f'{key}.svg', 100))
+            os.utime(cache.path_for(key), (time.time() + i, time.time() + i))
+        assert cache.get('a') is None
+        assert cache.get('b') and cache.get('c')
+        assert cache.stats()['bytes'] <= 250
+
+
+def _fake_manim(tex_dir, compiled):
+    """Stand-in manim modules: tex_to_svg_file "compiles" into tex_dir and counts it"""
+    config = types.SimpleNamespace(tex_dir=str(tex_dir), tex_template='template')
+    config.get_dir = lambda name: Path(config.tex_dir)
+    tex_file_writing = types.ModuleType('manim.utils.tex_file_writing')
+
+    def generate_tex_file(expression, environment, template):
+        source = f'{template}{environment}{expression}'
+        tex_file = Path(config.tex_dir) / f'{hashlib.sha256(source.encode()).hexdigest()[:16]}.tex'
+        tex_file.parent.mkdir(parents=True, exist_ok=True)
+        tex_file.write_text(source)
+        return tex_file
+
+    def tex_to_svg_file(expression, environment=None, tex_template=None):
+        compiled.append(expression)
+        svg = generate_tex_file(expression, environment, tex_template or config.tex_template).with_suffix('.svg')
+        svg.write_text(f'<svg>{expression}</svg>')
+        return svg
+
+    tex_file_writing.generate_tex_file = generate_tex_file
+    tex_file_writing.tex_to_svg_file = tex_to_svg_file
+    tex_mobject = types.ModuleType('manim.mobject.text.tex_mobject')
+    tex_mobject.tex_to_svg_file = tex_to_svg_file
+    manim = types.ModuleType('manim')
+    manim.config = config
+    manim.MathTex = lambda expression: tex_mobject.tex_to_svg_file(expression)
+    manim.__all__ = ['config', 'MathTex']
+    return {
+        'manim': manim,
+        'manim.utils': types.ModuleType('manim.utils'),
+        'manim.utils.tex_file_writing': tex_file_writing,
+        'manim.mobject': types.ModuleType('manim.mobject'),
+        'manim.mobject.text': types.ModuleType('manim.mobject.text'),
+        'manim.mobject.text.tex_mobject': tex_mobject,
+    }
+
+
+def test_cli_script_trailer_uses_shared_cache():
+    # 公式在construct()里构建，即模块（含尾部挂钩）执行完之后
+    script = 'from manim import *\n\ndef construct():\n    return MathTex("a^2 + b^2 = c^2")\n'
+    with tempfile.TemporaryDirectory() as tmp:
+        compiled = []
+        server_cache = TexSvgCache(Path(tmp) / 'shared')
+        with mock.patch.object(TexSvgCache.__init__, '__defaults__', (Path(tmp) / 'shared', 10 ** 6)):
+            for job in ('job1', 'job2'):  # 两次独立的CLI渲染
+                with mock.patch.dict(sys.modules, _fake_manim(Path(tmp) / job / 'Tex', compiled)), \
+                        mock.patch('atexit.register') as at_exit:
+                    namespace = {}
+                    exec(compile(enable_in_script(script), 'manim_script.py', 'exec'), namespace)
+                    namespace['construct']()
+                    # 子进程退出时打印查找次数，服务进程从输出里累计
+                    output = io.StringIO()
+                    with contextlib.redirect_stdout(output):
+                        at_exit.call_args[0][0]()
+                    server_cache.record_output(output.getvalue())
+        assert compiled == ['a^2 + b^2 = c^2']  # 第二次渲染直接取缓存，不再编译
+        assert len(list((Path(tmp) / 'job2' / 'Tex').glob('*.svg'))) == 1
+        assert len(list((Path(tmp) / 'shared').glob('*.svg'))) == 1
+        stats = server_cache.stats()
+        assert (stats['hits'], stats['misses']) == (1, 1)
+
+
+def test_worker_results_feed_server_counters():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = TexSvgCache(Path(tmp) / 'tex')
+        cache.record_render({'cache_lookups': {'tex': (4, 1), 'segment': (2, 0)}})
+        cache.record_render({'success': False})
+        assert cache.stats()['hit_ratio'] == 0.8
+
+
+def test_harvest_direct_and_template_formulas():
+    source = '''
+from manim import *
+formula = MathTex(r"a^2 + b^2 = c^2", font_size=36)
+dynamic = MathTex(value)
+
+def template(base):
+    fixed = \'\'\'
+        formula = MathTex(r"A = \\\\frac{1}{2} \\\\times b \\\\times h", font_size=36)\'\'\'
+    return fixed + f\'\'\'
+        calc = MathTex(r"A = {base}", font_size=32)\'\'\'
+'''
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'scene.py'
+        path.write_text(source, encoding='utf-8')
+        formulas = harvest_formulas([path])
+    assert ('MathTex', ('a^2 + b^2 = c^2',)) in formulas
+    assert ('MathTex', ('A = \\frac{1}{2} \\times b \\times h',)) in formulas
+    assert len(formulas) == 2
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 LaTeX SVG缓存测试全部通过")
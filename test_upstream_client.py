@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+测试上游HTTPS连接池 - 本地dashscope替身统计TLS握手次数、长连接复用、每个请求单独超时、上游关闭连接后重试、非2xx抛出UpstreamHTTPError
+"""
+import json
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from upstream_client import HTTPSConnectionPool, UpstreamHTTPError
+
+
+class DashscopeStandIn(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/slow':
+            time.sleep(1.0)
+        if self.path == '/error':
+            self._reply(500, {'code': 'InternalError'})
+        elif self.path == '/close':
+            self._reply(200, {'ok': True}, close=True)
+        else:
+            self._reply(200, {'output': {'text': '答案'}})
+
+    def _reply(self, status, payload, close=False):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if close:
+            # 不带Connection: close就断开，模拟上游回收空闲长连接
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class CountingTLSServer(ThreadingHTTPServer):
+    """每接受一个连接做一次TLS握手并计数"""
+    daemon_threads = True
+
+    def __init__(self, context):
+        super().__init__(('127.0.0.1', 0), DashscopeStandIn)
+        self.context = context
+        self.handshakes = 0
+
+    def get_request(self):
+        sock, address = self.socket.accept()
+        self.handshakes += 1
+        return self.context.wrap_socket(sock, server_side=True), address
+
+    def handle_error(self, request, client_address):
+        pass  # 客户端超时后断开，替身写回响应失败属预期
+
+
+def _with_stand_in(func):
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = Path(tmp) / 'cert.pem', Path(tmp) / 'key.pem'
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-subj', '/CN=localhost',
+                        '-days', '1', '-keyout', str(key), '-out', str(cert)], check=True, capture_output=True)
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(cert, key)
+        server = CountingTLSServer(server_context)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        client_context = ssl.create_default_context()
+        client_context.check_hostname = False
+        client_context.verify_mode = ssl.CERT_NONE
+        pool = HTTPSConnectionPool('127.0.0.1', server.server_address[1], ssl_context=client_context)
+        try:
+            return func(server, pool)
+        finally:
+            pool.close()
+            server.shutdown()
+            server.server_close()
+
+
+def test_requests_reuse_one_connection():
+    def check(server, pool):
+        for _ in range(5):
+            status, headers, body = pool.request('POST', '/generation', b'{}', {'Content-Type': 'application/json'})
+            assert status == 200 and json.loads(body)['output']['text'] == '答案'
+        assert server.handshakes == 1
+        stats = pool.stats()
+        assert stats['connections_opened'] == 1 and stats['requests'] == 5
+        assert stats['reused'] == 4 and stats['reuse_ratio'] == 0.8
+
+    _with_stand_in(check)
+
+
+def test_timeout_applies_to_one_request():
+    def check(server, pool):
+        previous = socket.getdefaulttimeout()
+        try:
+            pool.request('POST', '/slow', b'{}', timeout=0.2)
+            assert False, 'slow request should time out'
+        except (socket.timeout, TimeoutError):
+            pass
+        assert socket.getdefaulttimeout() == previous
+        # 超时的连接被丢弃，下一个请求用新连接和自己的超时
+        status, _, _ = pool.request('POST', '/slow', b'{}', timeout=5)
+        assert status == 200 and pool.stats()['connections_opened'] == 2
+
+    _with_stand_in(check)
+
+
+def test_stale_connection_is_retried():
+    def check(server, pool):
+        pool.request('POST', '/close', b'{}')
+        time.sleep(0.1)
+        status, _, _ = pool.request('POST', '/generation', b'{}')
+        assert status == 200
+        stats = pool.stats()
+        assert stats['stale_retries'] == 1 and server.handshakes == 2
+
+    _with_stand_in(check)
+
+
+def test_error_status_raises_and_keeps_connection():
+    def check(server, pool):
+        try:
+            pool.request('POST', '/error', b'{}')
+            assert False, '500 should raise'
+        except UpstreamHTTPError as e:
+            assert e.status == 500 and b'InternalError' in e.body
+        pool.request('POST', '/generation', b'{}')
+        assert server.handshakes == 1
+
+    _with_stand_in(check)
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 上游HTTPS连接池测试全部通过")
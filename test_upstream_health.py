@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+测试上游健康监测 - 熔断器closed/open/half_open状态切换、错误率窗口、4xx不算故障、后台探测只在空闲或熔断时进行、/api/qwen熔断时直接走备用响应、5xx重试而4xx不重试
+"""
+import json
+import socketserver
+import threading
+import time
+import urllib.request
+
+import server
+from upstream_client import UpstreamHTTPError
+from upstream_health import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, UpstreamHealthMonitor
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_half_opens_and_closes():
+    clock = FakeClock()
+    breaker = CircuitBreaker('test-cycle', failure_threshold=3, cooldown=30, clock=clock)
+    for _ in range(3):
+        assert breaker.allow_request()
+        breaker.record_failure(ConnectionRefusedError('refused'))
+    assert breaker.state == OPEN and not breaker.allow_request()
+    assert breaker.snapshot()['last_error'].startswith('ConnectionRefusedError')
+
+    clock.now += 30
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request()          # 只放行一个试探请求
+    assert not breaker.allow_request()
+    breaker.record_failure(TimeoutError('timed out'))
+    assert breaker.state == OPEN
+
+    clock.now += 30
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow_request()
+
+
+def test_error_rate_trips_and_client_errors_do_not():
+    clock = FakeClock()
+    breaker = CircuitBreaker('test-rate', failure_threshold=100, error_rate=0.5, min_samples=4, window=60,
+                             clock=clock)
+    for _ in range(10):
+        breaker.record_exception(UpstreamHTTPError(401, 'Unauthorized'))  # 密钥错误说明上游可达
+    assert breaker.state == CLOSED
+
+    clock.now += 61  # 旧样本滑出窗口
+    for error in (None, UpstreamHTTPError(503, 'Service Unavailable'), None, UpstreamHTTPError(429, 'Too Many')):
+        if error is None:
+            breaker.record_success()
+        else:
+            breaker.record_exception(error)
+    snapshot = breaker.snapshot()
+    assert snapshot['state'] == OPEN and snapshot['window_error_rate'] == 0.5
+
+
+def test_monitor_probes_only_when_idle_or_open():
+    clock = FakeClock()
+    breaker = CircuitBreaker('test-monitor', failure_threshold=1, cooldown=30, clock=clock)
+    probes = []
+    healthy = [True]
+
+    def probe():
+        probes.append(clock.now)
+        if not healthy[0]:
+            raise ConnectionResetError('reset')
+
+    monitor = UpstreamHealthMonitor(breaker, probe, interval=10)
+    breaker.record_success()
+    assert monitor.check() is None and probes == []  # 刚有真实流量，不探测
+
+    clock.now += 10
+    healthy[0] = False
+    assert monitor.check() is False and breaker.state == OPEN
+    clock.now += 10
+    assert monitor.check() is None  # 冷却中
+
+    clock.now += 20
+    healthy[0] = True
+    assert monitor.check() is True and breaker.state == CLOSED
+    assert len(probes) == 2
+
+
+class RefusingPool:
+    def __init__(self):
+        self.calls = 0
+
+    def request(self, *args, **kwargs):
+        self.calls += 1
+        raise ConnectionRefusedError('refused')
+
+
+def _post_qwen(breaker, pool):
+    previous = server.DASHSCOPE_BREAKER, server.DASHSCOPE_POOL
+    server.DASHSCOPE_BREAKER, server.DASHSCOPE_POOL = breaker, pool
+    httpd = socketserver.TCPServer(('127.0.0.1', 0), server.CORSHTTPRequestHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        body = json.dumps({'api_key': 'sk-test', 'messages': [{'role': 'user', 'content': '解方程 2x+3=7'}]})
+        req = urllib.request.Request(f'http://127.0.0.1:{httpd.server_address[1]}/api/qwen', data=body.encode(),
+                                     headers={'Content-Type': 'application/json'})
+        started = time.monotonic()
+        with urllib.request.urlopen(req, timeout=10) as response:
+            return json.loads(response.read()), time.monotonic() - started
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        server.DASHSCOPE_BREAKER, server.DASHSCOPE_POOL = previous
+
+
+def test_open_breaker_serves_fallback_without_calling_upstream():
+    breaker = CircuitBreaker('test-open', failure_threshold=1, cooldown=300)
+    breaker.record_failure(ConnectionRefusedError('refused'))
+    pool = RefusingPool()
+    data, elapsed = _post_qwen(breaker, pool)
+    assert data['output']['text'] and pool.calls == 0
+    assert elapsed < 2
+
+
+def test_failures_trip_breaker_and_stop_retries():
+    breaker = CircuitBreaker('test-trip', failure_threshold=1, cooldown=300)
+    pool = RefusingPool()
+    data, elapsed = _post_qwen(breaker, pool)
+    assert data['output']['text']
+    assert pool.calls == 1 and breaker.state == OPEN  # 熔断后不再等待重试
+    assert elapsed < 2
+
+
+
+class ScriptedPool:
+    """按顺序返回预设结果：异常则抛出，否则作为响应体返回"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def request(self, *args, **kwargs):
+        outcome = self.outcomes[self.calls]
+        self.calls += 1
+        if isinstance(outcome, Exception):
+            raise outcome
+        return 200, {}, json.dumps(outcome).encode()
+
+
+def test_server_errors_are_retried_and_client_errors_are_not():
+    breaker = CircuitBreaker('test-retry', failure_threshold=3, cooldown=300)
+    pool = ScriptedPool(UpstreamHTTPError(503, 'Service Unavailable'), {'output': {'text': '上游答案'}})
+    data, _ = _post_qwen(breaker, pool)
+    assert data['output']['text'] == '上游答案' and pool.calls == 2
+    assert breaker.state == CLOSED
+
+    pool = ScriptedPool(UpstreamHTTPError(401, 'Unauthorized'))
+    data, elapsed = _post_qwen(breaker, pool)
+    assert data['output']['text'] and pool.calls == 1  # 密钥错误直接走备用响应
+    assert breaker.state == CLOSED and elapsed < 2
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 上游健康监测测试全部通过")
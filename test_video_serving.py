@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+测试视频文件服务 - 断点续传(Range/206/416)、ETag条件请求(304)、ETag按内容计算且不阻塞首次响应、仅缓存键命名的文件长缓存、路径穿越防护
+"""
+import http.client
+import http.server
+import os
+import tempfile
+import hashlib
+import threading
+import time
+from pathlib import Path
+
+from video_serving import (cache_control, file_etag, identity_etag, parse_range, remember_digest,
+                           serve_from_directory)
+
+VIDEO = bytes(range(256)) * 40
+
+
+def _serve(root):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            serve_from_directory(self, root, self.path[len('/rendered_videos/'):])
+
+        def do_HEAD(self):
+            serve_from_directory(self, root, self.path[len('/rendered_videos/'):], head=True)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _get(server, path, headers=None, method='GET'):
+    conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+    conn.request(method, path, headers=headers or {})
+    response = conn.getresponse()
+    body = response.read()
+    conn.close()
+    return response, body
+
+
+def test_parse_range_forms():
+    assert parse_range('bytes=0-99', 1000) == (0, 99)
+    assert parse_range('bytes=900-', 1000) == (900, 999)
+    assert parse_range('bytes=-100', 1000) == (900, 999)
+    assert parse_range('bytes=990-2000', 1000) == (990, 999)
+    assert parse_range('bytes=0-1,5-6', 1000) is None
+    assert parse_range(None, 1000) is None
+    for unsatisfiable in ('bytes=1000-', 'bytes=-0', 'bytes=5-1'):
+        try:
+            parse_range(unsatisfiable, 1000)
+            assert False, unsatisfiable
+        except ValueError:
+            pass
+
+
+def test_full_range_and_conditional_responses():
+    with tempfile.TemporaryDirectory() as tmp:
+        (Path(tmp) / 'lesson.mp4').write_bytes(VIDEO)
+        server = _serve(tmp)
+        try:
+            response, body = _get(server, '/rendered_videos/lesson.mp4')
+            assert response.status == 200 and body == VIDEO
+            assert response.getheader('Accept-Ranges') == 'bytes'
+            assert response.getheader('Content-Type') == 'video/mp4'
+            etag = response.getheader('ETag')
+
+            response, body = _get(server, '/rendered_videos/lesson.mp4', {'Range': 'bytes=5000-5099'})
+            assert response.status == 206 and body == VIDEO[5000:5100]
+            assert response.getheader('Content-Range') == f'bytes 5000-5099/{len(VIDEO)}'
+
+            response, body = _get(server, '/rendered_videos/lesson.mp4', {'Range': f'bytes={len(VIDEO)}-'})
+            assert response.status == 416
+            assert response.getheader('Content-Range') == f'bytes */{len(VIDEO)}'
+
+            response, body = _get(server, '/rendered_videos/lesson.mp4', {'If-None-Match': etag})
+            assert response.status == 304 and body == b''
+
+            response, body = _get(server, '/rendered_videos/lesson.mp4',
+                                  {'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+            assert response.status == 200 and body == VIDEO
+
+            response, body = _get(server, '/rendered_videos/lesson.mp4', method='HEAD')
+            assert response.status == 200 and response.getheader('Content-Length') == str(len(VIDEO))
+        finally:
+            server.shutdown()
+
+
+def test_missing_and_traversal_are_404():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / 'videos'
+        root.mkdir()
+        (Path(tmp) / 'secret.txt').write_text('secret')
+        server = _serve(root)
+        try:
+            assert _get(server, '/rendered_videos/nope.mp4')[0].status == 404
+            assert _get(server, '/rendered_videos/..%2Fsecret.txt')[0].status == 404
+        finally:
+            server.shutdown()
+
+
+def test_etag_follows_content_not_inode_or_mtime():
+    with tempfile.TemporaryDirectory() as tmp:
+        original = Path(tmp) / 'a.mp4'
+        original.write_bytes(VIDEO)
+        remember_digest(original)  # 发布时计算摘要
+        etag = file_etag(original)
+        os.utime(original, (1, 1))
+        remember_digest(original)
+        assert file_etag(original) == etag
+        relinked = Path(tmp) / 'b.mp4'  # 去重重新链接：新inode，相同内容
+        relinked.write_bytes(VIDEO)
+        remember_digest(relinked)
+        os.replace(relinked, original)
+        assert file_etag(original) == etag
+        original.write_bytes(VIDEO[::-1])
+        remember_digest(original)
+        assert file_etag(original) != etag
+
+
+def test_unpublished_file_is_not_hashed_before_serving():
+    with tempfile.TemporaryDirectory() as tmp:
+        video = Path(tmp) / 'c.mp4'
+        video.write_bytes(VIDEO)
+        stat = video.stat()
+        # 首次请求不读整个文件，先用inode/大小/mtime，摘要在后台计算
+        assert file_etag(video) == identity_etag(stat)
+        content_etag = f'"{hashlib.sha256(VIDEO).hexdigest()[:32]}"'
+        for _ in range(100):
+            if file_etag(video) == content_etag:
+                break
+            time.sleep(0.02)
+        else:
+            raise AssertionError('digest never computed')
+
+
+def test_only_cache_key_names_are_immutable():
+    assert 'immutable' in cache_control('9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08.mp4')
+    assert cache_control('9f86d081884c7d659a2feaa0c55ad015.mp4') == 'no-cache'
+    assert cache_control('lesson_9f86d081884c7d65.mp4') == 'no-cache'
+    assert cache_control('manim_1718000000.mp4') == 'no-cache'
+    assert cache_control('lesson_with_audio_1718000000123456.mp4') == 'no-cache'
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 视频文件服务测试全部通过")
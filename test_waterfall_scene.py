@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+测试瀑布场景数据化 - 每个请求只写课程JSON，不再生成Python脚本；所有请求渲染同一个固定的waterfall_scene模块
+"""
+import http.client
+import json
+import os
+import socketserver
+import tempfile
+import threading
+from pathlib import Path
+from unittest import mock
+
+import waterfall_manim_server
+from waterfall_manim_server import WATERFALL_SCENE, WATERFALL_SCENE_DATA_ENV, WaterfallManimServer
+
+
+def _post_render(body):
+    server = socketserver.TCPServer(('127.0.0.1', 0), WaterfallManimServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+        conn.request('POST', '/render', json.dumps(body), {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        payload = json.loads(response.read())
+        conn.close()
+        return response.status, payload
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_requests_render_the_fixed_module_from_json():
+    renders = []
+
+    def fake_render_scene(script_path, scene_name, environ=None, output_file=None, **kwargs):
+        with open(environ[WATERFALL_SCENE_DATA_ENV], encoding='utf-8') as f:
+            renders.append({'script_path': script_path, 'scene_name': scene_name,
+                            'keep_module': kwargs.get('keep_module'), 'data': json.load(f)})
+        video = Path('media', 'videos', 'waterfall_scene', '480p15', f'{output_file}.mp4')
+        video.parent.mkdir(parents=True, exist_ok=True)
+        video.write_bytes(b'mp4')
+        return {'success': True, 'video_path': str(video)}
+
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            with mock.patch.object(waterfall_manim_server, 'render_scene', fake_render_scene), \
+                    mock.patch.object(waterfall_manim_server.MANIM_CAPABILITY, 'snapshot',
+                                      return_value={'available': True}), \
+                    mock.patch.object(tempfile, 'tempdir', tmp):
+                for name in ('lesson_a', 'lesson_b'):
+                    status, response = _post_render({
+                        'question': '求底边为6、高为4的三角形面积',
+                        'solution': '1. 面积公式 S = 1/2 × 底 × 高\n2. S = 1/2 × 6 × 4 = 12',
+                        'output_name': name,
+                    })
+                    assert status == 200 and response['success'], response
+                    assert response['type'] == 'waterfall_tutorial'
+            assert not list(Path(tmp).glob('*.py')) and not list(Path(tmp).glob('*.json'))
+        finally:
+            os.chdir(previous)
+
+    assert len(renders) == 2
+    assert {r['script_path'] for r in renders} == {WATERFALL_SCENE}
+    assert all(r['scene_name'] == 'WaterfallTutorialScene' and r['keep_module'] for r in renders)
+    contents = renders[0]['data']['contents']
+    assert contents and all(isinstance(item.get('color', 'WHITE'), str) for item in contents)
+    assert renders[0]['data']['scripts']
+
+
+def test_scene_module_has_no_eval():
+    source = WATERFALL_SCENE.read_text(encoding='utf-8')
+    assert 'eval(' not in source
+    assert "class WaterfallTutorialScene(Scene)" in source
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 瀑布场景数据化测试全部通过")
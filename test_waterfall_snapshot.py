@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+测试瀑布服务器健康快照 - Manim可用性只在启动/后台探测一次，健康检查和渲染请求读取内存快照，视频列表来自维护的索引而非每次扫描目录
+"""
+import subprocess
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from waterfall_manim_server import ManimCapability, VideoIndex
+
+
+def test_probe_runs_once_and_reads_are_served_from_memory():
+    capability = ManimCapability()
+    completed = subprocess.CompletedProcess([], 0, stdout='0.18.1\n', stderr='')
+    with mock.patch('subprocess.run', return_value=completed) as run:
+        for _ in range(20):
+            assert capability.available
+        snapshot = capability.snapshot()
+    assert run.call_count == 1
+    assert snapshot['version'] == '0.18.1' and snapshot['checked_at'] is not None
+
+
+def test_probe_failure_is_reported_not_raised():
+    capability = ManimCapability()
+    with mock.patch('subprocess.run', side_effect=subprocess.TimeoutExpired('python', 5)):
+        snapshot = capability.refresh()
+    assert snapshot['available'] is False and 'timed out' in snapshot['error']
+
+
+def test_video_index_tracks_published_videos():
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        (directory / 'math_triangle_area.mp4').write_bytes(b'x' * 10)
+        (directory / 'unrelated.mp4').write_bytes(b'x')
+        index = VideoIndex(directory)
+        assert [v['name'] for v in index.videos()] == ['math_triangle_area.mp4']
+
+        published = directory / 'algebra_equation.mp4'
+        published.write_bytes(b'x' * 5)
+        with mock.patch.object(Path, 'glob', side_effect=AssertionError('health check scanned the directory')):
+            index.add(published)
+            index.add(directory / 'notes.txt')
+            videos = index.videos()
+        assert [v['name'] for v in videos] == ['algebra_equation.mp4', 'math_triangle_area.mp4']
+        assert videos[0]['size'] == 5
+
+        (directory / 'math_triangle_area.mp4').unlink()
+        index.rescan()
+        assert [v['name'] for v in index.videos()] == ['algebra_equation.mp4']
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")
+    print("🎉 瀑布服务器健康快照测试全部通过")
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Shared LaTeX SVG Cache
+One tex -> SVG cache for every render server and worker process, keyed by
+Manim's own tex hash (sha256 of the full .tex source including the template
+preamble), so a formula compiled once by any server is never run through
+latex/dvisvgm again.
+
+Manim processes keep a private tex_dir (Manim deletes every non-SVG file in
+it after each compile, which races when several processes share one) and
+exchange finished SVGs through this directory. Entries are published with
+link + rename, so readers only ever see complete files, and eviction works
+from the directory itself so every process enforces the same budget.
+
+Persistent Manim workers install the lookup hook at startup; scripts handed
+to the Manim CLI get it from a trailer (enable_in_script), so a CLI render
+looks up only the formulas its scene actually builds.
+
+Lookups happen in those processes, not in the server: workers return their
+counts with each result (record_render) and CLI renders print them on exit
+(record_output), so the server's stats() cover every render.
+
+Usage:
+    python tex_cache.py warm [--dry-run] [paths...]   compile template formulas
+    python tex_cache.py stats
+"""
+
+import ast
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from render_cache import link_or_copy
+
+BASE_DIR = Path(__file__).parent.absolute()
+TEX_CACHE_DIR = Path(os.environ.get('MANIM_TEX_CACHE_DIR', BASE_DIR / 'tex_cache'))
+TEX_CACHE_MAX_BYTES = int(os.environ.get('MANIM_TEX_CACHE_MAX_BYTES', 128 * 1024 ** 2))
+
+SCRIPT_TRAILER = '''
+
+# --- shared tex cache, appended by the render server: formulas are looked up
+# --- in (and compiled into) the cache as the scene builds them
+import sys as _tex_cache_sys
+if {import_path!r} not in _tex_cache_sys.path:
+    _tex_cache_sys.path.insert(0, {import_path!r})
+try:
+    import atexit as _tex_cache_atexit
+    from manim import config as _tex_cache_config
+    from tex_cache import TexSvgCache as _TexSvgCache, install_manim_hook as _install_tex_cache
+    _tex_cache = _TexSvgCache()
+    if _install_tex_cache(_tex_cache, tex_dir=_tex_cache_config.get_dir('tex_dir')):
+        _tex_cache_atexit.register(_tex_cache.report_lookups)
+except Exception as _tex_cache_error:
+    print(f"Shared tex cache unavailable: {{_tex_cache_error}}")
+'''
+
+# Printed by a CLI render on exit, parsed back by the server (record_output)
+LOOKUPS_LINE = 'Shared tex cache lookups: {hits} hits, {misses} misses'
+LOOKUPS_RE = re.compile(r'^Shared tex cache lookups: (\d+) hits, (\d+) misses$', re.MULTILINE)
+
+TEX_CLASSES = {'MathTex', 'Tex'}
+# MathTex(r"...") embedded in the script templates the servers generate
+EMBEDDED_TEX_RE = re.compile(r'\b(MathTex|Tex)\(\s*(r?"[^"\n]*"|r?\'[^\'\n]*\')\s*[,)]')
+DEFAULT_WARM_SOURCES = [
+    'real_manim_video_server_v2.py',
+    'enhanced_manim_generator.py',
+    'optimized_manim_generator.py',
+    'qwen_video_*.py',
+]
+
+
+class TexSvgCache:
+    """Directory of <tex hash>.svg files shared between processes"""
+
+    def __init__(self, cache_dir=TEX_CACHE_DIR, max_bytes=TEX_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path_for(self, key):
+        return self.cache_dir / f'{key}.svg'
+
+    def get(self, key):
+        """Cached SVG for key (refreshing its recency) or None"""
+        path = self.path_for(key)
+        try:
+            os.utime(path, None)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def record_lookups(self, hits=0, misses=0):
+        """Count lookups another process made against this directory"""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def record_render(self, result):
+        """Count the tex lookups a worker render reported in its result"""
+        self.record_lookups(*result.get('cache_lookups', {}).get('tex', (0, 0)))
+
+    def record_output(self, output):
+        """Count the tex lookups a CLI render printed on exit"""
+        for hits, misses in LOOKUPS_RE.findall(output or ''):
+            self.record_lookups(int(hits), int(misses))
+
+    def report_lookups(self):
+        print(LOOKUPS_LINE.format(hits=self.hits, misses=self.misses), flush=True)
+
+    def put(self, key, svg_path):
+        """Publish a freshly compiled SVG and evict down to the size budget"""
+        path = self.path_for(key)
+        link_or_copy(svg_path, path)
+        self.evict(keep=path)
+        return path
+
+    def _scan(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith('.svg'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, Path(entry.path)))
+        return entries
+
+    def evict(self, keep=None):
+        """Drop least recently used SVGs until the directory fits max_bytes"""
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                continue  # Another process evicted it first
+            total -= size
+            with self._lock:
+                self.evictions += 1
+        return total
+
+    def stats(self):
+        entries = self._scan()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'updated_at': time.time(),
+            }
+
+
+def install_manim_hook(cache, tex_dir=None):
+    """Route Manim's tex_to_svg_file through cache inside a Manim process.
+
+    tex_dir gives the process a private working directory for latex; it
+    defaults to a fresh temporary directory. A process that already has a
+    cache hook (a persistent worker running a CLI-ready script) keeps it.
+    Returns whether the hook was installed.
+    """
+    from manim import config
+    from manim.mobject.text import tex_mobject
+    from manim.utils import tex_file_writing
+
+    original = tex_file_writing.tex_to_svg_file
+    if getattr(original, '_tex_cache', None) is not None:
+        return False
+    config.tex_dir = str(tex_dir or tempfile.mkdtemp(prefix='manim-tex-'))
+
+    def cached_tex_to_svg_file(expression, environment=None, tex_template=None):
+        try:
+            template = tex_template if tex_template is not None else config.tex_template
+            tex_file = tex_file_writing.generate_tex_file(expression, environment, template)
+        except Exception:
+            return original(expression, environment, tex_template)
+
+        svg_file = tex_file.with_suffix('.svg')
+        cached = None if svg_file.exists() else cache.get(tex_file.stem)
+        if cached is not None:
+            try:
+                link_or_copy(cached, svg_file)
+                return svg_file
+            except OSError:
+                pass  # Evicted between lookup and link - compile it
+
+        svg_file = Path(original(expression, environment, tex_template))
+        try:
+            cache.put(svg_file.stem, svg_file)
+        except OSError as e:
+            print(f"⚠️ Could not store {svg_file.name} in tex cache: {e}")
+        return svg_file
+
+    cached_tex_to_svg_file._tex_cache = cache
+    for module in (tex_file_writing, tex_mobject):
+        if getattr(module, 'tex_to_svg_file', None) is original:
+            module.tex_to_svg_file = cached_tex_to_svg_file
+    return True
+
+
+def enable_in_script(script_content, import_path=BASE_DIR):
+    """script_content with a trailer routing its LaTeX through the shared cache.
+
+    import_path is this directory as the rendering interpreter sees it (a
+    Windows path for the PowerShell renderer).
+    """
+    return script_content.rstrip('\n') + '\n' + SCRIPT_TRAILER.format(import_path=str(import_path))
+
+
+def harvest_formulas(paths):
+    """(class, args) for every MathTex/Tex built from string literals in paths.
+
+    Finds direct calls in scene scripts as well as calls embedded in the
+    script templates the servers generate; template formulas with
+    placeholders are skipped since they only exist at request time.
+    """
+    formulas = set()
+    for path in paths:
+        try:
+            tree = ast.parse(Path(path).read_text(encoding='utf-8'))
+        except (OSError, SyntaxError, UnicodeDecodeError, ValueError):
+            continue
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in TEX_CLASSES:
+                args = [arg.value for arg in node.args if isinstance(arg, ast.Constant) and isinstance(arg.value, str)]
+                if args and len(args) == len(node.args):
+                    formulas.add((node.func.id, tuple(args)))
+            elif isinstance(node, ast.Constant) and isinstance(node.value, str) and 'Tex(' in node.value:
+                for match in EMBEDDED_TEX_RE.finditer(node.value):
+                    try:
+                        formulas.add((match.group(1), (ast.literal_eval(match.group(2)),)))
+                    except (ValueError, SyntaxError):
+                        pass
+    return sorted(formulas)
+
+
+def warm(paths, cache=None, dry_run=False):
+    """Compile every harvested formula through the shared cache"""
+    formulas = harvest_formulas(paths)
+    print(f"🧮 {len(formulas)} distinct formulas found in {len(paths)} files")
+    if dry_run:
+        for cls_name, args in formulas:
+            print(f"   {cls_name}{args}")
+        return {'formulas': len(formulas)}
+
+    import manim
+
+    cache = cache or TexSvgCache()
+    install_manim_hook(cache)
+    before = cache.stats()
+    failed = 0
+    started = time.time()
+    for cls_name, args in formulas:
+        try:
+            getattr(manim, cls_name)(*args)
+        except Exception as e:
+            failed += 1
+            print(f"❌ {cls_name}{args}: {type(e).__name__}: {str(e)[:120]}")
+    after = cache.stats()
+    report = {
+        'formulas': len(formulas),
+        'already_cached': after['hits'] - before['hits'],
+        'compiled': after['misses'] - before['misses'] - failed,
+        'failed': failed,
+        'entries': after['entries'],
+        'bytes': after['bytes'],
+        'seconds': round(time.time() - started, 1),
+    }
+    print(f"✅ Tex cache warm: {report}")
+    return report
+
+
+def _expand(patterns):
+    paths = []
+    for pattern in patterns:
+        matches = sorted(BASE_DIR.glob(pattern)) if not Path(pattern).is_absolute() else [Path(pattern)]
+        paths.extend(path for path in matches if path.is_file())
+    return paths
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    command = args.pop(0) if args else 'stats'
+    if command == 'warm':
+        dry_run = '--dry-run' in args
+        patterns = [arg for arg in args if arg != '--dry-run'] or DEFAULT_WARM_SOURCES
+        warm(_expand(patterns), dry_run=dry_run)
+    elif command == 'stats':
+        print(TexSvgCache().stats())
+    else:
+        print(__doc__)
+        sys.exit(2)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Upstream HTTPS Client
+Keep-alive connection pool for the API upstreams the proxy servers call
+(dashscope). Building a new SSL context and urllib opener per call paid a
+TCP + TLS handshake every time, and socket.setdefaulttimeout() changed the
+timeout of every socket in the process.
+
+  - connections are reused while the upstream keeps them open (up to
+    maxsize idle ones, dropped after idle_timeout seconds)
+  - every request has its own timeout, applied to its socket only
+  - a request that fails on a reused connection the upstream had already
+    closed is retried once on a fresh one
+  - HTTPS_PROXY / HTTP_PROXY are honoured with a CONNECT tunnel
+
+Metrics (render_metrics, GET /metrics):
+  videotutor_upstream_connections_total    connections opened (= TLS handshakes)
+  videotutor_upstream_requests_total       requests by connection=new|reused
+  videotutor_upstream_idle_connections     pooled connections ready for reuse
+
+Usage:
+    pool = HTTPSConnectionPool('dashscope.aliyuncs.com', ssl_context=context)
+    status, headers, body = pool.request('POST', path, body, headers, timeout=30)
+"""
+
+import http.client
+import os
+import ssl
+import threading
+import time
+import urllib.parse
+from base64 import b64encode
+
+from render_metrics import Counter, Gauge
+
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 8))
+UPSTREAM_IDLE_TIMEOUT = float(os.environ.get('UPSTREAM_IDLE_TIMEOUT', 60))
+
+CONNECTIONS = Counter('videotutor_upstream_connections_total',
+                      'Upstream HTTPS connections opened (TCP + TLS handshakes)', ['host'])
+REQUESTS = Counter('videotutor_upstream_requests_total',
+                   'Upstream requests by whether they reused a pooled connection', ['host', 'connection'])
+IDLE_CONNECTIONS = Gauge('videotutor_upstream_idle_connections',
+                         'Pooled upstream connections ready for reuse', ['host'])
+
+# Errors meaning a reused keep-alive connection had been closed by the upstream
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                           ConnectionResetError, BrokenPipeError, ConnectionAbortedError, ssl.SSLEOFError)
+
+
+class UpstreamHTTPError(Exception):
+    """The upstream answered with a non-2xx status"""
+
+    def __init__(self, status, reason, body=b''):
+        super().__init__(f'HTTP {status} {reason}')
+        self.status = status
+        self.reason = reason
+        self.body = body
+
+
+def proxy_from_environment():
+    """HTTPS_PROXY / HTTP_PROXY URL, or None"""
+    return os.environ.get('HTTPS_PROXY') or os.environ.get('HTTP_PROXY') or None
+
+
+class HTTPSConnectionPool:
+    """Thread-safe pool of keep-alive HTTPS connections to one host"""
+
+    def __init__(self, host, port=443, ssl_context=None, proxy=None, maxsize=UPSTREAM_POOL_SIZE,
+                 idle_timeout=UPSTREAM_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self.proxy = urllib.parse.urlsplit(proxy) if proxy else None
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self._idle = []  # [(connection, returned_at)], most recently used last
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+        self.requests = 0
+        self.reused = 0
+        self.stale_retries = 0
+        IDLE_CONNECTIONS.add_source(lambda: {(self.host,): len(self._idle)})
+
+    def _connect(self, timeout):
+        if self.proxy:
+            conn = http.client.HTTPSConnection(self.proxy.hostname, self.proxy.port or 8080,
+                                               timeout=timeout, context=self.ssl_context)
+            tunnel_headers = {}
+            if self.proxy.username:
+                credentials = f'{urllib.parse.unquote(self.proxy.username)}:' \
+                              f'{urllib.parse.unquote(self.proxy.password or "")}'
+                tunnel_headers['Proxy-Authorization'] = 'Basic ' + b64encode(credentials.encode()).decode()
+            conn.set_tunnel(self.host, self.port, headers=tunnel_headers)
+        else:
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=timeout, context=self.ssl_context)
+        conn.connect()
+        with self._lock:
+            self.connections_opened += 1
+        CONNECTIONS.inc(host=self.host)
+        return conn
+
+    def _checkout(self, timeout):
+        """(connection, reused) - an idle pooled connection when one is still fresh"""
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                conn, returned_at = self._idle.pop()
+                if now - returned_at < self.idle_timeout and conn.sock is not None:
+                    conn.timeout = timeout
+                    conn.sock.settimeout(timeout)
+                    return conn, True
+                conn.close()
+        return self._connect(timeout), False
+
+    def _checkin(self, conn):
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def request(self, method, path, body=None, headers=None, timeout=30):
+        """Send one request; returns (status, headers, body bytes).
+
+        Raises UpstreamHTTPError for non-2xx answers and the socket/SSL error
+        (socket.timeout, ssl.SSLError, OSError) when the upstream can't be
+        reached in time.
+        """
+        for attempt in range(2):
+            conn, reused = self._checkout(timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                if reused and attempt == 0:
+                    with self._lock:
+                        self.stale_retries += 1
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            with self._lock:
+                self.requests += 1
+                self.reused += reused
+            REQUESTS.inc(host=self.host, connection='reused' if reused else 'new')
+            if response.will_close:
+                conn.close()
+            else:
+                self._checkin(conn)
+            if not 200 <= response.status < 300:
+                raise UpstreamHTTPError(response.status, response.reason, data)
+            return response.status, dict(response.getheaders()), data
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'host': self.host,
+                'connections_opened': self.connections_opened,
+                'requests': self.requests,
+                'reused': self.reused,
+                'reuse_ratio': round(self.reused / self.requests, 4) if self.requests else None,
+                'stale_retries': self.stale_retries,
+                'idle': len(self._idle),
+            }
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Upstream Health Monitor
+Circuit breaker for an API upstream (dashscope), fed by the outcomes of real
+requests and by probes from a background thread. Request handlers only read
+the breaker to pick the live path or the fallback; they no longer probe the
+network themselves before every call.
+
+  closed     requests go to the upstream
+  open       tripped by UPSTREAM_BREAKER_FAILURES consecutive failures, or by
+             an error rate of UPSTREAM_BREAKER_ERROR_RATE over the last
+             UPSTREAM_BREAKER_WINDOW seconds (with enough samples); requests
+             take the fallback
+  half_open  UPSTREAM_BREAKER_COOLDOWN seconds after opening: one trial (a
+             request or a probe) goes through; success closes the breaker,
+             failure re-opens it
+
+The monitor probes every UPSTREAM_PROBE_INTERVAL seconds, but only when no
+outcome has been recorded in that time or the breaker isn't closed, so a busy
+server isn't probing an upstream it is already talking to.
+
+Only upstream trouble counts as a failure: connection errors, timeouts, 5xx
+and 429. A 4xx (a bad API key, a malformed request) means the upstream is up.
+
+Metrics (render_metrics, GET /metrics):
+  videotutor_upstream_breaker_state        0 closed, 1 half_open, 2 open
+  videotutor_upstream_breaker_transitions_total{upstream,state}
+  videotutor_upstream_outcomes_total{upstream,source,outcome}
+
+Usage:
+    breaker = CircuitBreaker('dashscope')
+    UpstreamHealthMonitor(breaker, probe=pool_probe(pool)).start()
+
+    if breaker.allow_request():
+        try:
+            pool.request(...)
+            breaker.record_success()
+        except Exception as e:
+            breaker.record_exception(e)
+"""
+
+import collections
+import os
+import threading
+import time
+
+from render_metrics import Counter, Gauge
+from upstream_client import UpstreamHTTPError
+
+UPSTREAM_BREAKER_FAILURES = int(os.environ.get('UPSTREAM_BREAKER_FAILURES', 3))
+UPSTREAM_BREAKER_ERROR_RATE = float(os.environ.get('UPSTREAM_BREAKER_ERROR_RATE', 0.5))
+UPSTREAM_BREAKER_MIN_SAMPLES = int(os.environ.get('UPSTREAM_BREAKER_MIN_SAMPLES', 5))
+UPSTREAM_BREAKER_WINDOW = float(os.environ.get('UPSTREAM_BREAKER_WINDOW', 60))
+UPSTREAM_BREAKER_COOLDOWN = float(os.environ.get('UPSTREAM_BREAKER_COOLDOWN', 30))
+UPSTREAM_PROBE_INTERVAL = float(os.environ.get('UPSTREAM_PROBE_INTERVAL', 30))
+UPSTREAM_PROBE_TIMEOUT = float(os.environ.get('UPSTREAM_PROBE_TIMEOUT', 5))
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = Gauge('videotutor_upstream_breaker_state',
+                      'Upstream circuit breaker state (0 closed, 1 half_open, 2 open)', ['upstream'])
+TRANSITIONS = Counter('videotutor_upstream_breaker_transitions_total',
+                      'Upstream circuit breaker state changes', ['upstream', 'state'])
+OUTCOMES = Counter('videotutor_upstream_outcomes_total',
+                   'Upstream call outcomes seen by the breaker', ['upstream', 'source', 'outcome'])
+
+
+def is_upstream_failure(error):
+    """Whether an exception from an upstream call says the upstream is unhealthy"""
+    if isinstance(error, UpstreamHTTPError):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, OSError)  # socket.timeout, ssl.SSLError, connection errors
+
+
+class CircuitBreaker:
+    """closed / open / half_open state of one upstream"""
+
+    def __init__(self, name, failure_threshold=UPSTREAM_BREAKER_FAILURES, error_rate=UPSTREAM_BREAKER_ERROR_RATE,
+                 min_samples=UPSTREAM_BREAKER_MIN_SAMPLES, window=UPSTREAM_BREAKER_WINDOW,
+                 cooldown=UPSTREAM_BREAKER_COOLDOWN, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.error_rate = error_rate
+        self.min_samples = min_samples
+        self.window = window
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = None
+        self._trial_started = None  # When the half-open trial was handed out
+        self._consecutive_failures = 0
+        self._outcomes = collections.deque()  # (time, ok) within the window
+        self.last_outcome_at = None
+        self.last_error = None
+        BREAKER_STATE.add_source(lambda: {(self.name,): STATE_VALUES[self.state]})
+
+    def _set_state(self, state):
+        if state != self._state:
+            self._state = state
+            TRANSITIONS.inc(upstream=self.name, state=state)
+            print(f"🔌 Upstream {self.name} circuit {state}")
+
+    def _current_state(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.cooldown:
+            self._set_state(HALF_OPEN)
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(self._clock())
+
+    def allow_request(self):
+        """True when a call should go to the upstream. In half_open only one
+        trial is let through at a time (a lost trial expires after cooldown)."""
+        now = self._clock()
+        with self._lock:
+            state = self._current_state(now)
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and (self._trial_started is None or now - self._trial_started >= self.cooldown):
+                self._trial_started = now
+                return True
+            return False
+
+    def _record(self, ok, source, error=None):
+        now = self._clock()
+        OUTCOMES.inc(upstream=self.name, source=source, outcome='success' if ok else 'failure')
+        with self._lock:
+            self.last_outcome_at = now
+            self._outcomes.append((now, ok))
+            while self._outcomes and now - self._outcomes[0][0] > self.window:
+                self._outcomes.popleft()
+            state = self._current_state(now)
+            if ok:
+                self._consecutive_failures = 0
+                if state == HALF_OPEN:
+                    self._outcomes.clear()  # Start the error rate over once recovered
+                    self._trial_started = None
+                    self._set_state(CLOSED)
+                return
+            self.last_error = error
+            self._consecutive_failures += 1
+            if state == HALF_OPEN or (state == CLOSED and self._should_trip()):
+                self._trial_started = None
+                self._opened_at = now
+                self._set_state(OPEN)
+
+    def _should_trip(self):
+        if self._consecutive_failures >= self.failure_threshold:
+            return True
+        if len(self._outcomes) < self.min_samples:
+            return False
+        failures = sum(1 for _, ok in self._outcomes if not ok)
+        return failures / len(self._outcomes) >= self.error_rate
+
+    def record_success(self, source='traffic'):
+        self._record(True, source)
+
+    def record_failure(self, error=None, source='traffic'):
+        self._record(False, source, f'{type(error).__name__}: {error}' if error else None)
+
+    def record_exception(self, error, source='traffic'):
+        """Record an exception from an upstream call; client-side (4xx) errors count as reachable"""
+        if is_upstream_failure(error):
+            self.record_failure(error, source)
+        else:
+            self.record_success(source)
+
+    def snapshot(self):
+        now = self._clock()
+        with self._lock:
+            state = self._current_state(now)
+            samples = len(self._outcomes)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            return {
+                'upstream': self.name,
+                'state': state,
+                'consecutive_failures': self._consecutive_failures,
+                'window_samples': samples,
+                'window_error_rate': round(failures / samples, 4) if samples else None,
+                'seconds_since_outcome': round(now - self.last_outcome_at, 1) if self.last_outcome_at else None,
+                'retry_in': round(max(0.0, self.cooldown - (now - self._opened_at)), 1) if state == OPEN else None,
+                'last_error': self.last_error,
+            }
+
+
+def pool_probe(pool, path='/', timeout=UPSTREAM_PROBE_TIMEOUT):
+    """Probe that sends a cheap request over an HTTPSConnectionPool (keeping a
+    connection warm); raises what the pool raises"""
+    def probe():
+        try:
+            pool.request('HEAD', path, timeout=timeout)
+        except UpstreamHTTPError as e:
+            if is_upstream_failure(e):
+                raise
+    return probe
+
+
+class UpstreamHealthMonitor:
+    """Daemon thread probing the upstream when real traffic says nothing about it"""
+
+    def __init__(self, breaker, probe, interval=UPSTREAM_PROBE_INTERVAL):
+        self.breaker = breaker
+        self.probe = probe
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """Probe once if due; returns True/False for the probe result, None when skipped"""
+        last = self.breaker.last_outcome_at
+        recent_traffic = last is not None and self.breaker._clock() - last < self.interval
+        if self.breaker.state == CLOSED and recent_traffic:
+            return None
+        if not self.breaker.allow_request():  # Open and still cooling down
+            return None
+        try:
+            self.probe()
+        except Exception as e:
+            self.breaker.record_exception(e, source='probe')
+            return not is_upstream_failure(e)
+        self.breaker.record_success(source='probe')
+        return True
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._stop.clear()
+
+        def run():
+            while True:
+                try:
+                    self.check()
+                except Exception as e:
+                    print(f"⚠️ Upstream probe failed: {e}")
+                if self._stop.wait(self.interval):
+                    return
+
+        self._thread = threading.Thread(target=run, name=f'upstream-health-{self.breaker.name}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
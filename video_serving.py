@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Video Serving
+Static file responses for rendered videos on the http.server based servers:
+single byte ranges (Range / If-Range -> 206, 416), ETag / If-None-Match
+revalidation (304), and zero-copy bodies through socket.sendfile (which uses
+os.sendfile where the platform has it).
+
+The ETag is a digest of the file's bytes, so it survives hardlinking,
+dedupe relinks and mtime changes, and only changes when the video does.
+Videos are hashed when they are published (remember_digest, called by the
+media pipeline and the render cache); a file served before it was hashed
+gets an inode/size/mtime ETag while it is hashed in the background, so no
+response waits for a read of the whole file.
+Render cache entries (named by their full sha256 key) never change and are
+cached by browsers for a year; published names are chosen by callers and
+can be re-rendered, so they are revalidated, which costs a 304 instead of a
+full download.
+"""
+
+import email.utils
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import urllib.parse
+from collections import OrderedDict
+from pathlib import Path
+
+# RenderCache entries are <sha256 of script + flags>.mp4
+CONTENT_ADDRESSED_RE = re.compile(r'[0-9a-f]{64}')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+DIGEST_CACHE_SIZE = 4096
+
+_digests = OrderedDict()  # (device, inode, size, mtime_ns) -> sha256 hex
+_hashing = set()  # Identities being hashed in the background
+_digests_lock = threading.Lock()
+
+
+def _identity(stat):
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _known_digest(identity):
+    with _digests_lock:
+        if identity in _digests:
+            _digests.move_to_end(identity)
+            return _digests[identity]
+    return None
+
+
+def content_digest(path):
+    """sha256 of the file's bytes, hashed once per (inode, size, mtime)"""
+    with open(path, 'rb') as f:
+        identity = _identity(os.fstat(f.fileno()))
+        known = _known_digest(identity)
+        if known is not None:
+            return known
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    with _digests_lock:
+        _digests[identity] = digest.hexdigest()
+        while len(_digests) > DIGEST_CACHE_SIZE:
+            _digests.popitem(last=False)
+    return digest.hexdigest()
+
+
+def remember_digest(path):
+    """Hash a video as it is published, so its first response already carries the content ETag"""
+    try:
+        return content_digest(path)
+    except OSError as e:
+        print(f"⚠️ Could not hash {Path(path).name} for its ETag: {e}")
+        return None
+
+
+def _hash_in_background(path, identity):
+    with _digests_lock:
+        if identity in _hashing:
+            return
+        _hashing.add(identity)
+
+    def run():
+        try:
+            content_digest(path)
+        except OSError:
+            pass  # Replaced or removed meanwhile - the next request tries again
+        finally:
+            with _digests_lock:
+                _hashing.discard(identity)
+    threading.Thread(target=run, name='etag-digest', daemon=True).start()
+
+
+def file_etag(path, stat=None):
+    """Strong validator: the content digest once the file is hashed, else
+    one from its inode, size and mtime (hashing it in the background)"""
+    stat = stat or os.stat(path)
+    identity = _identity(stat)
+    digest = _known_digest(identity)
+    if digest is None:
+        _hash_in_background(path, identity)
+        return identity_etag(stat)
+    return f'"{digest[:32]}"'
+
+
+def identity_etag(stat):
+    """The ETag a file gets before it is hashed; still valid for as long as the file is unchanged"""
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def cache_max_age(filename):
+    """Seconds a client may reuse filename without revalidating"""
+    return IMMUTABLE_MAX_AGE if CONTENT_ADDRESSED_RE.fullmatch(Path(filename).stem.lower()) else 0
+
+
+def cache_control(filename):
+    max_age = cache_max_age(filename)
+    return f'public, max-age={max_age}, immutable' if max_age else 'no-cache'
+
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single 'bytes=' range, None to send the whole file.
+
+    Raises ValueError when the range can't be satisfied (416). Multiple
+    ranges and malformed headers are ignored, which RFC 9110 allows.
+    """
+    match = RANGE_RE.match((header or '').strip())
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if length == 0:
+            raise ValueError('empty suffix range')
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError('range not satisfiable')
+    return start, end
+
+
+def _etag_matches(header, validators):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') in validators for tag in header.split(','))
+
+
+def serve_file(handler, path, head=False):
+    """Answer handler's GET/HEAD with the file at path; returns the status sent"""
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        handler.send_response(404)
+        handler.send_header('Access-Control-Allow-Origin', '*')
+        handler.send_header('Content-Length', '0')
+        handler.end_headers()
+        return 404
+
+    with f:
+        stat = os.fstat(f.fileno())
+        size = stat.st_size
+        etag = file_etag(path, stat)
+        # A client may still hold the identity ETag served before the file was hashed
+        validators = {etag, identity_etag(stat)}
+        name = Path(path).name
+
+        def common_headers():
+            handler.send_header('ETag', etag)
+            handler.send_header('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True))
+            handler.send_header('Cache-Control', cache_control(name))
+            handler.send_header('Accept-Ranges', 'bytes')
+            handler.send_header('Access-Control-Allow-Origin', '*')
+            handler.send_header('Access-Control-Expose-Headers', 'Content-Range, Content-Length, Accept-Ranges, ETag')
+
+        if _etag_matches(handler.headers.get('If-None-Match'), validators):
+            handler.send_response(304)
+            common_headers()
+            handler.end_headers()
+            return 304
+
+        byte_range = None
+        if_range = handler.headers.get('If-Range')
+        if if_range is None or if_range.strip() in validators:
+            try:
+                byte_range = parse_range(handler.headers.get('Range'), size)
+            except ValueError:
+                handler.send_response(416)
+                common_headers()
+                handler.send_header('Content-Range', f'bytes */{size}')
+                handler.send_header('Content-Length', '0')
+                handler.end_headers()
+                return 416
+
+        start, end = byte_range or (0, size - 1)
+        status = 206 if byte_range else 200
+        handler.send_response(status)
+        handler.send_header('Content-Type', mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        handler.send_header('Content-Length', str(end - start + 1))
+        if byte_range:
+            handler.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        common_headers()
+        handler.end_headers()
+        if head or end < start:
+            return status
+        try:
+            handler.wfile.flush()
+            handler.connection.sendfile(f, offset=start, count=end - start + 1)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Players drop the connection as soon as the user seeks elsewhere
+        return status
+
+
+def serve_from_directory(handler, root, url_path, head=False):
+    """Serve url_path (already stripped of its route prefix) from inside root"""
+    relative = urllib.parse.unquote(urllib.parse.urlsplit(url_path).path).lstrip('/')
+    root = Path(root).resolve()
+    path = (root / relative).resolve()
+    if root not in path.parents:
+        path = root / '.missing'  # Path traversal - answer 404
+    return serve_file(handler, path, head=head)
@@ -7,12 +7,150 @@ This server creates actual math animations based on AI-provided solutions
 import json
 import os
 import tempfile
+import threading
 import time
 import http.server
 import socketserver
 import subprocess
 from pathlib import Path
 
+import process_tree
+import render_metrics
+import render_profiles
+from manim_workers import get_worker_pool, render_scene
+from media_pipeline import publish_faststart
+from render_cache import link_or_copy
+from storage_manager import get_storage_manager
+
+# Pre-rendered videos in rendered_videos/ served when generation fails
+FALLBACK_VIDEOS = {
+    'triangle': 'math_triangle_area_test_1752071810.mp4',
+    'equation': 'algebra_equation_test_1752071894.mp4',
+}
+# Names of real math videos listed by /health
+TUTORIAL_VIDEO_KEYWORDS = ('triangle', 'algebra', 'equation')
+# The waterfall scene is one fixed module (waterfall_scene.py); each request
+# only writes the lesson JSON it reads from WATERFALL_SCENE_DATA
+WATERFALL_SCENE = Path(__file__).parent.absolute() / 'waterfall_scene.py'
+WATERFALL_SCENE_NAME = 'WaterfallTutorialScene'
+WATERFALL_SCENE_DATA_ENV = 'WATERFALL_SCENE_DATA'
+# How often the Manim probe and the video index are refreshed in the background
+SNAPSHOT_REFRESH_SECONDS = float(os.environ.get('WATERFALL_SNAPSHOT_REFRESH', 300))
+
+
+class ManimCapability:
+    """Whether Manim can be imported here, probed off the request path.
+
+    The probe starts an interpreter (up to timeout seconds), so requests and
+    health checks read the last result instead of probing themselves.
+    """
+
+    def __init__(self, python_cmd='python', timeout=5):
+        self.python_cmd = python_cmd
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._snapshot = {'available': False, 'version': None, 'error': 'not probed yet', 'checked_at': None}
+
+    def probe(self):
+        try:
+            result = subprocess.run(
+                [self.python_cmd, '-c', 'import manim; print(manim.__version__)'],
+                capture_output=True, text=True, timeout=self.timeout
+            )
+        except (OSError, subprocess.TimeoutExpired) as e:
+            return {'available': False, 'version': None, 'error': str(e)}
+        if result.returncode != 0:
+            return {'available': False, 'version': None, 'error': result.stderr.strip()[-200:]}
+        return {'available': True, 'version': result.stdout.strip(), 'error': None}
+
+    def refresh(self):
+        snapshot = {**self.probe(), 'checked_at': time.time()}
+        with self._lock:
+            self._snapshot = snapshot
+        return snapshot
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = dict(self._snapshot)
+        if snapshot['checked_at'] is None:
+            snapshot = self.refresh()  # First use before the background probe ran
+        return snapshot
+
+    @property
+    def available(self):
+        return self.snapshot()['available']
+
+
+class VideoIndex:
+    """rendered_videos/*.mp4 tutorials, kept up to date as videos are published
+    instead of globbing the directory on every health check"""
+
+    def __init__(self, directory, keywords=TUTORIAL_VIDEO_KEYWORDS):
+        self.directory = Path(directory)
+        self.keywords = keywords
+        self._lock = threading.Lock()
+        self._videos = {}
+        self.scanned_at = None
+
+    def _entry(self, path):
+        path = Path(path)
+        if path.suffix != '.mp4' or not any(keyword in path.name for keyword in self.keywords):
+            return None
+        try:
+            return {'name': path.name, 'path': str(self.directory / path.name), 'size': path.stat().st_size}
+        except OSError:
+            return None
+
+    def rescan(self):
+        """Rebuild from the directory (picks up deletions by the storage manager)"""
+        videos = {}
+        if self.directory.exists():
+            for path in self.directory.glob('*.mp4'):
+                entry = self._entry(path)
+                if entry:
+                    videos[entry['name']] = entry
+        with self._lock:
+            self._videos = videos
+            self.scanned_at = time.time()
+
+    def add(self, path):
+        """Record a video that was just published"""
+        entry = self._entry(path)
+        if entry:
+            with self._lock:
+                self._videos[entry['name']] = entry
+
+    def videos(self):
+        if self.scanned_at is None:
+            self.rescan()
+        with self._lock:
+            return sorted(self._videos.values(), key=lambda entry: entry['name'])
+
+
+MANIM_CAPABILITY = ManimCapability()
+VIDEO_INDEX = VideoIndex('rendered_videos')
+
+
+def refresh_snapshot():
+    MANIM_CAPABILITY.refresh()
+    VIDEO_INDEX.rescan()
+
+
+def start_snapshot_refresh(interval=SNAPSHOT_REFRESH_SECONDS):
+    """Probe Manim and index the videos now, then keep both fresh from a daemon thread"""
+    refresh_snapshot()
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                refresh_snapshot()
+            except Exception as e:
+                print(f"⚠️ Snapshot refresh failed: {e}")
+
+    threading.Thread(target=run, name='waterfall-snapshot', daemon=True).start()
+
+
 class WaterfallManimServer(http.server.SimpleHTTPRequestHandler):
     def do_POST(self):
         if self.path == '/render':
@@ -23,16 +161,17 @@ class WaterfallManimServer(http.server.SimpleHTTPRequestHandler):
                 data = json.loads(post_data.decode('utf-8'))
                 question = data.get('question', '')
                 solution = data.get('solution', '')
-                script = data.get('script', '')
                 output_name = data.get('output_name', f'waterfall_math_{int(time.time())}')
+                profile = render_profiles.resolve(data.get('profile'))
                 
-                # Generate waterfall Manim script based on question and solution
-                manim_script = self.generate_waterfall_script(question, solution, script)
+                # Lesson contents and narration for the waterfall scene
+                with render_metrics.stage('script_generation'):
+                    scene_data = self.generate_waterfall_data(question, solution)
                 
-                # Create temporary script file
-                with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-                    f.write(manim_script)
-                    script_path = f.name
+                with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False, encoding='utf-8') as f:
+                    json.dump(scene_data, f, ensure_ascii=False)
+                    data_path = f.name
+                scene_env = {WATERFALL_SCENE_DATA_ENV: data_path}
                 
                 try:
                     # Set up output directories
@@ -51,33 +190,50 @@ class WaterfallManimServer(http.server.SimpleHTTPRequestHandler):
                     if manim_available:
                         print(f"🎬 Creating waterfall math tutorial for: {question}")
                         
-                        # Run Manim to generate video
-                        cmd = [
-                            'python', '-m', 'manim',
-                            script_path,
-                            'GeneratedWaterfallScene',
-                            '-ql',
-                            '--output_file', output_name
-                        ]
-                        
-                        print(f"Running: {' '.join(cmd)}")
-                        result = subprocess.run(cmd, capture_output=True, text=True, cwd=os.getcwd())
+                        # Run Manim to generate video, on a pre-warmed worker when possible
+                        with render_metrics.in_flight(), render_metrics.stage('manim'):
+                            worker_result = render_scene(
+                                WATERFALL_SCENE, WATERFALL_SCENE_NAME,
+                                profile=profile, output_file=output_name, timeout=profile.timeout,
+                                environ=scene_env, keep_module=True
+                            )
+                            if worker_result is not None:
+                                returncode = 0 if worker_result['success'] else 1
+                                stderr = worker_result.get('stderr', '')
+                                video_path = worker_result.get('video_path')
+                            else:
+                                cmd = [
+                                    'python', '-m', 'manim',
+                                    str(WATERFALL_SCENE),
+                                    WATERFALL_SCENE_NAME,
+                                    *profile.cli_args(),
+                                    '--output_file', output_name
+                                ]
+                            
+                                print(f"Running: {' '.join(cmd)}")
+                                try:
+                                    result = process_tree.run(cmd, capture_output=True, text=True, cwd=os.getcwd(),
+                                                              timeout=profile.timeout, env={**os.environ, **scene_env})
+                                    returncode, stderr, video_path = result.returncode, result.stderr, None
+                                except subprocess.TimeoutExpired:
+                                    print(f"⏱️ Manim timed out after {profile.timeout}s")
+                                    returncode, stderr, video_path = 1, f'Rendering timeout ({profile.timeout}s)', None
                         
-                        if result.returncode == 0:
-                            # Find generated video
-                            video_path = None
-                            for root, dirs, files in os.walk('media/videos'):
-                                for file in files:
-                                    if file.endswith('.mp4') and output_name in file:
-                                        video_path = os.path.join(root, file)
+                        if returncode == 0:
+                            # Find generated video (workers report the exact path)
+                            if not video_path:
+                                for root, dirs, files in os.walk('media/videos'):
+                                    for file in files:
+                                        if file.endswith('.mp4') and output_name in file:
+                                            video_path = os.path.join(root, file)
+                                            break
+                                    if video_path:
                                         break
-                                if video_path:
-                                    break
                             
                             if video_path and os.path.exists(video_path):
-                                # Copy to rendered_videos
-                                import shutil
-                                shutil.copy2(video_path, final_video_path)
+                                # Publish to rendered_videos as a fast-start mp4
+                                publish_faststart(video_path, final_video_path)
+                                VIDEO_INDEX.add(final_video_path)
                                 
                                 response = {
                                     'success': True,
@@ -86,22 +242,27 @@ class WaterfallManimServer(http.server.SimpleHTTPRequestHandler):
                                     'duration': 30,
                                     'size': os.path.getsize(final_video_path),
                                     'type': 'waterfall_tutorial',
-                                    'question': question
+                                    'question': question,
+                                    'profile': profile.to_dict()
                                 }
                             else:
-                                response = self.create_fallback_video(question, output_name)
+                                render_metrics.record_failure('output not found')
+                                response = self.create_fallback_video(question, output_name, profile)
                         else:
-                            print(f"❌ Manim error: {result.stderr}")
-                            response = self.create_fallback_video(question, output_name)
+                            print(f"❌ Manim error: {stderr}")
+                            render_metrics.record_failure(stderr)
+                            response = self.create_fallback_video(question, output_name, profile)
                     else:
                         print("⚠️ Manim not available, creating enhanced fallback")
-                        response = self.create_fallback_video(question, output_name)
+                        render_metrics.record_failure('manim workers unavailable')
+                        response = self.create_fallback_video(question, output_name, profile)
                         
                 finally:
-                    # Clean up temporary file
-                    if os.path.exists(script_path):
-                        os.unlink(script_path)
+                    # Clean up the lesson data file
+                    if os.path.exists(data_path):
+                        os.unlink(data_path)
                 
+                render_metrics.record_request('success' if response.get('type') == 'waterfall_tutorial' else 'fallback')
                 self.send_response(200)
                 self.send_header('Content-type', 'application/json')
                 self.send_header('Access-Control-Allow-Origin', '*')
@@ -109,6 +270,8 @@ class WaterfallManimServer(http.server.SimpleHTTPRequestHandler):
                 self.wfile.write(json.dumps(response).encode())
                 
             except Exception as e:
+                render_metrics.record_request('failed')
+                render_metrics.record_failure(e)
                 self.send_response(500)
                 self.send_header('Content-type', 'application/json')
                 self.send_header('Access-Control-Allow-Origin', '*')
@@ -118,16 +281,12 @@ class WaterfallManimServer(http.server.SimpleHTTPRequestHandler):
                     'error': str(e)
                 }).encode())
     
-    def generate_waterfall_script(self, question, solution, script):
-        """Generate UniversalWaterfallScene script for real math tutorial"""
+    def generate_waterfall_data(self, question, solution):
+        """Contents and narration of the waterfall tutorial (read by waterfall_scene.py)"""
         
         # Parse solution to extract steps
         steps = self.extract_math_steps(solution)
         
-        # Generate detailed content for waterfall with TTS synchronization
-        contents = []
-        scripts_data = []
-        
         # Analyze question type for better content organization
         question_lower = str(question).lower()
         
@@ -144,105 +303,7 @@ class WaterfallManimServer(http.server.SimpleHTTPRequestHandler):
             contents_data = self.generate_generic_contents(question, steps)
             scripts_data = self.generate_generic_scripts(question, steps)
         
-        # Generate enhanced UniversalWaterfallScene script
-        import json
-        contents_json = repr(contents_data)
-        scripts_json = repr(scripts_data)
-        
-        template = f'''#!/usr/bin/env python3
-# -*- coding: utf-8 -*-
-from manim import *
-import json
-import sys
-import os
-
-# Add path for imports
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-
-class WaterfallTutorialScene(Scene):
-    def __init__(self, contents_data=None, scripts_data=None, **kwargs):
-        super().__init__(**kwargs)
-        self.dynamic_contents_data = contents_data or []
-        self.dynamic_scripts_data = scripts_data or []
-
-    def construct(self):
-        self.camera.background_color = BLACK
-        
-        # Layout configuration
-        total_height = 8.0
-        display_ratio = 0.85
-        script_ratio = 0.15
-        
-        display_area_height = total_height * display_ratio
-        script_area_height = total_height * script_ratio
-        
-        # Create content objects with waterfall effect
-        content_group = VGroup()
-        
-        for item_data in self.dynamic_contents_data:
-            item_type = item_data.get("type")
-            if item_type == "text":
-                text_obj = Text(
-                    item_data["value"], 
-                    font_size=item_data.get("font_size", 24),
-                    color=eval(item_data.get("color", "WHITE"))
-                )
-                content_group.add(text_obj)
-            elif item_type == "formula":
-                formula_obj = MathTex(
-                    item_data["value"], 
-                    color=eval(item_data.get("color", "WHITE"))
-                )
-                content_group.add(formula_obj)
-            elif item_type == "graphic":
-                # Create simple triangle graphic
-                if item_data.get("graphic_type") == "triangle":
-                    triangle = Triangle(color=BLUE, fill_opacity=0.3)
-                    triangle.scale(0.8)
-                    content_group.add(triangle)
-        
-        # Arrange with waterfall effect
-        if len(content_group) > 0:
-            content_group.arrange(DOWN, buff=0.5)
-            content_group.scale_to_fit_height(display_area_height * 0.8)
-            content_group.move_to(UP * script_area_height)
-            
-            # Create waterfall animation (staggered appearance)
-            for item in content_group:
-                self.play(Write(item), run_time=1.5)
-                self.wait(0.5)
-        
-        # Add script area at bottom with current step
-        if self.dynamic_scripts_data:
-            for i, script_text in enumerate(self.dynamic_scripts_data):
-                if i < 3:  # Show first 3 steps in script area
-                    script_display = Text(
-                        script_text,
-                        font_size=16,
-                        color=GRAY
-                    )
-                    script_display.to_edge(DOWN)
-                    script_display.shift(UP * i * 0.3)
-                    self.add(script_display)
-                    
-                    if i == 0:  # Keep first script visible longer
-                        self.wait(2)
-
-class GeneratedWaterfallScene(WaterfallTutorialScene):
-    def __init__(self, **kwargs):
-        contents_data = {contents_json}
-        scripts_data = {scripts_json}
-        super().__init__(contents_data=contents_data, scripts_data=scripts_data, **kwargs)
-
-# Configure Manim
-config.frame_rate = 30
-config.pixel_height = 1080
-config.pixel_width = 1920
-config.background_color = BLACK
-config.output_file = "waterfall_tutorial"
-'''
-
-        return template.format(contents_json=contents_json, scripts_json=scripts_json)
+        return {'contents': contents_data, 'scripts': scripts_data}
     
     def extract_math_steps(self, solution):
         """Extract clear steps from AI solution"""
@@ -268,26 +329,28 @@ config.output_file = "waterfall_tutorial"
         
         return steps[:6]  # Limit to 6 steps for waterfall
     
-    def create_fallback_video(self, question, output_name):
-        """Create enhanced fallback using real math content"""
+    def create_fallback_video(self, question, output_name, profile):
+        """Create enhanced fallback using real math content (tagged with the requested profile)"""
+        render_metrics.record_fallback('fallback_video')
         rendered_videos_dir = Path('rendered_videos')
         
         # Map question types to real videos
         question_lower = str(question).lower()
         
         if any(word in question_lower for word in ['三角形', '面积', 'triangle']):
-            video_file = 'math_triangle_area_test_1752071810.mp4'
+            video_file = FALLBACK_VIDEOS['triangle']
         elif any(word in question_lower for word in ['代数', '方程', 'equation']):
-            video_file = 'algebra_equation_test_1752071894.mp4'
+            video_file = FALLBACK_VIDEOS['equation']
         else:
-            video_file = 'math_triangle_area_test_1752071810.mp4'
+            video_file = FALLBACK_VIDEOS['triangle']
         
         source_path = rendered_videos_dir / video_file
         target_path = rendered_videos_dir / f'{output_name}.mp4'
         
         if source_path.exists():
-            import shutil
-            shutil.copy2(str(source_path), str(target_path))
+            # Alias the canned video (hardlink) instead of copying it per fallback
+            link_or_copy(source_path, target_path)
+            VIDEO_INDEX.add(target_path)
             
             return {
                 'success': True,
@@ -297,7 +360,8 @@ config.output_file = "waterfall_tutorial"
                 'size': source_path.stat().st_size,
                 'type': 'real_tutorial',
                 'question': question,
-                'fallback': True
+                'fallback': True,
+                'profile': profile.to_dict()
             }
         else:
             # Use test_final_universal as last resort
@@ -308,52 +372,40 @@ config.output_file = "waterfall_tutorial"
                 'duration': 20,
                 'size': 964051,
                 'type': 'enhanced_tutorial',
-                'question': question
+                'question': question,
+                'profile': profile.to_dict()
             }
     
     def check_manim_availability(self):
-        """Check if Manim is available"""
-        try:
-            import subprocess
-            result = subprocess.run(['python', '-c', 'import manim'], 
-                                  capture_output=True, text=True, timeout=5)
-            return result.returncode == 0
-        except:
-            return False
+        """Check if Manim is available (last background probe, no process started)"""
+        return MANIM_CAPABILITY.available
     
     def do_GET(self):
-        if self.path == '/health':
+        if self.path == '/metrics':
+            render_metrics.send_metrics(self)
+        elif self.path == '/health':
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
             
+            manim = MANIM_CAPABILITY.snapshot()
             health_data = {
                 'status': 'healthy',
                 'service': 'waterfall-manim-server',
                 'timestamp': time.time(),
-                'manim_available': self.check_manim_availability(),
-                'available_videos': self.list_available_videos()
+                'manim_available': manim['available'],
+                'manim': manim,
+                'available_videos': self.list_available_videos(),
+                'videos_indexed_at': VIDEO_INDEX.scanned_at
             }
             self.wfile.write(json.dumps(health_data).encode())
         else:
             super().do_GET()
     
     def list_available_videos(self):
-        """List available real math videos"""
-        rendered_videos_dir = Path('rendered_videos')
-        videos = []
-        
-        if rendered_videos_dir.exists():
-            for video_file in rendered_videos_dir.glob('*.mp4'):
-                if any(name in str(video_file) for name in ['triangle', 'algebra', 'equation']):
-                    videos.append({
-                        'name': video_file.name,
-                        'path': str(video_file),
-                        'size': video_file.stat().st_size
-                    })
-        
-        return videos
+        """List available real math videos (from the index, not a directory scan)"""
+        return VIDEO_INDEX.videos()
     
     def generate_triangle_area_contents(self, question, steps):
         """Generate triangle area tutorial contents"""
@@ -477,6 +529,14 @@ if __name__ == '__main__':
     Path('rendered_videos').mkdir(exist_ok=True)
     Path('media/videos').mkdir(parents=True, exist_ok=True)
     
+    # Pre-warm persistent Manim workers before accepting requests, and probe
+    # Manim / index the videos once so health checks answer from memory
+    get_worker_pool()
+    start_snapshot_refresh()
+    storage = get_storage_manager()
+    storage.add_references(lambda: [Path('rendered_videos', name).absolute() for name in FALLBACK_VIDEOS.values()])
+    storage.start()
+    
     with socketserver.TCPServer(("0.0.0.0", PORT), WaterfallManimServer) as httpd:
         print(f"🌊 Waterfall Manim Server starting on port {PORT}...")
         print(f"📡 Health check: http://localhost:{PORT}/health")
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Waterfall Tutorial Scene
+The waterfall math tutorial as one fixed, importable Manim scene. What a
+lesson shows comes from a JSON file, not from generated Python:
+
+    {
+      "contents": [
+        {"type": "text", "value": "...", "font_size": 28, "color": "YELLOW"},
+        {"type": "formula", "value": "A = \\\\frac{1}{2}bh", "color": "#FFCC00"},
+        {"type": "graphic", "graphic_type": "triangle"}
+      ],
+      "scripts": ["narration line", ...]
+    }
+
+Colors are Manim color constant names or hex strings, looked up in a table
+(never eval'd). The data file is named by the WATERFALL_SCENE_DATA
+environment variable, so the CLI and the persistent Manim workers render the
+same module for every request:
+
+    WATERFALL_SCENE_DATA=lesson.json manim -ql waterfall_scene.py WaterfallTutorialScene
+"""
+
+import json
+import os
+
+from manim import *
+from manim.utils import color as manim_colors
+
+SCENE_NAME = 'WaterfallTutorialScene'
+DATA_ENV = 'WATERFALL_SCENE_DATA'
+SCRIPT_PATH = os.path.abspath(__file__)
+
+# Manim's color constants (WHITE, BLUE, YELLOW, ...) by name
+COLORS = {name: value for name, value in vars(manim_colors).items() if name.isupper()}
+
+
+def resolve_color(name, default=WHITE):
+    """Color for a JSON color field: a constant name or a hex string"""
+    if isinstance(name, str) and name.startswith('#'):
+        return name
+    return COLORS.get(str(name).upper(), default)
+
+
+def load_scene_data(path=None):
+    """contents/scripts of a lesson from path (default: $WATERFALL_SCENE_DATA)"""
+    path = path or os.environ.get(DATA_ENV)
+    if not path:
+        return {'contents': [], 'scripts': []}
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return {'contents': data.get('contents') or [], 'scripts': data.get('scripts') or []}
+
+
+class WaterfallTutorialScene(Scene):
+    def __init__(self, contents_data=None, scripts_data=None, **kwargs):
+        super().__init__(**kwargs)
+        if contents_data is None and scripts_data is None:
+            data = load_scene_data()
+            contents_data, scripts_data = data['contents'], data['scripts']
+        self.dynamic_contents_data = contents_data or []
+        self.dynamic_scripts_data = scripts_data or []
+
+    def construct(self):
+        self.camera.background_color = BLACK
+
+        # Layout configuration
+        total_height = 8.0
+        display_ratio = 0.85
+        script_ratio = 0.15
+
+        display_area_height = total_height * display_ratio
+        script_area_height = total_height * script_ratio
+
+        # Create content objects with waterfall effect
+        content_group = VGroup()
+
+        for item_data in self.dynamic_contents_data:
+            item_type = item_data.get("type")
+            if item_type == "text":
+                text_obj = Text(
+                    item_data["value"],
+                    font_size=item_data.get("font_size", 24),
+                    color=resolve_color(item_data.get("color", "WHITE"))
+                )
+                content_group.add(text_obj)
+            elif item_type == "formula":
+                formula_obj = MathTex(
+                    item_data["value"],
+                    color=resolve_color(item_data.get("color", "WHITE"))
+                )
+                content_group.add(formula_obj)
+            elif item_type == "graphic":
+                # Create simple triangle graphic
+                if item_data.get("graphic_type") == "triangle":
+                    triangle = Triangle(color=BLUE, fill_opacity=0.3)
+                    triangle.scale(0.8)
+                    content_group.add(triangle)
+
+        # Arrange with waterfall effect
+        if len(content_group) > 0:
+            content_group.arrange(DOWN, buff=0.5)
+            content_group.scale_to_fit_height(display_area_height * 0.8)
+            content_group.move_to(UP * script_area_height)
+
+            # Create waterfall animation (staggered appearance)
+            for item in content_group:
+                self.play(Write(item), run_time=1.5)
+                self.wait(0.5)
+
+        # Add script area at bottom with current step
+        if self.dynamic_scripts_data:
+            for i, script_text in enumerate(self.dynamic_scripts_data):
+                if i < 3:  # Show first 3 steps in script area
+                    script_display = Text(
+                        script_text,
+                        font_size=16,
+                        color=GRAY
+                    )
+                    script_display.to_edge(DOWN)
+                    script_display.shift(UP * i * 0.3)
+                    self.add(script_display)
+
+                    if i == 0:  # Keep first script visible longer
+                        self.wait(2)